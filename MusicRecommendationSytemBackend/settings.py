@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -155,4 +158,107 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Song lists are written from pre-encoded JSON, see api/renderers.py
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.SongListJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Song catalog served by the api app
+CATALOG_CSV_PATH = BASE_DIR / 'dataset' / 'processes_dataset.csv'
+# Memory-mapped columnar copy written by `manage.py compile_catalog` (or on
+# load, see CATALOG_INGEST). Generated, so git ignores the default location;
+# CATALOG_COMPILED_PATH moves it out of the source tree, e.g. onto a volume
+CATALOG_COMPILED_PATH = Path(os.environ.get('CATALOG_COMPILED_PATH', BASE_DIR / 'dataset' / 'catalog'))
+
+# The favorites alias must be shared by every worker process, or a favorite
+# written through one worker stays invisible to the others until the entry
+# expires. The default file-based cache is shared by the workers of one
+# host; use Redis or Memcached when serving from several hosts. Never point
+# it at a local-memory cache with more than one worker
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'favorites': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'FAVORITES_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'music-recommendation-favorites')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Per-user favorites, cached as catalog positions (see api/favorites.py)
+FAVORITES_CACHE = {
+    'ALIAS': 'favorites',
+    'TIMEOUT': 3600,  # seconds
+}
+
+# Async views (api/async_views.py) run catalog filtering on a thread pool
+ASYNC_VIEWS = {
+    'CPU_WORKERS': 4,
+}
+
+# Worker pool for prompt scoring and taste model work (api/workers.py).
+# MODE 'inline' runs the jobs in the web worker. 'process' sends them to
+# WORKERS extra processes per web worker, each with its own catalog, and
+# pays pickling on every job: only worth it when jobs are heavier than that
+# (very large catalogs, long fits); measure with `manage.py bench_workers`
+WORKER_POOL = {
+    'MODE': 'inline',
+    'WORKERS': 2,
+    'MAX_PENDING': 16,  # jobs in flight before requests get a 503
+    'QUEUE_WAIT': 0.5,  # seconds a request waits for a free slot
+    'TIMEOUT': 10,  # seconds per job before a 504
+    'START_METHOD': 'spawn',
+}
+
+# Streaming CSV ingestion (api/ingest.py). With COMPILE_ON_LOAD a missing or
+# stale compiled catalog is compiled chunk by chunk before it is loaded
+CATALOG_INGEST = {
+    'CHUNK_ROWS': 100000,
+    'COMPILE_ON_LOAD': True,
+}
+
+# Catalog warm-up (api/catalog.py): serving processes (wsgi.py, asgi.py) load
+# the catalog before their first request; anything else (migrate, shell,
+# tests) only loads it if something uses it. CATALOG_WARMUP=0 turns it off,
+# making the first request load it; BACKGROUND starts serving right away
+# while it loads
+CATALOG_WARMUP = {
+    'ENABLED': os.environ.get('CATALOG_WARMUP', '1') != '0',
+    'BACKGROUND': False,
+}
+
+# Hot reload of the catalog (api/reloader.py): serving processes poll the CSV
+# and compiled manifest and swap in a new catalog when they change. SIGHUP or
+# POST /api/catalog/reload/ trigger a check immediately
+CATALOG_RELOAD = {
+    'WATCH': True,
+    'INTERVAL': 5,  # seconds between polls
+    'SIGNAL': True,  # reload on SIGHUP
+}
+
+# Per-stage request timings (api/timing.py): a Server-Timing header on every
+# response and p50/p95/p99 histograms at /api/timing/. Off by default
+TIMING = {
+    'ENABLED': os.environ.get('TIMING_ENABLED', '') == '1',
+}
+
+# How prompts pick songs (api/prompthandler.py): 'score' ranks every song by a
+# weighted soft match on the parsed intent and keeps the top results,
+# 'filter' applies hard filters and keeps the first matches in catalog order.
+# WEIGHTS overrides entries of prompthandler.DEFAULT_WEIGHTS
+PROMPT_SCORING = {
+    'MODE': 'score',
+    'WEIGHTS': {},
+}
+
+# Per-process cache of prompt results, keyed by parsed prompt intent
+PROMPT_CACHE = {
+    'MAX_ENTRIES': 4096,
+    'TIMEOUT': 300,  # seconds
+    'TOP_N': 10,  # row positions kept per intent
 }
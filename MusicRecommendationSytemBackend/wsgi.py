@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MusicRecommendationSytemBackend.settings')
 
 application = get_wsgi_application()
+
+# Only processes that serve requests load the catalog up front and watch
+# for new ones
+from api.catalog import warm_up  # noqa: E402
+from api.reloader import start_reloader  # noqa: E402
+
+warm_up()
+start_reloader()
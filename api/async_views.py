@@ -0,0 +1,160 @@
+"""
+Async variants of the catalog endpoints, for running under ASGI (asgi.py).
+
+DRF's APIView is synchronous, so these are plain Django async views with
+the same token authentication, request bodies and responses as their
+counterparts in ``views.py``. Database access goes through the async ORM and
+cache, and catalog filtering runs on the bounded CPU pool
+(``executor.run_cpu``) or the worker processes (``workers.arun``), so one
+event loop can keep many requests waiting on I/O without blocking on any of
+them.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException
+
+from . import etags, favorites
+from .catalog import aget_catalog
+from .executor import run_cpu
+from .models import Favorite
+from .renderers import SongList, SongListJSONRenderer
+from .views import InvalidQuery, discover_page, favorites_changed
+
+renderer = SongListJSONRenderer()
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json', headers=headers)
+
+
+async def authenticate(request):
+    """The user for an ``Authorization: Token <key>`` header, like DRF's TokenAuthentication."""
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    try:
+        token = await Token.objects.select_related('user').aget(key=auth[1])
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """Token-authenticated async view with JSON in ``request.data`` and JSON out."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await authenticate(request)
+        if user is None:
+            return json_response(
+                {"detail": "Authentication credentials were not provided."},
+                status=status.HTTP_401_UNAUTHORIZED,
+                headers={"WWW-Authenticate": "Token"},
+            )
+        request.user = user
+
+        request.data = request.POST
+        if request.content_type == 'application/json':
+            try:
+                request.data = json.loads(request.body or b'{}')
+            except ValueError as e:
+                return json_response({"detail": f"JSON parse error - {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as e:
+            # e.g. the worker pool being busy, rendered like DRF would
+            headers = {"Retry-After": str(e.wait)} if getattr(e, 'wait', None) else None
+            return json_response({"detail": e.detail}, status=e.status_code, headers=headers)
+
+
+class AsyncPromptView(AsyncAPIView):
+    async def post(self, request):
+        prompt = request.data.get("prompt")
+        if not prompt:
+            return json_response({"error": "No prompt provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+        catalog = await aget_catalog()
+        if catalog is None:
+            return json_response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        from .prompthandler import aprompt_positions
+        positions = await aprompt_positions(catalog, prompt)
+        user_favorites = await favorites.afavorite_positions(request.user.id, catalog)
+        return json_response(SongList(catalog, positions, user_favorites))
+
+
+class AsyncDiscoverView(AsyncAPIView):
+    async def get(self, request):
+        catalog = await aget_catalog()
+        if catalog is None:
+            return json_response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        tag = etags.etag(request, catalog, await favorites.aversion(request.user.id), 'json')
+        if etags.matches(request, tag):
+            return etags.tag(HttpResponse(status=status.HTTP_304_NOT_MODIFIED), tag)
+
+        try:
+            page_positions, page_info = await run_cpu(discover_page, catalog, request.GET)
+        except InvalidQuery as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_favorites = await favorites.afavorite_positions(request.user.id, catalog)
+        return etags.tag(json_response({"songs": SongList(catalog, page_positions, user_favorites), **page_info}), tag)
+
+
+class AsyncFavoritesListView(AsyncAPIView):
+    async def get(self, request):
+        catalog = await aget_catalog()
+        if catalog is None:
+            return json_response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        tag = etags.etag(request, catalog, await favorites.aversion(request.user.id), 'json')
+        if etags.matches(request, tag):
+            return etags.tag(HttpResponse(status=status.HTTP_304_NOT_MODIFIED), tag)
+
+        user_favorites = await favorites.afavorite_positions(request.user.id, catalog)
+        return etags.tag(json_response(SongList(catalog, user_favorites)), tag)
+
+
+class AsyncAddFavoriteView(AsyncAPIView):
+    async def post(self, request):
+        track_id = request.data.get("track_id")
+        track_name = request.data.get("track_name")
+
+        if not all([track_id, track_name]):
+            return json_response(
+                {"error": "song_id and song_name both are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with favorites.write_through():
+            favorite, created = await Favorite.objects.aget_or_create(
+                user=request.user,
+                track_id=track_id,
+                defaults={
+                    'track_name': track_name,
+                }
+            )
+
+        if created:
+            # The taste model update is synchronous ORM work, keep it off the loop
+            await sync_to_async(favorites_changed)(request.user.id, await aget_catalog(), added=[track_id])
+            return json_response({"message": "Favorite added successfully"}, status=status.HTTP_201_CREATED)
+        return json_response({"message": "Item already in favorites"})
+
+
+class AsyncRemoveFavoriteView(AsyncAPIView):
+    async def delete(self, request, track_id):
+        with favorites.write_through():
+            deleted, _ = await Favorite.objects.filter(user=request.user, track_id=track_id).adelete()
+        if not deleted:
+            return json_response({"error": "Favorite item not found"}, status=status.HTTP_404_NOT_FOUND)
+        await sync_to_async(favorites_changed)(request.user.id, await aget_catalog(), removed=[track_id])
+        return json_response({"message": "Favorite removed successfully"})
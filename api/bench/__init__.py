@@ -0,0 +1,85 @@
+"""
+Reproducible benchmarks for the prompt handler, recommender and endpoints.
+
+``run_benchmarks()`` generates a seeded synthetic catalog (see
+``synthetic.py``), installs it in place of the real one, creates a throwaway
+test database and runs the requested suites (see ``suites.py``) against
+them, then puts everything back. The result is a plain dict, written as
+JSON by ``manage.py benchmark`` so runs can be diffed.
+"""
+import platform
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from .. import workers
+from ..catalog import Catalog, install_catalog
+from .suites import SUITES
+from .synthetic import synthetic_songs
+
+
+@contextmanager
+def test_database():
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def installed(catalog):
+    # The synthetic catalog only exists in this process, so jobs run inline
+    previous_catalog = install_catalog(catalog)
+    previous_pool, workers._pool = workers._pool, workers.WorkerPool(mode='inline')
+    try:
+        yield catalog
+    finally:
+        workers._pool = previous_pool
+        install_catalog(previous_catalog)
+
+
+def run_benchmarks(suites=tuple(SUITES), rows=50000, genres_per_track=(0, 3), artists_per_track=(1, 2),
+                   genres=500, seed=0, repeat=100):
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+
+    started = time.perf_counter()
+    songs = synthetic_songs(rows, genres_per_track, artists_per_track, genres=genres, seed=seed)
+    catalog = Catalog.from_frame(songs, source='synthetic')
+    generate_seconds = time.perf_counter() - started
+    catalog.warm()
+
+    results = {}
+    with installed(catalog), test_database():
+        user = User.objects.create_user('bench')
+        token = Token.objects.create(user=user).key
+        for name in suites:
+            for benchmark, summary in SUITES[name](catalog, user, token, repeat=repeat).items():
+                results[f"{name}.{benchmark}"] = summary
+
+    return {
+        "meta": {
+            "rows": rows,
+            "genres_per_track": list(genres_per_track),
+            "artists_per_track": list(artists_per_track),
+            "genres": genres,
+            "seed": seed,
+            "repeat": repeat,
+            "catalog_version": catalog.version,
+            "generate_seconds": round(generate_seconds, 3),
+            "warm_seconds": round(catalog.warm_seconds, 3),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
@@ -0,0 +1,27 @@
+import time
+
+import numpy as np
+
+
+def measure(func, repeat=100, warmup=3):
+    """Call ``func(i)`` ``repeat`` times (after ``warmup`` calls) and summarize."""
+    for i in range(warmup):
+        func(i)
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        started = time.perf_counter()
+        func(i)
+        timings[i] = time.perf_counter() - started
+    return summarize(timings)
+
+
+def summarize(timings):
+    timings = np.asarray(timings) * 1000
+    return {
+        "calls": int(len(timings)),
+        "mean_ms": round(float(timings.mean()), 4),
+        "min_ms": round(float(timings.min()), 4),
+        "p50_ms": round(float(np.percentile(timings, 50)), 4),
+        "p95_ms": round(float(np.percentile(timings, 95)), 4),
+        "p99_ms": round(float(np.percentile(timings, 99)), 4),
+    }
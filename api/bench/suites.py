@@ -0,0 +1,112 @@
+"""
+Benchmark suites. Each takes the installed catalog, a benchmark user and
+its API token, and returns ``{name: summary}`` (see ``measure.summarize``).
+"""
+import numpy as np
+from django.test import Client
+
+from .. import favorites, recommender
+from ..models import Favorite, TasteProfile
+from ..prompthandler import (
+    KEYWORDS, calculate_dynamic_thresholds, filter_songs_by_prompt, get_fuzzy_genre_match,
+    get_recommendations_from_favorites,
+)
+from ..result_cache import prompt_cache
+from .measure import measure
+
+FAVORITES = 50
+
+
+def sample_prompts(catalog, count=64, seed=0):
+    """Prompts mixing moods, tempos, genres, artists and years from the catalog."""
+    rng = np.random.default_rng(seed)
+    engine = catalog.prompt_engine
+    keywords = [k for words in KEYWORDS.values() for k in words]
+    prompts = []
+    for i in range(count):
+        parts = [str(rng.choice(keywords))]
+        if engine.all_genres and i % 2 == 0:
+            parts.append(str(rng.choice(engine.all_genres)))
+        if engine.all_artists and i % 3 == 0:
+            parts.append(f"by {rng.choice(engine.all_artists)}")
+        if i % 4 == 0:
+            parts.append(str(rng.integers(1960, 2024)))
+        prompts.append(' '.join(parts))
+    return prompts
+
+
+def setup_favorites(user, catalog, seed=0):
+    """Give ``user`` ``FAVORITES`` random favorites; returns their positions."""
+    rng = np.random.default_rng(seed)
+    positions = np.sort(rng.choice(len(catalog), size=min(FAVORITES, len(catalog)), replace=False))
+    track_ids = catalog.store['track_id'].decode(positions).tolist()
+    Favorite.objects.filter(user=user).delete()
+    Favorite.objects.bulk_create([Favorite(user=user, track_id=t, track_name='bench') for t in track_ids])
+    TasteProfile.objects.filter(user=user).delete()
+    favorites.refresh(user.id, catalog)
+    return positions
+
+
+def micro(catalog, user, token=None, repeat=100):
+    engine = catalog.prompt_engine
+    prompts = sample_prompts(catalog)
+    favorites = setup_favorites(user, catalog)
+
+    def prompt(i):
+        return prompts[i % len(prompts)]
+
+    return {
+        "calculate_dynamic_thresholds": measure(
+            lambda i: calculate_dynamic_thresholds(catalog.songs), max(repeat // 10, 5)
+        ),
+        "get_fuzzy_genre_match": measure(lambda i: get_fuzzy_genre_match(prompt(i), engine.genre_matcher), repeat),
+        "filter_songs_by_prompt": measure(lambda i: filter_songs_by_prompt(prompt(i), engine), repeat),
+        "score_prompt": measure(lambda i: engine.top(engine.parse(prompt(i)), 10), repeat),
+        "taste_model_fit": measure(lambda i: recommender.fit_state(catalog, favorites), max(repeat // 10, 5)),
+        "get_recommendations_from_favorites": measure(
+            lambda i: get_recommendations_from_favorites(user.id, catalog, 10), repeat
+        ),
+    }
+
+
+def endpoints(catalog, user, token, repeat=100):
+    client = Client(headers={'Authorization': f'Token {token}'})
+    prompts = sample_prompts(catalog, seed=1)
+    setup_favorites(user, catalog, seed=1)
+    engine = catalog.prompt_engine
+    genres = engine.all_genres or ['pop']
+    artists = engine.all_artists or ['']
+    discover = [
+        '/api/discover/',
+        '/api/discover/?filter=new&page=5',
+        '/api/discover/?genre={genre}',
+        '/api/discover/?artist={artist}&filter=popular',
+        '/api/discover/?year=2015&genre={genre}&page_size=50',
+    ]
+
+    def check(response):
+        assert response.status_code == 200, (response.status_code, response.content[:200])
+
+    def post_prompt(i):
+        check(client.post('/api/prompt/', {'prompt': prompts[i % len(prompts)]}, content_type='application/json'))
+
+    def get_discover(i):
+        path = discover[i % len(discover)].format(genre=genres[i % len(genres)], artist=artists[i % len(artists)])
+        check(client.get(path))
+
+    def get_favorites(i):
+        check(client.get('/api/favorites/'))
+
+    # Start from a cold prompt cache so runs are comparable
+    prompt_cache().clear()
+    return {
+        "prompt": measure(post_prompt, repeat),
+        "discover": measure(get_discover, repeat),
+        "favorites": measure(get_favorites, repeat),
+    }
+
+
+SUITES = {
+    'micro': micro,
+    'endpoints': endpoints,
+}
@@ -0,0 +1,90 @@
+"""
+Synthetic song catalogs in the schema of ``processes_dataset.csv``.
+
+Everything is drawn from a seeded generator, so the same arguments always
+give the same catalog.
+"""
+import string
+
+import numpy as np
+import pandas as pd
+
+BASE_GENRES = [
+    'pop', 'rock', 'lo-fi', 'lofi beats', 'indie pop', 'hip hop', 'dance pop', 'jazz', 'classical',
+    'k-pop', 'metal', 'death metal', 'edm', 'house', 'deep house', 'r&b', 'soul', 'country', 'folk',
+    'chillhop', 'trap', 'drum and bass', 'ambient', 'blues', 'reggaeton', 'punk', 'techno', 'gospel',
+]
+GENRE_PREFIXES = ['alt', 'modern', 'classic', 'dark', 'uk', 'latin', 'indie', 'progressive', 'melodic', 'experimental']
+WORDS = ['love', 'night', 'blue', 'fire', 'dream', 'city', 'heart', 'rain', 'gold', 'wild', 'sky', 'ocean']
+COVER_64 = 'https://i.scdn.co/image/ab67616d00004851'
+COVER_640 = 'https://i.scdn.co/image/ab67616d0000b273'
+
+
+def parse_range(value):
+    """``"2"`` -> (2, 2), ``"0-3"`` -> (0, 3)."""
+    low, _, high = str(value).partition('-')
+    return int(low), int(high or low)
+
+
+def _ids(rng, count, length):
+    alphabet = np.array(list(string.ascii_letters + string.digits))
+    return [''.join(chars) for chars in rng.choice(alphabet, size=(count, length))]
+
+
+def _pick(rng, vocabulary, rows, per_track):
+    # One vectorized draw; a rare repeat within a row is dropped, so a track
+    # can end up one value short of its count
+    low, high = per_track
+    counts = rng.integers(low, high + 1, rows).tolist()
+    drawn = rng.integers(0, len(vocabulary), (rows, max(high, 1))).tolist()
+    return [[vocabulary[v] for v in dict.fromkeys(row[:k])] for row, k in zip(drawn, counts)]
+
+
+def genre_names(count, seed=0):
+    rng = np.random.default_rng(seed)
+    names = list(BASE_GENRES)
+    while len(names) < count:
+        names.append(f"{rng.choice(GENRE_PREFIXES)} {rng.choice(BASE_GENRES)} {len(names)}")
+    return names[:count]
+
+
+def synthetic_songs(rows=50000, genres_per_track=(0, 3), artists_per_track=(1, 2), genres=500, artists=None, seed=0):
+    """
+    A catalog DataFrame as ``read_songs_csv`` returns it (list columns as
+    lists). ``*_per_track`` are inclusive ``(low, high)`` ranges.
+    """
+    rng = np.random.default_rng(seed)
+    genre_vocabulary = genre_names(genres, seed)
+    artists = artists or max(rows // 6, 10)
+    artist_vocabulary = [
+        f"{' '.join(rng.choice(WORDS, size=rng.integers(1, 3)).tolist()).title()} {i}" for i in range(artists)
+    ]
+    albums = _ids(rng, max(rows // 8, 1), 10)
+    covers = _ids(rng, len(albums), 24)
+    album = rng.integers(0, len(albums), rows)
+
+    return pd.DataFrame({
+        'track_id': _ids(rng, rows, 22),
+        'track_name': [' '.join(words) for words in rng.choice(WORDS, size=(rows, 2)).tolist()],
+        'artist_names': _pick(rng, artist_vocabulary, rows, artists_per_track),
+        'album_name': [albums[a] for a in album],
+        'year': rng.integers(1960, 2024, rows),
+        'duration_ms': rng.integers(90000, 400000, rows),
+        'album_cover_64x64': [COVER_64 + covers[a] for a in album],
+        'album_cover_640x640': [COVER_640 + covers[a] for a in album],
+        'popularity': rng.integers(0, 100, rows),
+        'acousticness': rng.random(rows),
+        'energy': rng.random(rows),
+        'valence': rng.random(rows),
+        'tempo': rng.normal(120, 25, rows),
+        'danceability': rng.random(rows),
+        'genres': _pick(rng, genre_vocabulary, rows, genres_per_track),
+    })
+
+
+def write_csv(songs, path):
+    """Write ``songs`` the way the dataset CSV stores it (lists stringified)."""
+    songs = songs.copy()
+    for column in ('artist_names', 'genres'):
+        songs[column] = songs[column].map(str)
+    songs.to_csv(path, index=False)
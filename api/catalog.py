@@ -0,0 +1,408 @@
+"""
+In-process registry for the song catalog.
+
+The catalog is loaded once per process and shared by every view: up front
+in processes that serve requests (``warm_up()``), otherwise by the first
+``get_catalog()``. Reading it after that is a single module attribute read,
+so requests never copy or unpickle the DataFrame. Reloads build a new ``Catalog`` and swap it in
+with ``install_catalog()``; requests that already hold the old instance keep
+using it until they finish.
+
+When a compiled catalog (see ``manage.py compile_catalog``) that matches the
+CSV exists it is memory-mapped instead of parsing the CSV. If it is missing
+or older than the CSV, loading compiles it first, streaming the CSV in chunks
+(``CATALOG_INGEST``), so the whole dataset is never held in memory.
+"""
+import ast
+import hashlib
+import logging
+import os
+import threading
+import time
+from functools import cached_property
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .columnar import ColumnStore, open_store, read_manifest
+from .indexes import InvertedIndex, SortOrder, TrackLookup
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Columns stored in the CSV as stringified Python lists
+LIST_COLUMNS = ['artist_names', 'genres']
+
+
+class Catalog:
+    """An immutable snapshot of the song dataset plus its load statistics.
+
+    ``store`` holds the columnar arrays (possibly memory-mapped); ``songs`` is
+    the equivalent DataFrame, built from the store on first use. Derived
+    structures are cached properties listed in ``DERIVED``; ``warm()`` builds
+    them all up front so no request pays for them.
+    """
+
+    DERIVED = ('genre_index', 'artist_index', 'year_index', 'sort_orders', 'track_positions', 'features', 'similarity_index', 'prompt_engine', 'song_fragments', 'facets')
+
+    def __init__(self, store, songs=None, source=None, version=None, load_seconds=0.0, mapped=False):
+        self.store = store
+        if songs is not None:
+            self.__dict__['songs'] = songs
+        self.source = source
+        self.version = version
+        self.load_seconds = load_seconds
+        self.mapped = mapped
+        self.loaded_at = time.time()
+        self.warm_seconds = None
+        self._memory_bytes = None
+
+    @classmethod
+    def from_frame(cls, songs, **kwargs):
+        # Only the compact store is kept; ``songs`` is rebuilt from it if needed
+        kwargs.setdefault('version', frame_version(songs))
+        return cls(ColumnStore.from_frame(songs, LIST_COLUMNS), **kwargs)
+
+    def __len__(self):
+        return len(self.store)
+
+    @cached_property
+    def songs(self):
+        _pandas()
+        return self.store.to_frame()
+
+    def _saved_index(self, name, build):
+        # Compiled catalogs carry their indexes, see api.ingest
+        index = InvertedIndex.from_store(self.store, name)
+        return index if index is not None else build()
+
+    @cached_property
+    def genre_index(self):
+        return self._saved_index('genre_index', lambda: InvertedIndex.from_list_column(self.store['genres']))
+
+    @cached_property
+    def artist_index(self):
+        return self._saved_index('artist_index', lambda: InvertedIndex.from_list_column(self.store['artist_names']))
+
+    @cached_property
+    def year_index(self):
+        return self._saved_index('year_index', lambda: InvertedIndex.from_values(self.store['year']))
+
+    @cached_property
+    def sort_orders(self):
+        # The orderings DiscoverView supports; anything else is catalog order
+        return {
+            'popular': SortOrder.descending(self.store['popularity']),
+            'new': SortOrder.descending(self.store['year']),
+            'natural': SortOrder.natural(len(self)),
+        }
+
+    @cached_property
+    def track_positions(self):
+        lookup = TrackLookup.from_store(self.store, 'track_lookup', 'track_id')
+        return lookup if lookup is not None else TrackLookup.build(self.store['track_id'])
+
+    def positions(self, track_ids):
+        """Sorted row positions of the given track ids; unknown ids are skipped."""
+        found = self.track_positions.find(track_ids)
+        return np.unique(found[found >= 0])
+
+    @cached_property
+    def features(self):
+        from .recommender import FeatureMatrix
+        return FeatureMatrix(self.store)
+
+    @cached_property
+    def similarity_index(self):
+        from .similarity import SimilarityIndex
+        return SimilarityIndex(self.features)
+
+    @cached_property
+    def prompt_engine(self):
+        from .prompthandler import PromptEngine
+        return PromptEngine(self)
+
+    @cached_property
+    def song_fragments(self):
+        from .renderers import SongFragments
+        return SongFragments.from_store(self.store)
+
+    @cached_property
+    def facets(self):
+        from .facets import Facets
+        return Facets(self)
+
+    def warm(self):
+        started = time.perf_counter()
+        for name in self.DERIVED:
+            getattr(self, name)
+        self.warm_seconds = time.perf_counter() - started
+        return self
+
+    def derived_bytes(self):
+        """Bytes of each derived structure built so far, by name."""
+        sizes = {}
+        for name in self.DERIVED:
+            value = self.__dict__.get(name)
+            if name == 'sort_orders' and value is not None:
+                sizes[name] = sum(order.order.nbytes + order.rank.nbytes for order in value.values())
+            elif hasattr(value, 'nbytes'):
+                sizes[name] = int(value.nbytes)
+        return sizes
+
+    @property
+    def frame_bytes(self):
+        """Bytes of the ``songs`` DataFrame, 0 until something builds it."""
+        # deep=True walks every Python object, so only do it once
+        if self._memory_bytes is None:
+            if 'songs' not in self.__dict__:
+                return 0
+            self._memory_bytes = int(self.songs.memory_usage(index=True, deep=True).sum())
+        return self._memory_bytes
+
+    @property
+    def memory_bytes(self):
+        """
+        Everything the catalog holds: the store's columns (memory-mapped and
+        shared between processes when compiled), the derived structures and
+        the DataFrame if built.
+        """
+        return self.store.nbytes + sum(self.derived_bytes().values()) + self.frame_bytes
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "source": str(self.source) if self.source else None,
+            "rows": len(self),
+            "load_seconds": round(self.load_seconds, 4),
+            "warm_seconds": round(self.warm_seconds, 4) if self.warm_seconds is not None else None,
+            "mapped": self.mapped,
+            # Columns only
+            "store_bytes": self.store.nbytes,
+            "derived_bytes": self.derived_bytes(),
+            "frame_bytes": self.frame_bytes,
+            "memory_bytes": self.memory_bytes,
+            "loaded_at": self.loaded_at,
+        }
+
+
+_catalog = None
+_install_lock = threading.Lock()
+_load_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+
+def dataset_path():
+    return settings.CATALOG_CSV_PATH
+
+
+def compiled_path():
+    return settings.CATALOG_COMPILED_PATH
+
+
+def file_version(path):
+    # Cheap and identical in every worker as long as the file is unchanged
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def _pandas():
+    # pandas is slow to import and only needed for the CSV and DataFrames, so
+    # it is imported on first use. Copy-on-write makes every slice of the
+    # shared catalog a lazy view: filtering never copies the underlying
+    # columns and writes on a derived frame can never leak back into the
+    # catalog other requests are reading.
+    import pandas as pd
+    pd.set_option('mode.copy_on_write', True)
+    return pd
+
+
+def frame_version(songs):
+    pd = _pandas()
+    digest = pd.util.hash_pandas_object(songs['track_id'], index=False).sum()
+    return hashlib.sha1(f"{len(songs)}:{digest}".encode()).hexdigest()[:12]
+
+
+def _parse_list(value):
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str) and value.startswith('['):
+        return ast.literal_eval(value)
+    return []
+
+
+def read_songs_csv(path):
+    songs = _pandas().read_csv(path)
+    songs = songs.drop_duplicates(subset=['track_id']).reset_index(drop=True)
+    for column in LIST_COLUMNS:
+        if column in songs:
+            songs[column] = songs[column].map(_parse_list)
+    return songs
+
+
+def get_catalog():
+    """
+    Return the installed catalog. O(1), allocation free once loaded; the
+    first call loads it unless ``warm_up()`` already has. None if it cannot
+    be loaded.
+    """
+    catalog = _catalog
+    if catalog is None:
+        catalog = _load_on_demand()
+    return catalog
+
+
+def installed_catalog():
+    """The installed catalog, or None; unlike ``get_catalog()`` never loads it."""
+    return _catalog
+
+
+async def aget_catalog():
+    """``get_catalog()`` for async views: a first load runs off the event loop."""
+    catalog = _catalog
+    if catalog is None:
+        catalog = await sync_to_async(_load_on_demand, thread_sensitive=False)()
+    return catalog
+
+
+def _load_on_demand():
+    try:
+        return load_catalog()
+    except Exception:
+        # Views answer "Dataset is not available"; the next call tries again
+        logger.exception("Could not load the catalog")
+        return None
+
+
+def warm_up():
+    """
+    Load and warm the catalog before the first request, as configured by
+    ``CATALOG_WARMUP``. Called by the processes that serve requests
+    (wsgi.py, asgi.py) rather than at import, so management commands, the
+    shell and tests never load it unless they use it. Returns the loading
+    thread when warming up in the background.
+    """
+    options = getattr(settings, 'CATALOG_WARMUP', {})
+    if not options.get('ENABLED', True):
+        return None
+    if options.get('BACKGROUND', False):
+        # Requests arriving before it is done wait for it in load_catalog()
+        thread = threading.Thread(target=_load_on_demand, name='catalog-warmup', daemon=True)
+        thread.start()
+        return thread
+    load_catalog()
+    return None
+
+
+def install_catalog(catalog):
+    """Atomically replace the shared catalog and return the previous one."""
+    global _catalog
+    with _install_lock:
+        previous, _catalog = _catalog, catalog
+    return previous
+
+
+def _usable_manifest(compiled, csv_path):
+    """Return the compiled manifest if it is up to date with the CSV."""
+    try:
+        manifest = read_manifest(compiled)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(csv_path) or manifest.get("source_version") == file_version(csv_path):
+        return manifest
+    return None
+
+
+def _compile_on_load(compiled, path):
+    """Compile ``path`` into ``compiled``, once across processes; returns the manifest or None."""
+    from .ingest import compile_csv
+
+    try:
+        with open(f"{os.fspath(compiled)}.lock", 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have compiled it while we waited
+            manifest = _usable_manifest(compiled, path)
+            if manifest is None:
+                stats = compile_csv(path, compiled)
+                logger.info("Compiled %d tracks from %s in %.1fs", stats["rows"], path, stats["seconds"])
+                manifest = _usable_manifest(compiled, path)
+            return manifest
+    except OSError:
+        # e.g. a read-only deployment; fall back to reading the CSV
+        logger.exception("Could not compile the catalog to %s", compiled)
+        return None
+
+
+def build_catalog(path=None, compiled=None):
+    """Build a catalog without installing it, preferring the compiled copy."""
+    path = path or dataset_path()
+    compiled = compiled or compiled_path()
+    started = time.perf_counter()
+    manifest = _usable_manifest(compiled, path) if compiled else None
+    if manifest is None and compiled and os.path.exists(path) \
+            and getattr(settings, 'CATALOG_INGEST', {}).get('COMPILE_ON_LOAD', False):
+        manifest = _compile_on_load(compiled, path)
+    if manifest is not None:
+        return Catalog(
+            open_store(compiled, manifest),
+            source=compiled,
+            version=manifest["source_version"],
+            load_seconds=time.perf_counter() - started,
+            mapped=True,
+        )
+    songs = read_songs_csv(path)
+    return Catalog.from_frame(
+        songs,
+        source=path,
+        version=file_version(path),
+        load_seconds=time.perf_counter() - started,
+    )
+
+
+def load_catalog(path=None, force=False):
+    """Load the dataset from disk and install it, unless one is already installed."""
+    with _load_lock:
+        if _catalog is not None and not force:
+            return _catalog
+        catalog = build_catalog(path).warm()
+        install_catalog(catalog)
+        return catalog
+
+
+def source_signature(path=None, compiled=None):
+    """What a reload would load from: the CSV and compiled manifest versions."""
+    path = path or dataset_path()
+    compiled = compiled or compiled_path()
+    csv_version = file_version(path) if os.path.exists(path) else None
+    try:
+        compiled_version = read_manifest(compiled).get("source_version") if compiled else None
+    except (OSError, ValueError):
+        compiled_version = None
+    return csv_version, compiled_version
+
+
+def reload_catalog(path=None, on_built=None):
+    """
+    Build and warm a fresh catalog off the request path, then swap it in.
+
+    Returns ``(catalog, reloaded)``; nothing is installed when the new build
+    has the version already being served. ``on_built(catalog)`` runs after
+    the build and before the swap (the worker pool restarts its processes
+    there). Requests holding the old catalog finish on it.
+    """
+    with _reload_lock:
+        catalog = build_catalog(path).warm()
+        current = _catalog
+        if current is not None and current.version == catalog.version:
+            return current, False
+        if on_built is not None:
+            on_built(catalog)
+        install_catalog(catalog)
+        return catalog, True
@@ -0,0 +1,674 @@
+"""
+Columnar, memory-mappable representation of the song catalog.
+
+A compiled catalog is a directory holding a ``manifest.json`` and one raw
+little-endian array file per buffer:
+
+* numeric columns are stored in the smallest dtype that holds them
+  (``compact_numeric``: int16/int32, floats as float32),
+* string columns are dictionary encoded (int32 codes + a UTF-8 dictionary);
+  a prefix shared by every value of a dictionary (e.g. the cover image host
+  and path) is kept once in the manifest, and columns whose dictionaries are
+  then identical (the two cover sizes) share the same files,
+* multi-valued columns (``artist_names``, ``genres``) are stored CSR style as
+  an int64 ``offsets`` array of length ``rows + 1`` and int32 ``values``
+  codes into a dictionary.
+
+Derived arrays (e.g. the standardized feature matrix) can ride along as
+``extras`` with JSON metadata in ``meta``.
+
+Everything is opened with ``np.memmap`` in read-only mode so all workers on a
+host share the same page-cache pages instead of parsing the CSV each. Only
+converting from and to DataFrames needs pandas, which is imported then.
+
+``write_store()`` writes a store that is already in memory; ``StoreWriter``
+builds one chunk by chunk (see ``api.ingest``) so only the current chunk and
+the string dictionaries are ever held in memory.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+FORMAT_VERSION = 2
+MANIFEST = 'manifest.json'
+# Shorter shared prefixes are not worth stripping
+MIN_PREFIX = 8
+
+
+def compact_numeric(values):
+    """``values`` as int16/int32 when their range fits, floats as float32."""
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        if not len(values):
+            return values.astype(np.int16)
+        low, high = values.min(), values.max()
+        for dtype in (np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return values.astype(dtype)
+        return values
+    if values.dtype.kind == 'f' and values.dtype.itemsize > 4:
+        return values.astype(np.float32)
+    return values
+
+
+def common_prefix(strings):
+    """The prefix of every string in ``strings``, or '' when too short to bother."""
+    if len(strings) < 2:
+        return ''
+    prefix = os.path.commonprefix(list(strings))
+    return prefix if len(prefix.encode('utf-8')) >= MIN_PREFIX else ''
+
+
+class StringDictionary:
+    """
+    UTF-8 strings stored back to back after a common ``prefix``, decoded
+    lazily on first use.
+    """
+
+    # Below this many codes per dictionary entry, ``take`` decodes just those
+    SPARSE_FRACTION = 1 / 16
+
+    def __init__(self, data, offsets, prefix=''):
+        self.data = data
+        self.offsets = offsets
+        self.prefix = prefix
+        self._decoded = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_strings(cls, strings, prefix=''):
+        width = len(prefix)
+        encoded = [s[width:].encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets, prefix)
+
+    @property
+    def strings(self):
+        # Object array with a trailing None so that code -1 decodes to None
+        if self._decoded is None:
+            decoded = np.empty(len(self) + 1, dtype=object)
+            decoded[:-1] = self.decode_range(0, len(self))
+            decoded[-1] = None
+            self._decoded = decoded
+        return self._decoded
+
+    def decode_range(self, start, stop):
+        """The strings ``start:stop`` as a list, without caching them."""
+        bounds = np.asarray(self.offsets[start:stop + 1]).tolist()
+        if not bounds:
+            return []
+        base = bounds[0]
+        blob = np.asarray(self.data[base:bounds[-1]]).tobytes()
+        prefix = self.prefix
+        return [prefix + blob[bounds[i] - base:bounds[i + 1] - base].decode('utf-8') for i in range(len(bounds) - 1)]
+
+    def take(self, codes):
+        """
+        Strings of ``codes`` (-1 gives None). A few codes of a big dictionary
+        are decoded one by one rather than decoding (and keeping) it all.
+        """
+        codes = np.asarray(codes)
+        if self._decoded is not None or len(codes) >= len(self) * self.SPARSE_FRACTION:
+            return self.strings[codes]
+        taken = np.empty(len(codes), dtype=object)
+        taken[:] = [None if code < 0 else self.decode_range(code, code + 1)[0] for code in codes.tolist()]
+        return taken
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+
+class StringColumn:
+    def __init__(self, codes, dictionary):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def decode(self, positions=None):
+        if positions is None:
+            return self.dictionary.strings[self.codes]
+        return self.dictionary.take(self.codes[positions])
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.dictionary.nbytes
+
+
+class ListColumn:
+    def __init__(self, offsets, values, dictionary):
+        self.offsets = offsets
+        self.values = values
+        self.dictionary = dictionary
+
+    def row(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.dictionary.take(self.values[start:end]).tolist()
+
+    def decode(self, positions=None):
+        if positions is not None:
+            return [self.row(p) for p in positions]
+        flat = self.dictionary.strings[self.values].tolist()
+        bounds = self.offsets.tolist()
+        return [flat[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.values.nbytes + self.dictionary.nbytes
+
+
+class ColumnStore:
+    """Named columns of equal length, numeric columns as plain ndarrays."""
+
+    def __init__(self, columns, rows, extras=None, meta=None):
+        self.columns = columns
+        self.rows = rows
+        self.extras = extras or {}
+        self.meta = meta or {}
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def nbytes(self):
+        # Buffers shared between columns (see write_store) count once
+        buffers = {id(b): b for b in self.buffers()}
+        return sum(b.nbytes for b in buffers.values())
+
+    def buffers(self, name=None):
+        """The arrays holding column ``name`` (default: every column and extra)."""
+        names = self.columns if name is None else [name]
+        for column in (self.columns[n] for n in names):
+            if isinstance(column, ListColumn):
+                yield from (column.offsets, column.values, column.dictionary.data, column.dictionary.offsets)
+            elif isinstance(column, StringColumn):
+                yield from (column.codes, column.dictionary.data, column.dictionary.offsets)
+            else:
+                yield column
+        if name is None:
+            yield from self.extras.values()
+
+    @classmethod
+    def from_frame(cls, songs, list_columns=()):
+        columns = {}
+        for name in songs.columns:
+            series = songs[name]
+            if name in list_columns:
+                columns[name] = _encode_lists(series)
+            elif _is_numeric(series):
+                columns[name] = compact_numeric(series.to_numpy())
+            else:
+                columns[name] = _encode_strings(series)
+        return cls(columns, len(songs))
+
+    def to_frame(self):
+        import pandas as pd
+
+        data = {}
+        for name, column in self.columns.items():
+            if isinstance(column, ListColumn):
+                data[name] = column.decode()
+            elif isinstance(column, StringColumn):
+                # Categorical: one Python string per distinct value, not per row
+                data[name] = pd.Categorical.from_codes(
+                    np.asarray(column.codes), column.dictionary.strings[:-1], validate=False)
+            else:
+                data[name] = column
+        return pd.DataFrame(data)
+
+
+def _is_numeric(series):
+    # Ints, floats (nullable ones too), not bools, strings or categoricals
+    return getattr(series.dtype, 'kind', 'O') in 'iufc'
+
+
+def _encode_strings(series):
+    codes, uniques = series.factorize()
+    strings = [str(u) for u in uniques]
+    return StringColumn(codes.astype(np.int32), StringDictionary.from_strings(strings, common_prefix(strings)))
+
+
+def _encode_lists(series):
+    import pandas as pd
+
+    lengths = series.map(len).to_numpy()
+    offsets = np.zeros(len(series) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = pd.Series([item for items in series for item in items], dtype=object)
+    codes, uniques = pd.factorize(flat)
+    strings = [str(u) for u in uniques]
+    return ListColumn(offsets, codes.astype(np.int32), StringDictionary.from_strings(strings, common_prefix(strings)))
+
+
+# Reading and writing
+
+def _write_array(directory, name, array):
+    array = np.ascontiguousarray(array)
+    if array.dtype.byteorder == '>':
+        array = array.astype(array.dtype.newbyteorder('<'))
+    filename = f"{name}.bin"
+    array.tofile(os.path.join(directory, filename))
+    spec = {"file": filename, "dtype": array.dtype.str, "length": int(len(array))}
+    if array.ndim > 1:
+        spec["shape"] = list(array.shape)
+    return spec
+
+
+def _read_array(directory, spec):
+    dtype = np.dtype(spec["dtype"])
+    shape = tuple(spec.get("shape", (spec["length"],)))
+    if spec["length"] == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(os.path.join(directory, spec["file"]), dtype=dtype, mode='r', shape=shape)
+
+
+def _write_dictionary(directory, name, dictionary, written):
+    # ``written``: digest -> files of the dictionaries written so far, so
+    # identical ones (once their prefixes are stripped) are stored once
+    digest = _digest(dictionary.data, dictionary.offsets)
+    if digest not in written:
+        written[digest] = {
+            "data": _write_array(directory, f"{name}.dict", dictionary.data),
+            "offsets": _write_array(directory, f"{name}.dict_offsets", dictionary.offsets),
+        }
+    return {**written[digest], "prefix": dictionary.prefix}
+
+
+def _digest(*arrays):
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(str(len(array)).encode())
+        digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+def _read_dictionary(directory, spec, read):
+    return StringDictionary(read(spec["data"]), read(spec["offsets"]), spec.get("prefix", ''))
+
+
+def _staging(path):
+    staging = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    return staging
+
+
+def _publish(staging, path, manifest):
+    with open(os.path.join(staging, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    # Swap directories; workers that still map the old files keep valid pages
+    previous = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, previous)
+    try:
+        os.rename(staging, path)
+    except OSError:
+        # Another process published at the same moment, keep theirs
+        shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+def write_store(store, path, source_version=None):
+    """Write ``store`` to ``path``, replacing any previous compiled catalog."""
+    path = os.fspath(path)
+    staging = _staging(path)
+
+    columns = []
+    dictionaries = {}
+    for name, column in store.columns.items():
+        if isinstance(column, ListColumn):
+            spec = {
+                "kind": "list",
+                "offsets": _write_array(staging, f"{name}.offsets", column.offsets),
+                "values": _write_array(staging, f"{name}.values", column.values),
+                "dictionary": _write_dictionary(staging, name, column.dictionary, dictionaries),
+            }
+        elif isinstance(column, StringColumn):
+            spec = {
+                "kind": "string",
+                "codes": _write_array(staging, f"{name}.codes", column.codes),
+                "dictionary": _write_dictionary(staging, name, column.dictionary, dictionaries),
+            }
+        else:
+            spec = {"kind": "numeric", "data": _write_array(staging, name, column)}
+        columns.append({"name": name, **spec})
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "rows": store.rows,
+        "source_version": source_version,
+        "columns": columns,
+        "extras": {name: _write_array(staging, f"extra.{name}", array) for name, array in store.extras.items()},
+        "meta": store.meta,
+    }
+    return _publish(staging, path, manifest)
+
+
+# Writing chunk by chunk
+
+class ArrayWriter:
+    """
+    An array file written by appending chunks. Chunks whose dtypes differ
+    (e.g. an int column that turns out to have NaNs further down) are promoted
+    to their common dtype when the writer is finished.
+    """
+
+    BLOCK = 1 << 20
+
+    def __init__(self, directory, name, dtype=np.int64):
+        self.directory = directory
+        self.filename = f"{name}.bin"
+        # dtype used if nothing is ever appended
+        self.dtype = np.dtype(dtype)
+        self.segments = []
+        self.length = 0
+        self.shape = None
+        self.spec = None
+        self._file = open(os.path.join(directory, self.filename), 'wb')
+
+    def append(self, array):
+        array = np.ascontiguousarray(array)
+        if array.dtype.byteorder == '>':
+            array = array.astype(array.dtype.newbyteorder('<'))
+        self.shape = array.shape[1:]
+        self._file.write(array.tobytes())
+        self.segments.append((array.dtype, len(array)))
+        self.length += len(array)
+
+    def finish(self):
+        if self.spec is None:
+            self._file.close()
+            dtypes = {dtype for dtype, _ in self.segments} or {self.dtype}
+            dtype = np.result_type(*dtypes)
+            if len(dtypes) > 1:
+                self._promote(dtype)
+            self.spec = {"file": self.filename, "dtype": dtype.str, "length": int(self.length)}
+            if self.shape:
+                self.spec["shape"] = [int(self.length), *self.shape]
+        return self.spec
+
+    def _promote(self, dtype):
+        # Rewrite segment by segment, a block at a time
+        source = os.path.join(self.directory, self.filename)
+        target = f"{source}.promoted"
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            for segment_dtype, length in self.segments:
+                width = segment_dtype.itemsize * int(np.prod(self.shape, dtype=np.int64))
+                for start in range(0, length, self.BLOCK):
+                    count = min(self.BLOCK, length - start)
+                    block = np.frombuffer(src.read(count * width), dtype=segment_dtype)
+                    dst.write(block.astype(dtype).tobytes())
+        os.replace(target, source)
+
+
+class DictionaryEncoder:
+    """
+    Assigns dictionary codes in order of first appearance, like
+    ``pd.factorize``. The common prefix of the values is tracked as they
+    arrive and stripped from the data file at the end.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.codes = {}
+        self.prefix = None
+        self.data = ArrayWriter(directory, f"{name}.dict", dtype=np.uint8)
+        self.offsets = ArrayWriter(directory, f"{name}.dict_offsets")
+        self.offsets.append(np.zeros(1, dtype=np.int64))
+        self._end = 0
+        self.spec = None
+
+    def encode(self, values):
+        """int32 codes of ``values`` (a Series); missing values get -1."""
+        codes, uniques = values.factorize()
+        mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+        new = []
+        for i, value in enumerate(uniques):
+            value = str(value)
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.codes)
+                self.prefix = value if self.prefix is None else os.path.commonprefix([self.prefix, value])
+                new.append(value.encode('utf-8'))
+            mapping[i] = code
+        mapping[-1] = -1
+        if new:
+            self.data.append(np.frombuffer(b''.join(new), dtype=np.uint8))
+            ends = self._end + np.cumsum([len(b) for b in new], dtype=np.int64)
+            self.offsets.append(ends)
+            self._end = int(ends[-1])
+        return mapping[codes]
+
+    def finish(self):
+        if self.spec is None:
+            self.spec = {"data": self.data.finish(), "offsets": self.offsets.finish(), "prefix": ''}
+            prefix = self.prefix if len(self.codes) > 1 else ''
+            if len((prefix or '').encode('utf-8')) >= MIN_PREFIX:
+                self._strip(len(prefix.encode('utf-8')))
+                self.spec["prefix"] = prefix
+        return self.spec
+
+    def _strip(self, width):
+        # Rewrite the data without the first ``width`` bytes of each string,
+        # a block of strings at a time, and shift the offsets to match
+        offsets = np.memmap(os.path.join(self.directory, self.offsets.filename), dtype=np.int64, mode='r+')
+        source = os.path.join(self.directory, self.data.filename)
+        data = np.memmap(source, dtype=np.uint8, mode='r')
+        target = f"{source}.stripped"
+        block = max(ArrayWriter.BLOCK // width, 1)
+        with open(target, 'wb') as dst:
+            for start in range(0, len(offsets) - 1, block):
+                bounds = np.asarray(offsets[start:start + block + 1])
+                keep = np.ones(int(bounds[-1] - bounds[0]), dtype=bool)
+                keep[((bounds[:-1] - bounds[0])[:, None] + np.arange(width)).ravel()] = False
+                dst.write(np.asarray(data[bounds[0]:bounds[-1]])[keep].tobytes())
+        del data
+        os.replace(target, source)
+        offsets -= width * np.arange(len(offsets), dtype=np.int64)
+        offsets.flush()
+        self.spec["data"]["length"] = int(offsets[-1])
+        del offsets
+
+
+class StoreWriter:
+    """
+    Writes a compiled catalog to ``path`` from DataFrame chunks.
+
+    Column kinds are taken from the first chunk (same rules as
+    ``ColumnStore.from_frame``). After the last chunk, ``open()`` maps the
+    columns written so far so derived extras can be computed from them in
+    blocks, and ``close()`` publishes the catalog.
+    """
+
+    def __init__(self, path, list_columns=()):
+        self.path = os.fspath(path)
+        self.list_columns = list_columns
+        self.staging = _staging(self.path)
+        self.rows = 0
+        self.columns = None
+        self.extras = {}
+        self.meta = {}
+
+    def _start(self, chunk):
+        self.columns = {}
+        for name in chunk.columns:
+            series = chunk[name]
+            if name in self.list_columns:
+                offsets = ArrayWriter(self.staging, f"{name}.offsets")
+                offsets.append(np.zeros(1, dtype=np.int64))
+                self.columns[name] = ("list", {
+                    "offsets": offsets,
+                    "values": ArrayWriter(self.staging, f"{name}.values"),
+                    "dictionary": DictionaryEncoder(self.staging, name),
+                    "end": 0,
+                })
+            elif _is_numeric(series):
+                self.columns[name] = ("numeric", {"data": ArrayWriter(self.staging, name)})
+            else:
+                self.columns[name] = ("string", {
+                    "codes": ArrayWriter(self.staging, f"{name}.codes"),
+                    "dictionary": DictionaryEncoder(self.staging, name),
+                })
+
+    def kind(self, name):
+        """How column ``name`` is being written: "list", "string" or "numeric"."""
+        return self.columns[name][0]
+
+    def append(self, chunk):
+        """Append the rows of ``chunk`` (list columns already parsed into lists)."""
+        import pandas as pd
+
+        if self.columns is None:
+            self._start(chunk)
+        for name, (kind, parts) in self.columns.items():
+            series = chunk[name]
+            if kind == "list":
+                lengths = series.map(len).to_numpy()
+                parts["offsets"].append(parts["end"] + np.cumsum(lengths, dtype=np.int64))
+                parts["end"] += int(lengths.sum())
+                flat = pd.Series([item for items in series for item in items], dtype=object)
+                parts["values"].append(parts["dictionary"].encode(flat))
+            elif kind == "numeric":
+                if not _is_numeric(series):
+                    raise ValueError(f"Column {name!r} is numeric in the first chunk but not at row {self.rows}")
+                # Chunks compacted to different dtypes are promoted when finished
+                parts["data"].append(compact_numeric(series.to_numpy()))
+            else:
+                parts["codes"].append(parts["dictionary"].encode(series))
+        self.rows += len(chunk)
+
+    def _column_specs(self):
+        specs = []
+        dictionaries = {}
+        for name, (kind, parts) in (self.columns or {}).items():
+            if kind == "list":
+                spec = {
+                    "offsets": parts["offsets"].finish(),
+                    "values": parts["values"].finish(),
+                    "dictionary": self._dictionary(parts["dictionary"], dictionaries),
+                }
+            elif kind == "string":
+                spec = {"codes": parts["codes"].finish(), "dictionary": self._dictionary(parts["dictionary"], dictionaries)}
+            else:
+                spec = {"data": parts["data"].finish()}
+            specs.append({"name": name, "kind": kind, **spec})
+        return specs
+
+    def _dictionary(self, encoder, written):
+        # Like write_store, identical dictionaries share one set of files
+        spec = encoder.finish()
+        read = _reader(self.staging)
+        digest = _digest(read(spec["data"]), read(spec["offsets"]))
+        if digest not in written:
+            written[digest] = spec
+            return spec
+        for part in ("data", "offsets"):
+            os.remove(os.path.join(self.staging, spec[part]["file"]))
+        return {**spec, "data": written[digest]["data"], "offsets": written[digest]["offsets"]}
+
+    def open(self):
+        """Finish the columns and memory-map them as a ``ColumnStore``."""
+        self.columns = self._column_specs()
+        return open_store(self.staging, {"format": FORMAT_VERSION, "rows": self.rows, "columns": self.columns})
+
+    def add_extra(self, name, array):
+        self.extras[name] = _write_array(self.staging, f"extra.{name}", array)
+
+    def allocate_extra(self, name, shape, dtype):
+        """A writable memmap for extra ``name``, to be filled in place."""
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        dtype = np.dtype(dtype).newbyteorder('<')
+        filename = f"extra.{name}.bin"
+        spec = {"file": filename, "dtype": dtype.str, "length": int(shape[0])}
+        if len(shape) > 1:
+            spec["shape"] = list(shape)
+        self.extras[name] = spec
+        if not shape[0]:
+            open(os.path.join(self.staging, filename), 'wb').close()
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.staging, filename), dtype=dtype, mode='w+', shape=shape)
+
+    def add_extra_writer(self, name, dtype=np.int64):
+        """An ``ArrayWriter`` for extra ``name``, for extras built chunk by chunk."""
+        writer = ArrayWriter(self.staging, f"extra.{name}", dtype)
+        self.extras[name] = writer
+        return writer
+
+    def _manifest(self, source_version):
+        return {
+            "format": FORMAT_VERSION,
+            "rows": self.rows,
+            "source_version": source_version,
+            "columns": self.columns,
+            "extras": {
+                name: spec.finish() if isinstance(spec, ArrayWriter) else spec for name, spec in self.extras.items()
+            },
+            "meta": self.meta,
+        }
+
+    def close(self, source_version=None):
+        if not isinstance(self.columns, list):
+            self.columns = self._column_specs()
+        return _publish(self.staging, self.path, self._manifest(source_version))
+
+    def abort(self):
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compiled catalog format {manifest.get('format')!r}")
+    return manifest
+
+
+def open_store(path, manifest=None):
+    """Memory-map a compiled catalog. Nothing is read until it is accessed."""
+    path = os.fspath(path)
+    manifest = manifest or read_manifest(path)
+    read = _reader(path)
+    columns = {}
+    for spec in manifest["columns"]:
+        kind = spec["kind"]
+        if kind == "list":
+            columns[spec["name"]] = ListColumn(
+                read(spec["offsets"]),
+                read(spec["values"]),
+                _read_dictionary(path, spec["dictionary"], read),
+            )
+        elif kind == "string":
+            columns[spec["name"]] = StringColumn(
+                read(spec["codes"]),
+                _read_dictionary(path, spec["dictionary"], read),
+            )
+        else:
+            columns[spec["name"]] = read(spec["data"])
+    extras = {name: read(spec) for name, spec in manifest.get("extras", {}).items()}
+    return ColumnStore(columns, manifest["rows"], extras, manifest.get("meta"))
+
+
+def _reader(path):
+    # Files shared by several columns are mapped once
+    mapped = {}
+
+    def read(spec):
+        if spec["file"] not in mapped:
+            mapped[spec["file"]] = _read_array(path, spec)
+        return mapped[spec["file"]]
+    return read
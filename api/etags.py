@@ -0,0 +1,37 @@
+"""
+Conditional GETs for the per-user catalog endpoints.
+
+A response from Discover or the favorites list only depends on the catalog
+version, the user's favorites (``favorites.version()``), the query string
+and the response format, so its ETag is a hash of those. Views compute it
+before doing any work, and a matching ``If-None-Match`` gets a bodiless 304
+straight away: no filtering, serialization or favorites lookup, just a cache
+read for the favorites version.
+"""
+import hashlib
+
+from django.utils.http import parse_etags
+
+# Clients must revalidate; the response is per user
+CACHE_CONTROL = 'private, no-cache'
+
+
+def etag(request, catalog, favorites_version, variant=''):
+    params = sorted((key, values) for key, values in request.GET.lists())
+    key = repr((request.path, variant, catalog.version, request.user.id, favorites_version, params))
+    return f'"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+
+def matches(request, tag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = parse_etags(header)
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return '*' in tags or tag.removeprefix('W/') in (t.removeprefix('W/') for t in tags)
+
+
+def tag(response, tag):
+    response['ETag'] = tag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
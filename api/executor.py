@@ -0,0 +1,40 @@
+"""
+Bounded thread pool for CPU work done on behalf of async views.
+
+Async views must not run catalog filtering on the event loop, so they hand it
+to ``run_cpu()``. The pool has ``ASYNC_VIEWS['CPU_WORKERS']`` threads; work
+beyond that queues instead of piling more threads onto the GIL. numpy and
+RapidFuzz release the GIL for their heavy loops, so a few threads still help.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executor = None
+_lock = threading.Lock()
+
+
+def cpu_workers():
+    return getattr(settings, 'ASYNC_VIEWS', {}).get('CPU_WORKERS') or min(4, os.cpu_count() or 1)
+
+
+def cpu_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=cpu_workers(), thread_name_prefix='catalog-cpu')
+    return _executor
+
+
+async def run_cpu(func, *args, **kwargs):
+    """Run ``func(*args, **kwargs)`` on the CPU pool and await its result."""
+    loop = asyncio.get_running_loop()
+    # run_in_executor doesn't carry context variables over (request timings)
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor(), functools.partial(context.run, func, *args, **kwargs))
@@ -0,0 +1,91 @@
+"""
+Facet counts for Discover: how many of the rows matching a filter have each
+year, genre and artist.
+
+Counts come from ``np.bincount`` over term ids: the CSR ``offsets``/``values``
+of the list columns are gathered for the matching rows and mapped to index
+terms through the index's ``value_terms``; years use a per-row term id array.
+With no filter the counts are just the index's posting list lengths.
+"""
+import numpy as np
+
+from .columnar import ListColumn
+
+
+class Facet:
+    """Counts per term of one inverted index, for any set of rows."""
+
+    def __init__(self, index, column):
+        self.index = index
+        self.column = column
+        self.all_counts = index.counts()
+        if isinstance(column, ListColumn):
+            self.value_terms = index.value_terms
+            # Rows listing a term twice (after normalization) must count once;
+            # only pay for deduplicating if the catalog has such rows
+            self.has_repeats = int(self.all_counts.sum()) != len(column.values)
+            # Display name of a term: the first dictionary value mapping to it
+            _, first = np.unique(self.value_terms, return_index=True)
+            self.labels = column.dictionary.strings[first]
+        else:
+            self.row_terms = np.searchsorted(np.asarray(index.terms), np.asarray(column)).astype(np.int32)
+            # Object labels so a missing year comes out as null
+            self.labels = np.array([None if term != term else term for term in index.terms], dtype=object)
+
+    def counts(self, positions=None):
+        if positions is None:
+            return self.all_counts
+        if not isinstance(self.column, ListColumn):
+            return np.bincount(self.row_terms[positions], minlength=len(self.index))
+
+        offsets = self.column.offsets
+        starts = np.asarray(offsets[positions])
+        lengths = np.asarray(offsets[positions + 1]) - starts
+        # Indexes of every value of the selected rows, without a Python loop
+        ends = np.cumsum(lengths)
+        gather = np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+        term_ids = self.value_terms[self.column.values[gather]].astype(np.int64)
+        if self.has_repeats:
+            rows = np.repeat(np.arange(len(positions), dtype=np.int64), lengths)
+            term_ids = np.unique(rows * len(self.index) + term_ids) % len(self.index)
+        return np.bincount(term_ids, minlength=len(self.index))
+
+    def top(self, counts, limit=None):
+        """``[{"value", "count"}]`` of the terms with results, most results first."""
+        present = np.flatnonzero(counts)
+        if limit is not None and len(present) > limit:
+            # Only the limit largest get sorted; ties at the cut by term order
+            kth = -np.partition(-counts[present], limit - 1)[limit - 1]
+            above = present[counts[present] > kth]
+            present = np.concatenate([above, present[counts[present] == kth][:limit - len(above)]])
+        present = present[np.lexsort((present, -counts[present]))]
+        return [{"value": label, "count": count} for label, count in
+                zip(self.labels[present].tolist(), counts[present].tolist())]
+
+    def ordered(self, counts):
+        """``[{"value", "count"}]`` of the terms with results, in term order."""
+        present = np.flatnonzero(counts)
+        return [{"value": label, "count": count} for label, count in
+                zip(self.labels[present].tolist(), counts[present].tolist())]
+
+
+class Facets:
+    """The Discover facets of one catalog (``Catalog.facets``)."""
+
+    def __init__(self, catalog):
+        store = catalog.store
+        self.rows = len(catalog)
+        self.years = Facet(catalog.year_index, store['year'])
+        self.genres = Facet(catalog.genre_index, store['genres'])
+        self.artists = Facet(catalog.artist_index, store['artist_names'])
+
+    def counts(self, positions, limit=20):
+        if positions is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+        year_counts = self.years.counts(positions)
+        return {
+            "total_songs": self.rows if positions is None else len(positions),
+            "years": self.years.ordered(year_counts)[::-1],
+            "genres": self.genres.top(self.genres.counts(positions), limit),
+            "artists": self.artists.top(self.artists.counts(positions), limit),
+        }
@@ -0,0 +1,165 @@
+"""
+Per-user favorites cache.
+
+A user's favorites are kept as the sorted catalog row positions of their
+tracks, in a Django cache (the ``FAVORITES_CACHE['ALIAS']`` backend) so the
+``is_favorite`` overlay and the favorites listing need no database query on
+a hit. Small sets are stored as int32 positions, large ones as a bitmap over
+the catalog, whichever is smaller.
+
+Entries are keyed by catalog version, so a reloaded catalog simply misses.
+Views that change favorites call ``refresh()`` after the write (write
+through). The backend must be shared by every worker process (the default
+is a file-based cache, Redis or Memcached across hosts) so they all see the
+new set; a local-memory backend is only correct with a single worker. ``afavorite_positions()``/``arefresh()`` are the
+async ORM/cache equivalents for the async views.
+
+Each user also has a favorites version, a random token replaced by
+``bump_version()`` on every change, which conditional GETs (``api.etags``)
+use to tell whether a cached response is still current. It lives in the
+same shared cache, so every worker computes the same ETag for a user.
+
+Changes made any other way (the admin, the shell, cascade deletes) reach
+``changed()`` through the ``Favorite`` signal receivers in ``api.signals``,
+which drops the cached set and bumps the version once the transaction
+commits. Views wrap their writes in ``write_through()`` so the receivers
+leave those to them.
+"""
+import contextvars
+import secrets
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .catalog import installed_catalog
+from .models import Favorite
+from .timing import stage
+
+POSITIONS, BITMAP = 'p', 'b'
+
+_written_through = contextvars.ContextVar('favorites_written_through', default=False)
+
+
+def _options():
+    return getattr(settings, 'FAVORITES_CACHE', {})
+
+
+def _cache():
+    return caches[_options().get('ALIAS', 'default')]
+
+
+def _key(user_id, catalog):
+    return f"favorites:{user_id}:{catalog.version}"
+
+
+def encode(positions, rows):
+    positions = np.asarray(positions, dtype=np.int32)
+    if len(positions) * 4 <= (rows + 7) // 8:
+        return POSITIONS, positions.tobytes()
+    mask = np.zeros(rows, dtype=bool)
+    mask[positions] = True
+    return BITMAP, np.packbits(mask).tobytes()
+
+
+def decode(entry, rows):
+    kind, data = entry
+    if kind == POSITIONS:
+        positions = np.frombuffer(data, dtype=np.int32)
+    else:
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=rows)
+        positions = np.flatnonzero(bits).astype(np.int32)
+    positions.flags.writeable = False
+    return positions
+
+
+def _load(user_id, catalog):
+    return catalog.positions(Favorite.objects.filter(user_id=user_id).values_list('track_id', flat=True))
+
+
+def refresh(user_id, catalog):
+    """Re-read ``user_id``'s favorites from the database and cache them."""
+    entry = encode(_load(user_id, catalog), len(catalog))
+    _cache().set(_key(user_id, catalog), entry, _options().get('TIMEOUT', 3600))
+    return decode(entry, len(catalog))
+
+
+def favorite_positions(user_id, catalog):
+    """Sorted, read-only catalog positions of ``user_id``'s favorites."""
+    with stage('favorites'):
+        entry = _cache().get(_key(user_id, catalog))
+        if entry is None:
+            return refresh(user_id, catalog)
+        return decode(entry, len(catalog))
+
+
+async def arefresh(user_id, catalog):
+    track_ids = [t async for t in Favorite.objects.filter(user_id=user_id).values_list('track_id', flat=True)]
+    entry = encode(catalog.positions(track_ids), len(catalog))
+    await _cache().aset(_key(user_id, catalog), entry, _options().get('TIMEOUT', 3600))
+    return decode(entry, len(catalog))
+
+
+async def afavorite_positions(user_id, catalog):
+    with stage('favorites'):
+        entry = await _cache().aget(_key(user_id, catalog))
+        if entry is None:
+            return await arefresh(user_id, catalog)
+        return decode(entry, len(catalog))
+
+
+def invalidate(user_id, catalog):
+    _cache().delete(_key(user_id, catalog))
+
+
+@contextmanager
+def write_through():
+    """Favorite changes made inside are refreshed and versioned by the caller."""
+    token = _written_through.set(True)
+    try:
+        yield
+    finally:
+        _written_through.reset(token)
+
+
+def written_through():
+    return _written_through.get()
+
+
+def changed(user_id):
+    """Drop ``user_id``'s cached favorites and give them a new version."""
+    catalog = installed_catalog()
+    if catalog is not None:
+        invalidate(user_id, catalog)
+    bump_version(user_id)
+
+
+def _version_key(user_id):
+    # Not scoped to the catalog version, the ETag includes that separately
+    return f"favorites-version:{user_id}"
+
+
+def version(user_id):
+    """Token that changes whenever ``user_id``'s favorites change."""
+    cache = _cache()
+    token = cache.get(_version_key(user_id))
+    if token is None:
+        # First use or evicted: any new token is safe, it just invalidates
+        # what clients have. add() so concurrent requests agree on one
+        cache.add(_version_key(user_id), secrets.token_hex(8), None)
+        token = cache.get(_version_key(user_id))
+    return token
+
+
+def bump_version(user_id):
+    _cache().set(_version_key(user_id), secrets.token_hex(8), None)
+
+
+async def aversion(user_id):
+    cache = _cache()
+    token = await cache.aget(_version_key(user_id))
+    if token is None:
+        await cache.aadd(_version_key(user_id), secrets.token_hex(8), None)
+        token = await cache.aget(_version_key(user_id))
+    return token
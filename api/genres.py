@@ -0,0 +1,94 @@
+"""
+Fuzzy genre matching for prompts, backed by RapidFuzz.
+
+Genre names are normalized once when the matcher is built. A prompt is split
+into contiguous token n-grams. For each n-gram, candidates are pruned through
+a padded trigram index (a genre must share at least a third of the n-gram's
+trigrams) and by length, and the survivors are scored in one vectorized
+``process.cdist`` call. Each pair is scored twice: once with
+spaces removed (so "lofi" matches "lo-fi") and once with sorted tokens (so
+"pop dance" matches "dance pop"). The better score counts.
+"""
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from .matcher import tokenize
+
+MAX_NGRAM = 4
+# Fraction of an n-gram's trigrams a genre must share to be scored at all
+MIN_SHARED_GRAMS = 1 / 3
+
+
+def _grams(key):
+    padded = f"##{key}##"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class GenreMatcher:
+    def __init__(self, genres):
+        self.genres = list(genres)
+        tokens = [tokenize(g) for g in self.genres]
+        self.compact = ["".join(t) for t in tokens]
+        self.sorted = [" ".join(sorted(t)) for t in tokens]
+        self.max_tokens = min(MAX_NGRAM, max((len(t) for t in tokens), default=1))
+
+        index = {}
+        for genre_id, key in enumerate(self.compact):
+            for gram in _grams(key):
+                index.setdefault(gram, []).append(genre_id)
+        self.index = {gram: np.array(ids, dtype=np.int32) for gram, ids in index.items()}
+        self._compact = np.array(self.compact, dtype=object)
+        self._sorted = np.array(self.sorted, dtype=object)
+        self.lengths = np.array([len(k) for k in self.compact], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.genres)
+
+    def _phrases(self, prompt):
+        tokens = tokenize(prompt)
+        phrases = set()
+        for n in range(1, self.max_tokens + 1):
+            for i in range(len(tokens) - n + 1):
+                phrases.add(tuple(tokens[i:i + n]))
+        return sorted(phrases)
+
+    def candidates(self, compact, score_cutoff):
+        """Genre ids worth scoring against the compact n-gram ``compact``."""
+        grams = _grams(compact)
+        hits = [self.index[g] for g in grams if g in self.index]
+        if not hits:
+            return np.empty(0, dtype=np.int32)
+        ids, shared = np.unique(np.concatenate(hits), return_counts=True)
+        ids = ids[shared >= len(grams) * MIN_SHARED_GRAMS]
+        # ratio >= c is impossible once the lengths differ by more than this;
+        # the slack covers the spaces the sorted-token keys add back
+        c = score_cutoff / 100
+        lengths = self.lengths[ids]
+        low, high = len(compact) * c / (2 - c) - MAX_NGRAM, len(compact) * (2 - c) / c + MAX_NGRAM
+        return ids[(lengths >= low) & (lengths <= high)]
+
+    def match(self, prompt, limit=5, score_cutoff=80):
+        """Top ``limit`` genres for ``prompt`` as ``(genre, score)``, best first."""
+        if not self.genres:
+            return []
+        scores = {}
+        for phrase in self._phrases(prompt):
+            compact = "".join(phrase)
+            ids = self.candidates(compact, score_cutoff)
+            if not len(ids):
+                continue
+            best = process.cdist([compact], self._compact[ids], scorer=fuzz.ratio,
+                                 score_cutoff=score_cutoff, dtype=np.float32)[0]
+            np.maximum(best, process.cdist([" ".join(sorted(phrase))], self._sorted[ids], scorer=fuzz.ratio,
+                                           score_cutoff=score_cutoff, dtype=np.float32)[0], out=best)
+            for genre_id, score in zip(ids[best >= score_cutoff].tolist(), best[best >= score_cutoff].tolist()):
+                if score > scores.get(genre_id, 0):
+                    scores[genre_id] = score
+        # Highest score first, then the more specific (longer) genre, then
+        # catalog dictionary order
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -self.lengths[item[0]], item[0]))
+        return [(self.genres[genre_id], score) for genre_id, score in ranked[:limit]]
+
+    def best(self, prompt, score_cutoff=80):
+        matches = self.match(prompt, limit=1, score_cutoff=score_cutoff)
+        return matches[0][0] if matches else None
@@ -0,0 +1,340 @@
+"""
+Inverted indexes and precomputed sort orders over catalog columns.
+
+Each index maps a normalized (casefolded) term to the sorted row positions
+that contain it, stored CSR style: ``postings[offsets[t]:offsets[t + 1]]``
+are the rows for term id ``t``. Filters become lookups plus sorted-array
+intersections instead of a Python ``.apply`` over every row.
+
+Indexes are built with a two-pass counting sort over blocks of rows, so a
+compiled catalog's indexes can be built from its memory-mapped columns into
+memory-mapped postings (see ``api.ingest``) and saved alongside it.
+
+``SortOrder`` holds a precomputed ordering of all rows so result sets can be
+ordered and paginated without sorting the catalog per request.
+
+``TrackLookup`` finds the rows of track ids from sorted id hashes.
+"""
+import hashlib
+
+import numpy as np
+
+from .columnar import StringDictionary
+
+EMPTY = np.empty(0, dtype=np.int32)
+# Bump when the way terms are normalized or postings are laid out changes
+INDEX_FORMAT = 1
+LOOKUP_FORMAT = 2
+
+
+def normalize(term):
+    return term.casefold().strip()
+
+
+def intersect(*position_arrays):
+    """Intersect sorted, unique position arrays; ``None`` means "all rows"."""
+    result = None
+    for positions in sorted((p for p in position_arrays if p is not None), key=len):
+        result = positions if result is None else np.intersect1d(result, positions, assume_unique=True)
+        if not len(result):
+            break
+    return result
+
+
+def _counting_sort(blocks, n_terms, allocate=None):
+    """
+    CSR ``offsets`` and int32 ``postings`` from ``blocks()``, which yields
+    ``(term_ids, rows)`` sorted by term then row, blocks in row order. One
+    pass counts, the second scatters, so only a block is held at a time.
+    """
+    counts = np.zeros(n_terms, dtype=np.int64)
+    for term_ids, _ in blocks():
+        counts += np.bincount(term_ids, minlength=n_terms)
+    offsets = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    postings = (allocate or np.empty)(int(offsets[-1]), np.int32)
+    cursor = offsets[:-1].copy()
+    for term_ids, rows in blocks():
+        # Rank of each entry within its term's run in this block
+        within = np.arange(len(term_ids)) - np.searchsorted(term_ids, term_ids)
+        postings[cursor[term_ids] + within] = rows
+        cursor += np.bincount(term_ids, minlength=n_terms)
+    return offsets, postings
+
+
+def _reusable(blocks, block_rows):
+    # A single block is cheaper to keep than to compute twice
+    if block_rows is None:
+        computed = list(blocks())
+        return lambda: computed
+    return blocks
+
+
+class InvertedIndex:
+    def __init__(self, terms, offsets, postings, value_terms=None):
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        # Dictionary code of the source column -> term id
+        self.value_terms = value_terms
+        self._term_ids = {term: i for i, term in enumerate(terms)}
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return self.term_id(term) is not None
+
+    def term_id(self, term):
+        return self._term_ids.get(normalize(term) if isinstance(term, str) else term)
+
+    def positions(self, term_id):
+        return self.postings[self.offsets[term_id]:self.offsets[term_id + 1]]
+
+    def get(self, term):
+        """Sorted row positions containing ``term`` (a read-only view)."""
+        term_id = self.term_id(term)
+        if term_id is None:
+            return EMPTY
+        return self.positions(term_id)
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.postings.nbytes
+
+    @classmethod
+    def from_list_column(cls, column, block_rows=None, allocate=None):
+        """
+        Index a multi-valued column. ``block_rows`` bounds the rows processed
+        at once; ``allocate(length, dtype)`` creates the postings array.
+        """
+        rows = len(column.offsets) - 1
+        strings = column.dictionary.strings[:-1]
+        terms, value_terms = np.unique(
+            np.array([normalize(s) for s in strings], dtype=object), return_inverse=True
+        )
+        value_terms = value_terms.astype(np.int32)
+        step = block_rows or max(rows, 1)
+
+        def blocks():
+            for start in range(0, rows, step):
+                stop = min(start + step, rows)
+                bounds = np.asarray(column.offsets[start:stop + 1])
+                row_ids = np.repeat(np.arange(start, stop, dtype=np.int64), np.diff(bounds))
+                term_ids = value_terms[np.asarray(column.values[bounds[0]:bounds[-1]])].astype(np.int64)
+                # One (term, row) key per value; np.unique sorts by term then
+                # row and drops rows listing a term twice after normalization
+                keys = np.unique(term_ids * rows + row_ids)
+                yield keys // rows, keys % rows
+
+        offsets, postings = _counting_sort(_reusable(blocks, block_rows), len(terms), allocate)
+        return cls(terms.tolist(), offsets, postings, value_terms)
+
+    @classmethod
+    def from_values(cls, values, block_rows=None, allocate=None):
+        """Index a single-valued column (e.g. ``year``) by its distinct values."""
+        values = np.asarray(values)
+        step = block_rows or max(len(values), 1)
+        starts = range(0, len(values), step)
+        terms = np.unique(np.concatenate([np.unique(values[s:s + step]) for s in starts] or [values[:0]]))
+
+        def blocks():
+            for start in starts:
+                term_ids = np.searchsorted(terms, values[start:start + step])
+                order = np.argsort(term_ids, kind='stable')
+                yield term_ids[order], order + start
+
+        offsets, postings = _counting_sort(_reusable(blocks, block_rows), len(terms), allocate)
+        return cls(terms.tolist(), offsets, postings)
+
+    def save(self, writer, name):
+        """Persist as extras ``name.*`` of a ``columnar.StoreWriter``."""
+        if f"{name}.postings" not in writer.extras:
+            writer.add_extra(f"{name}.postings", self.postings)
+        writer.add_extra(f"{name}.offsets", self.offsets)
+        strings = bool(self.terms) and isinstance(self.terms[0], str)
+        if strings:
+            dictionary = StringDictionary.from_strings(self.terms)
+            writer.add_extra(f"{name}.terms", dictionary.data)
+            writer.add_extra(f"{name}.term_offsets", dictionary.offsets)
+        else:
+            writer.add_extra(f"{name}.terms", np.asarray(self.terms))
+        if self.value_terms is not None:
+            writer.add_extra(f"{name}.value_terms", self.value_terms)
+        writer.meta.setdefault('indexes', {})[name] = {
+            'format': INDEX_FORMAT,
+            'terms': 'strings' if strings else 'values',
+        }
+
+    @classmethod
+    def from_store(cls, store, name):
+        """The index saved as ``name`` with a compiled catalog, or None."""
+        meta = store.meta.get('indexes', {}).get(name)
+        if meta is None or meta.get('format') != INDEX_FORMAT:
+            return None
+        extras = store.extras
+        if meta['terms'] == 'strings':
+            terms = StringDictionary(extras[f"{name}.terms"], extras[f"{name}.term_offsets"]).strings[:-1].tolist()
+        else:
+            terms = extras[f"{name}.terms"].tolist()
+        return cls(terms, extras[f"{name}.offsets"], extras[f"{name}.postings"], extras.get(f"{name}.value_terms"))
+
+
+class SortOrder:
+    """
+    A permutation of all rows (``order``) and its inverse (``rank``).
+
+    Pages of the unfiltered catalog are slices of ``order``; a filtered
+    result set is put in order by its ranks, so nothing is ever sorted by
+    the underlying column on the request path.
+    """
+
+    # Above this share of the catalog a mask scan beats sorting by rank
+    DENSE_FRACTION = 1 / 16
+
+    def __init__(self, order):
+        self.order = np.asarray(order, dtype=np.int32)
+        self.rank = np.empty_like(self.order)
+        self.rank[self.order] = np.arange(len(self.order), dtype=np.int32)
+        self.order.flags.writeable = False
+        self.rank.flags.writeable = False
+
+    def __len__(self):
+        return len(self.order)
+
+    @classmethod
+    def natural(cls, rows):
+        return cls(np.arange(rows))
+
+    @classmethod
+    def descending(cls, values):
+        # Stable, so ties keep catalog order
+        return cls(np.argsort(-np.asarray(values), kind='stable'))
+
+    def arrange(self, positions):
+        """``positions`` (or every row when ``None``) in this order."""
+        if positions is None:
+            return self.order
+        if len(positions) > len(self) * self.DENSE_FRACTION:
+            mask = np.zeros(len(self), dtype=bool)
+            mask[positions] = True
+            return self.order[mask[self.order]]
+        return positions[np.argsort(self.rank[positions], kind='stable')]
+
+    def page(self, positions, offset, limit, after=None):
+        """
+        One page of ``positions`` in this order.
+
+        ``after`` is a keyset cursor (the rank of the last row already seen);
+        when given it replaces ``offset``. Returns ``(rows, total, last_rank)``
+        where ``last_rank`` is the cursor for the next page, or ``None``.
+        """
+        if positions is None:
+            total = len(self)
+            start = after + 1 if after is not None else offset
+            rows = self.order[start:start + limit]
+            end = start + len(rows)
+        else:
+            ordered = self.arrange(positions)
+            total = len(ordered)
+            start = offset
+            if after is not None:
+                start = int(np.searchsorted(self.rank[ordered], after, side='right'))
+            rows = ordered[start:start + limit]
+            end = start + len(rows)
+        last_rank = int(self.rank[rows[-1]]) if len(rows) and end < total else None
+        return rows, total, last_rank
+
+
+class TrackLookup:
+    """
+    Row of each track id: the 64-bit hashes of the ids, sorted, and the row
+    of each hash. Both are plain arrays (memory-mapped in compiled catalogs)
+    where a dict would hold a Python string per row in every worker. Hash
+    hits are confirmed against the id column. ``in``, ``[]`` and ``get``
+    work like the dict.
+    """
+
+    def __init__(self, column, hashes, rows):
+        self.column = column
+        self.hashes = hashes
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def hash(track_ids):
+        digests = b''.join(hashlib.blake2b(str(t).encode('utf-8'), digest_size=8).digest() for t in track_ids)
+        return np.frombuffer(digests, dtype='<u8')
+
+    @classmethod
+    def build(cls, column, block_rows=None):
+        """Lookup over a dictionary encoded ``column``, hashing ``block_rows`` ids at a time."""
+        dictionary = column.dictionary
+        step = block_rows or max(len(dictionary), 1)
+        value_hashes = np.concatenate([np.empty(0, dtype=np.uint64)] + [
+            cls.hash(dictionary.decode_range(start, min(start + step, len(dictionary))))
+            for start in range(0, len(dictionary), step)
+        ])
+        codes = np.asarray(column.codes)
+        rows = np.flatnonzero(codes >= 0).astype(np.int32)
+        hashes = value_hashes[codes[rows]]
+        order = np.argsort(hashes, kind='stable')
+        return cls(column, hashes[order], rows[order])
+
+    def find(self, track_ids):
+        """Row of each of ``track_ids`` (int64 array), -1 where unknown."""
+        track_ids = list(track_ids)
+        found = np.full(len(track_ids), -1, dtype=np.int64)
+        if not track_ids or not len(self.hashes):
+            return found
+        hashes = self.hash(track_ids)
+        starts = np.searchsorted(self.hashes, hashes, 'left')
+        ends = np.searchsorted(self.hashes, hashes, 'right')
+        hit = np.flatnonzero(ends > starts)
+        rows = self.rows[starts[hit]].astype(np.int64)
+        confirmed = self.column.decode(rows) == np.array(track_ids, dtype=object)[hit]
+        found[hit[confirmed]] = rows[confirmed]
+        # On a 64-bit hash collision the id may be another row with that hash
+        for i in hit[~confirmed & (ends[hit] - starts[hit] > 1)].tolist():
+            candidates = np.asarray(self.rows[starts[i]:ends[i]])
+            matches = candidates[self.column.decode(candidates) == track_ids[i]]
+            if len(matches):
+                found[i] = matches.min()
+        return found
+
+    def get(self, track_id, default=None):
+        row = int(self.find([track_id])[0])
+        return default if row < 0 else row
+
+    def __contains__(self, track_id):
+        return self.get(track_id) is not None
+
+    def __getitem__(self, track_id):
+        row = self.get(track_id)
+        if row is None:
+            raise KeyError(track_id)
+        return row
+
+    @property
+    def nbytes(self):
+        return self.hashes.nbytes + self.rows.nbytes
+
+    def save(self, writer, name):
+        """Persist as extras ``name.*`` of a ``columnar.StoreWriter``."""
+        writer.add_extra(f"{name}.hashes", self.hashes)
+        writer.add_extra(f"{name}.rows", self.rows)
+        writer.meta.setdefault('lookups', {})[name] = {'format': LOOKUP_FORMAT}
+
+    @classmethod
+    def from_store(cls, store, name, column):
+        """The lookup saved as ``name`` with a compiled catalog, or None."""
+        meta = store.meta.get('lookups', {}).get(name)
+        if meta is None or meta.get('format') != LOOKUP_FORMAT:
+            return None
+        return cls(store[column], store.extras[f"{name}.hashes"], store.extras[f"{name}.rows"])
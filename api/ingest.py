@@ -0,0 +1,146 @@
+"""
+Streaming compilation of the song CSV into a compiled catalog.
+
+``compile_csv()`` reads the CSV ``chunk_rows`` rows at a time and appends
+each chunk to a ``columnar.StoreWriter``: duplicate ``track_id`` rows are
+dropped against every id seen so far (first one wins, as with
+``drop_duplicates``), list columns are parsed per chunk, and the pre-encoded
+song JSON is built per chunk (without the cover URLs, which are rendered
+from their dictionaries). Once all rows are on disk the feature matrix
+and the genre/artist/year indexes are computed from the memory-mapped
+columns in blocks of the same size and written next to them, as is the
+track id lookup.
+
+Peak memory is a chunk, plus 8 bytes per distinct track id (``SeenIds``)
+and the string dictionaries, which grow with the number of distinct values
+rather than rows. The result is identical to compiling an in-memory
+``read_songs_csv()`` frame, up to float rounding in the feature matrix.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .catalog import LIST_COLUMNS, _parse_list, file_version
+from .columnar import ColumnStore, StoreWriter
+from .indexes import InvertedIndex, TrackLookup
+from .recommender import FeatureMatrix
+from .renderers import SHARED_FIELDS, SongFragments
+
+# Indexes saved with the catalog: name -> (column, kind)
+INDEXES = {
+    'genre_index': ('genres', 'list'),
+    'artist_index': ('artist_names', 'list'),
+    'year_index': ('year', 'values'),
+}
+
+
+def default_chunk_rows():
+    return getattr(settings, 'CATALOG_INGEST', {}).get('CHUNK_ROWS', 100000)
+
+
+class SeenIds:
+    """
+    Set of 64-bit id hashes kept as sorted runs, merged when a run is no
+    bigger than the next (so there are O(log n) runs). 8 bytes per id instead
+    of a Python set's ~100.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    @staticmethod
+    def hash(ids):
+        return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+    def contains(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            if not len(run):
+                continue
+            at = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[at] == hashes
+        return found
+
+    def add(self, hashes):
+        run = np.unique(hashes)
+        if not len(run):
+            # e.g. a chunk of nothing but duplicates
+            return
+        while self.runs and len(self.runs[-1]) <= len(run):
+            run = np.sort(np.concatenate([self.runs.pop(), run]), kind='stable')
+        self.runs.append(run)
+
+
+def _new_rows(chunk, seen):
+    """``chunk`` without rows whose track id was seen before (in it or earlier)."""
+    hashes = seen.hash(chunk['track_id'])
+    keep = ~(pd.Series(hashes).duplicated().to_numpy() | seen.contains(hashes))
+    seen.add(hashes[keep])
+    return chunk[keep].reset_index(drop=True)
+
+
+def compile_csv(source, output, chunk_rows=None, source_version=None):
+    """Compile the CSV at ``source`` into ``output``; returns ingestion stats."""
+    chunk_rows = chunk_rows or default_chunk_rows()
+    started = time.perf_counter()
+    writer = StoreWriter(output, LIST_COLUMNS)
+    seen = SeenIds()
+    read = chunks = 0
+    try:
+        fragments = writer.add_extra_writer('song_fragments', np.uint8)
+        fragment_offsets = writer.add_extra_writer('song_fragment_offsets')
+        fragment_offsets.append(np.zeros(1, dtype=np.int64))
+        fragment_end = 0
+        shared = None
+
+        for chunk in pd.read_csv(source, chunksize=chunk_rows):
+            read += len(chunk)
+            chunks += 1
+            chunk = _new_rows(chunk, seen)
+            for column in LIST_COLUMNS:
+                if column in chunk:
+                    chunk[column] = chunk[column].map(_parse_list)
+            writer.append(chunk)
+            if shared is None:
+                # Decided by the column kinds of the first chunk, like the writer
+                shared = [f for f in SHARED_FIELDS if writer.kind(f) == 'string']
+                shared = shared if len(shared) == len(SHARED_FIELDS) else []
+
+            # Each row's JSON only depends on its own values, so the chunk's
+            # fragments are the catalog's fragments for those rows
+            data, offsets = SongFragments.encode(ColumnStore.from_frame(chunk, LIST_COLUMNS), shared)
+            fragments.append(np.frombuffer(data, dtype=np.uint8))
+            fragment_offsets.append(fragment_end + offsets[1:])
+            fragment_end += int(offsets[-1])
+
+        store = writer.open()
+        writer.meta['song_fragments'] = SongFragments.meta(shared or [])
+        FeatureMatrix.save_blocks(store, writer, chunk_rows)
+        for name, (column, kind) in INDEXES.items():
+            def allocate(length, dtype, name=name):
+                return writer.allocate_extra(f"{name}.postings", length, dtype)
+            if kind == 'list':
+                index = InvertedIndex.from_list_column(store[column], chunk_rows, allocate)
+            else:
+                index = InvertedIndex.from_values(store[column], chunk_rows, allocate)
+            index.save(writer, name)
+        TrackLookup.build(store['track_id'], chunk_rows).save(writer, 'track_lookup')
+
+        writer.close(source_version or file_version(source))
+    except BaseException:
+        writer.abort()
+        raise
+
+    return {
+        "rows": writer.rows,
+        "read": read,
+        "duplicates": read - writer.rows,
+        "chunks": chunks,
+        "chunk_rows": chunk_rows,
+        "seconds": time.perf_counter() - started,
+    }
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from rest_framework.authtoken.models import Token
+
+from api.catalog import load_catalog
+
+PROMPTS = [
+    'chill lofi 2019', 'happy pop', 'fast popular rock 1999', 'sad acoustic',
+    'calm jazz', 'intense metal 2005', 'slow hip hop', 'popular dance 2015',
+]
+
+# name -> (method, sync path, async path)
+ENDPOINTS = {
+    'prompt': ('post', '/api/prompt/', '/api/async/prompt/'),
+    'discover': ('get', '/api/discover/?genre=pop&filter=new&page_size=20', '/api/async/discover/?genre=pop&filter=new&page_size=20'),
+    'favorites': ('get', '/api/favorites/', '/api/async/favorites/'),
+}
+
+
+def _summary(timings, elapsed):
+    timings = np.array(timings) * 1000
+    return {
+        "requests": len(timings),
+        "throughput": round(len(timings) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "p95_ms": round(float(np.percentile(timings, 95)), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput of the sync views driven through the WSGI handler by "
+        "a thread pool with the async views driven through the ASGI handler on "
+        "one event loop, at several concurrency levels. Runs in-process, so it "
+        "measures the handlers rather than a particular server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,8,32', help="Comma separated in-flight request counts")
+        parser.add_argument('--requests', type=int, default=400, help="Requests per endpoint and run")
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help="Comma separated endpoints to run")
+
+    def handle(self, *args, **options):
+        catalog = load_catalog()
+        user, _ = User.objects.get_or_create(username='bench-concurrency')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.headers = {'Authorization': f'Token {token.key}'}
+        try:
+            # A handful of favorites so the overlay and listing do real work
+            for track_id in catalog.store['track_id'].decode(np.arange(min(25, len(catalog)))).tolist():
+                user.favorites.get_or_create(track_id=track_id, defaults={'track_name': 'bench'})
+
+            for name in options['endpoints'].split(','):
+                for concurrency in [int(c) for c in options['concurrency'].split(',')]:
+                    wsgi = self.run_wsgi(name, concurrency, options['requests'])
+                    asgi = asyncio.run(self.run_asgi(name, concurrency, options['requests']))
+                    self.stdout.write(
+                        f"{name:<10} c={concurrency:<4} "
+                        f"wsgi {wsgi['throughput']:8.1f} req/s p95 {wsgi['p95_ms']:7.2f} ms   "
+                        f"asgi {asgi['throughput']:8.1f} req/s p95 {asgi['p95_ms']:7.2f} ms"
+                    )
+        finally:
+            user.delete()
+
+    def _kwargs(self, method, i):
+        if method == 'post':
+            return {'data': {'prompt': PROMPTS[i % len(PROMPTS)]}, 'content_type': 'application/json'}
+        return {}
+
+    def run_wsgi(self, name, concurrency, requests):
+        method, path, _ = ENDPOINTS[name]
+        local = threading.local()
+
+        def call(i):
+            # One client per thread, like one request per server thread
+            if not hasattr(local, 'client'):
+                local.client = Client(headers=self.headers)
+            started = time.perf_counter()
+            response = getattr(local.client, method)(path, **self._kwargs(method, i))
+            assert response.status_code == 200, response.content[:200]
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(call, range(requests)))
+        return _summary(timings, time.perf_counter() - started)
+
+    async def run_asgi(self, name, concurrency, requests):
+        method, _, path = ENDPOINTS[name]
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def call(i):
+            async with slots:
+                started = time.perf_counter()
+                response = await getattr(client, method)(path, headers=self.headers, **self._kwargs(method, i))
+                assert response.status_code == 200, response.content[:200]
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(call(i) for i in range(requests)))
+        return _summary(timings, time.perf_counter() - started)
@@ -0,0 +1,86 @@
+import random
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Favorite
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test favorite lookups as the favorites table grows. Rows are "
+        "written to the configured database inside a transaction that is "
+        "rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help="Comma separated table sizes")
+        parser.add_argument('--users', type=int, default=1000, help="Users the rows are spread over")
+        parser.add_argument('--lookups', type=int, default=2000, help="Timed queries per size and kind")
+        parser.add_argument('--explain', action='store_true', help="Print the query plan of each lookup")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rng = random.Random(0)
+        User.objects.bulk_create([User(username=f"bench-favorites-{i}") for i in range(options['users'])])
+        user_ids = list(User.objects.filter(username__startswith="bench-favorites-").values_list('id', flat=True))
+
+        rows = 0
+        for size in [int(s) for s in options['sizes'].split(',')]:
+            started = time.perf_counter()
+            while rows < size:
+                batch = min(50000, size - rows)
+                Favorite.objects.bulk_create([
+                    Favorite(user_id=user_ids[n % len(user_ids)], track_id=f"track{n:017d}", track_name="bench")
+                    for n in range(rows, rows + batch)
+                ], batch_size=5000)
+                rows += batch
+            self.stdout.write(f"{rows} rows ({time.perf_counter() - started:.1f}s to fill)")
+
+            def sample():
+                n = rng.randrange(rows)
+                return user_ids[n % len(user_ids)], f"track{n:017d}"
+
+            lookups = {
+                # RemoveFavoriteView / get_or_create
+                'get': lambda u, t: Favorite.objects.filter(user_id=u, track_id=t).exists(),
+                # Favorites cache fill
+                'track_ids': lambda u, t: list(Favorite.objects.filter(user_id=u).values_list('track_id', flat=True)),
+                # A user's newest favorites
+                'recent': lambda u, t: list(Favorite.objects.filter(user_id=u).order_by('-created_at')[:20]),
+            }
+            for name, lookup in lookups.items():
+                timings = []
+                for _ in range(options['lookups']):
+                    user_id, track_id = sample()
+                    started = time.perf_counter()
+                    lookup(user_id, track_id)
+                    timings.append(time.perf_counter() - started)
+                timings = np.array(timings) * 1e6
+                self.stdout.write(
+                    f"  {name:<10} p50 {np.percentile(timings, 50):8.1f} us  "
+                    f"p95 {np.percentile(timings, 95):8.1f} us  p99 {np.percentile(timings, 99):8.1f} us"
+                )
+
+            if options['explain']:
+                user_id, track_id = sample()
+                for name, query in (
+                    ('get', Favorite.objects.filter(user_id=user_id, track_id=track_id)),
+                    ('track_ids', Favorite.objects.filter(user_id=user_id).values_list('track_id', flat=True)),
+                    ('recent', Favorite.objects.filter(user_id=user_id).order_by('-created_at')[:20]),
+                ):
+                    self.stdout.write(f"  {name} plan: {query.explain()}")
@@ -0,0 +1,57 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.catalog import load_catalog
+from api.renderers import SONG_FIELDS, SongList, SongListJSONRenderer
+
+
+def dataframe_response(catalog, positions, favorites):
+    # The path views used before SongList: DataFrame -> records -> JSONRenderer
+    songs = catalog.songs.iloc[positions][SONG_FIELDS]
+    songs['is_favorite'] = np.isin(positions, favorites)
+    return JSONRenderer().render(songs.to_dict(orient='records'))
+
+
+def fragment_response(catalog, positions, favorites):
+    return SongListJSONRenderer().render(SongList(catalog, positions, favorites))
+
+
+class Command(BaseCommand):
+    help = "Compare DataFrame.to_dict and pre-encoded fragment serialization of song lists."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,20,100,500', help="Comma separated list lengths")
+        parser.add_argument('--repeat', type=int, default=200, help="Renders per size and path")
+
+    def handle(self, *args, **options):
+        catalog = load_catalog()
+        rng = np.random.default_rng(0)
+        favorites = np.unique(rng.choice(len(catalog), size=min(50, len(catalog)), replace=False))
+
+        for size in [int(s) for s in options['sizes'].split(',')]:
+            positions = rng.choice(len(catalog), size=min(size, len(catalog)), replace=False)
+            # Roughly a quarter of each list is flagged as a favorite
+            shared = min(len(positions) // 4, len(favorites))
+            positions[:shared] = favorites[:shared]
+
+            old = dataframe_response(catalog, positions, favorites)
+            new = fragment_response(catalog, positions, favorites)
+            if json.loads(old) != json.loads(new):
+                self.stderr.write(self.style.ERROR(f"size {size}: outputs differ"))
+
+            timings = {}
+            for name, render in (('to_dict', dataframe_response), ('fragments', fragment_response)):
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    render(catalog, positions, favorites)
+                timings[name] = (time.perf_counter() - started) / options['repeat'] * 1000
+
+            self.stdout.write(
+                f"{size:>5} songs  to_dict {timings['to_dict']:8.3f} ms  "
+                f"fragments {timings['fragments']:8.3f} ms  "
+                f"x{timings['to_dict'] / timings['fragments']:.1f}  ({len(new)} bytes)"
+            )
@@ -0,0 +1,114 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter: import the WSGI application like a server
+# would, then serve one Discover request. The test helpers and a throwaway
+# database are set up first so they count towards neither number.
+SERVE = """
+import json, os, time
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings!r})
+django.setup()
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIRequestFactory, force_authenticate
+setup_test_environment()
+connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+started = time.perf_counter()
+from django.core.servers.basehttp import get_internal_wsgi_application
+get_internal_wsgi_application()
+ready = time.perf_counter()
+
+from api.views import DiscoverView
+request = APIRequestFactory().get('/api/discover/')
+force_authenticate(request, user=User(id=0, username='bench-startup'))
+response = DiscoverView.as_view()(request)
+response.render()
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(json.dumps({{"ready_ms": (ready - started) * 1000, "first_request_ms": (done - ready) * 1000}}))
+"""
+
+SCENARIOS = {
+    'command': "manage.py check: what migrate, shell and tests pay before doing anything",
+    'serve': "WSGI application with the catalog warm-up, then the first request",
+    'serve-lazy': "WSGI application with CATALOG_WARMUP=0, the first request loads the catalog",
+}
+
+
+def parse_importtime(stderr):
+    """(total ms, [(package, cumulative ms)]) from ``python -X importtime`` output."""
+    total = 0
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            total += int(cumulative)
+        name = name.strip()
+        # First import of each top-level package, wherever it happened
+        if '.' not in name and name not in packages:
+            packages[name] = int(cumulative) / 1000
+    return total / 1000, sorted(packages.items(), key=lambda item: -item[1])
+
+
+class Command(BaseCommand):
+    help = "Measure process start-up: import time, catalog warm-up and time to the first request."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per scenario, the median is reported")
+        parser.add_argument('--top', type=int, default=10, help="Slowest imported packages to list")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def _run(self, scenario, importtime=False):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ['DJANGO_SETTINGS_MODULE']}
+        env['CATALOG_WARMUP'] = '0' if scenario == 'serve-lazy' else '1'
+        flags = ['-X', 'importtime'] if importtime else []
+        if scenario == 'command':
+            command = [sys.executable, *flags, os.path.join(settings.BASE_DIR, 'manage.py'), 'check']
+        else:
+            command = [sys.executable, *flags, '-c', SERVE.format(settings=env['DJANGO_SETTINGS_MODULE'])]
+
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        total = (time.perf_counter() - started) * 1000
+        if result.returncode:
+            raise RuntimeError(f"{scenario} failed:\n{result.stderr[-2000:]}")
+        if importtime:
+            return parse_importtime(result.stderr)
+        timings = json.loads(result.stdout.splitlines()[-1]) if scenario != 'command' else {}
+        return {"total_ms": total, **timings}
+
+    def handle(self, *args, **options):
+        report = {}
+        for scenario in SCENARIOS:
+            runs = [self._run(scenario) for _ in range(options['repeat'])]
+            summary = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+            imports, packages = self._run(scenario, importtime=True)
+            summary["import_ms"] = round(imports, 1)
+            summary["slowest_packages"] = [[name, round(ms, 1)] for name, ms in packages[:options['top']]]
+            report[scenario] = summary
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=1))
+            return
+
+        for scenario, summary in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{scenario}: {SCENARIOS[scenario]}"))
+            line = f"  total {summary['total_ms']:8.1f} ms  imports {summary['import_ms']:8.1f} ms"
+            if 'ready_ms' in summary:
+                line += f"  ready {summary['ready_ms']:8.1f} ms  first request {summary['first_request_ms']:8.1f} ms"
+            self.stdout.write(line)
+            self.stdout.write("  slowest packages: " + ", ".join(
+                f"{name} {ms:.0f} ms" for name, ms in summary["slowest_packages"]
+            ))
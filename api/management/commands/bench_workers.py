@@ -0,0 +1,56 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api.catalog import load_catalog
+from api.workers import PoolBusy, WorkerPool
+
+
+class Command(BaseCommand):
+    help = (
+        "Send a burst of distinct prompts from many threads and compare latency "
+        "percentiles of running them inline against the worker process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', type=int, default=200, help="Prompts in the burst")
+        parser.add_argument('--threads', type=int, default=16, help="Concurrent request threads")
+        parser.add_argument('--workers', type=int, default=4, help="Worker processes")
+        parser.add_argument('--max-pending', type=int, default=64, help="Pool backpressure limit")
+
+    def handle(self, *args, **options):
+        catalog = load_catalog()
+        rng = random.Random(0)
+        genres = catalog.prompt_engine.all_genres
+        moods = ['happy', 'sad', 'calm', 'intense', 'fast', 'slow', 'popular', '']
+        prompts = [
+            f"{rng.choice(moods)} {rng.choice(genres)} {rng.randint(1960, 2023)}"
+            for _ in range(options['burst'])
+        ]
+
+        for mode in ('inline', 'process'):
+            pool = WorkerPool(mode=mode, workers=options['workers'], max_pending=options['max_pending'], queue_wait=5, timeout=30).start()
+
+            def call(prompt):
+                started = time.perf_counter()
+                try:
+                    pool.run('prompt', catalog, catalog.prompt_engine.parse(prompt))
+                except PoolBusy:
+                    return None
+                return time.perf_counter() - started
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as threads:
+                timings = list(threads.map(call, prompts))
+            elapsed = time.perf_counter() - started
+            pool.shutdown()
+
+            done = np.array([t for t in timings if t is not None]) * 1000
+            self.stdout.write(
+                f"{mode:<8} {len(done) / elapsed:7.1f} prompts/s  "
+                f"p50 {np.percentile(done, 50):7.1f} ms  p95 {np.percentile(done, 95):7.1f} ms  "
+                f"p99 {np.percentile(done, 99):7.1f} ms  rejected {len(timings) - len(done)}"
+            )
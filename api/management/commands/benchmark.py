@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.bench import SUITES, run_benchmarks
+from api.bench.synthetic import parse_range
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the benchmark suites against a seeded synthetic catalog and a "
+        "throwaway test database, and print or save the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suites', default=','.join(SUITES), help=f"Comma separated, from {', '.join(SUITES)}")
+        parser.add_argument('--rows', type=int, default=50000)
+        parser.add_argument('--genres-per-track', default='0-3', help="Count or low-high range")
+        parser.add_argument('--artists-per-track', default='1-2', help="Count or low-high range")
+        parser.add_argument('--genres', type=int, default=500, help="Distinct genres in the catalog")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=100, help="Timed calls per benchmark")
+        parser.add_argument('--output', help="Write the JSON here instead of stdout")
+        parser.add_argument('--compare', help="Earlier JSON output to compare p50 timings against")
+
+    def handle(self, *args, **options):
+        report = run_benchmarks(
+            suites=options['suites'].split(','),
+            rows=options['rows'],
+            genres_per_track=parse_range(options['genres_per_track']),
+            artists_per_track=parse_range(options['artists_per_track']),
+            genres=options['genres'],
+            seed=options['seed'],
+            repeat=options['repeat'],
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        else:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)["results"]
+            for name, summary in sorted(report["results"].items()):
+                before = baseline.get(name)
+                if before is None:
+                    self.stderr.write(f"{name:<45} {summary['p50_ms']:10.3f} ms  (new)")
+                    continue
+                ratio = summary['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+                self.stderr.write(
+                    f"{name:<45} {before['p50_ms']:10.3f} -> {summary['p50_ms']:10.3f} ms  x{ratio:.2f}"
+                )
@@ -0,0 +1,117 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.catalog import build_catalog, compiled_path, dataset_path, read_songs_csv
+
+
+def resident_memory():
+    """(private, shared) MB of this process: anonymous memory vs mapped file pages. Linux only."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {line.split()[0].rstrip(':'): int(line.split()[1]) for line in f if line[0].isupper()}
+    except OSError:
+        return None, None
+    return fields['Anonymous'] / 1024, (fields['Rss'] - fields['Anonymous']) / 1024
+
+
+def column_type(store, name):
+    column = store[name]
+    if hasattr(column, 'dictionary'):
+        dictionary = column.dictionary
+        kind = 'list' if hasattr(column, 'values') else 'string'
+        prefix = f", prefix {dictionary.prefix!r}" if dictionary.prefix else ''
+        return f"{kind}, {len(dictionary)} values{prefix}"
+    return str(column.dtype)
+
+
+def derived_group(name):
+    # 'genre_index.postings' -> 'genre_index', 'feature_norms' -> 'features'
+    group = name.split('.')[0]
+    return {'feature_norms': 'features', 'song_fragment_offsets': 'song_fragments'}.get(group, group)
+
+
+class Command(BaseCommand):
+    help = "Report the catalog's memory per column: as a pandas DataFrame and in the compact columnar store."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help="CSV to read (defaults to CATALOG_CSV_PATH)")
+        parser.add_argument('--compiled', help="Compiled catalog (defaults to CATALOG_COMPILED_PATH)")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        source = options['source'] or dataset_path()
+        compiled = options['compiled'] or compiled_path()
+
+        # What a worker holds once the catalog is loaded and warm, measured
+        # before the DataFrame below is read
+        private_before, shared_before = resident_memory()
+        catalog = build_catalog(source, compiled).warm()
+        private_after, shared_after = resident_memory()
+        store = catalog.store
+
+        frame = read_songs_csv(source).memory_usage(index=False, deep=True)
+
+        # Buffers shared by several columns count for the first one
+        counted = set()
+        columns = []
+        for name in store.columns:
+            buffers = [b for b in store.buffers(name) if id(b) not in counted]
+            counted.update(id(b) for b in buffers)
+            before = int(frame.get(name, 0))
+            after = sum(b.nbytes for b in buffers)
+            columns.append({
+                "column": name,
+                "type": column_type(store, name),
+                "dataframe_bytes": before,
+                "compact_bytes": after,
+            })
+
+        derived = {}
+        for name, array in store.extras.items():
+            group = derived_group(name)
+            derived[group] = derived.get(group, 0) + array.nbytes
+        derived['sort_orders (in memory)'] = sum(
+            order.order.nbytes + order.rank.nbytes for order in catalog.sort_orders.values()
+        )
+
+        report = {
+            "rows": len(catalog),
+            "source": str(catalog.source),
+            "mapped": catalog.mapped,
+            "columns": columns,
+            "dataframe_bytes": int(frame.sum()),
+            "compact_bytes": sum(c["compact_bytes"] for c in columns),
+            "derived_bytes": derived,
+            "worker_private_mb": None if private_after is None else round(private_after - private_before, 1),
+            "worker_shared_mb": None if shared_after is None else round(shared_after - shared_before, 1),
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=1))
+            return
+        self._print(report)
+
+    def _print(self, report):
+        mb = 1024 * 1024
+        self.stdout.write(f"{report['rows']} tracks from {report['source']}"
+                          f"{' (memory-mapped)' if report['mapped'] else ''}\n")
+        self.stdout.write(f"{'column':<22} {'dataframe':>10} {'compact':>10} {'ratio':>7}  type")
+        for c in report["columns"] + [{
+            "column": "total", "type": "", "dataframe_bytes": report["dataframe_bytes"],
+            "compact_bytes": report["compact_bytes"],
+        }]:
+            before, after = c["dataframe_bytes"], c["compact_bytes"]
+            ratio = f"x{before / after:.1f}" if after else "shared"
+            self.stdout.write(
+                f"{c['column']:<22} {before / mb:7.2f} MB {after / mb:7.2f} MB {ratio:>7}  {c['type']}"
+            )
+
+        self.stdout.write("\nderived")
+        for name, size in sorted(report["derived_bytes"].items(), key=lambda item: -item[1]):
+            self.stdout.write(f"{name:<33} {size / mb:7.2f} MB")
+
+        if report["worker_private_mb"] is not None:
+            self.stdout.write(self.style.SUCCESS(
+                f"\nLoading and warming the catalog took {report['worker_private_mb']} MB of private memory "
+                f"plus {report['worker_shared_mb']} MB of page cache shared by all workers"
+            ))
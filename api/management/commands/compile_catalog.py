@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.catalog import compiled_path, dataset_path
+from api.ingest import compile_csv, default_chunk_rows
+
+
+class Command(BaseCommand):
+    help = "Compile the song CSV into the memory-mapped columnar catalog format."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help="CSV to compile (defaults to CATALOG_CSV_PATH)")
+        parser.add_argument('--output', help="Directory to write (defaults to CATALOG_COMPILED_PATH)")
+        parser.add_argument('--chunk-rows', type=int, default=None,
+                            help=f"CSV rows read at a time (default {default_chunk_rows()})")
+
+    def handle(self, *args, **options):
+        source = options['source'] or dataset_path()
+        output = options['output'] or compiled_path()
+
+        stats = compile_csv(source, output, chunk_rows=options['chunk_rows'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compiled {stats['rows']} tracks ({stats['duplicates']} duplicates dropped, "
+            f"{stats['chunks']} chunks of {stats['chunk_rows']}) from {source} to {output} "
+            f"in {stats['seconds']:.2f}s"
+        ))
@@ -0,0 +1,78 @@
+"""
+Multi-phrase matcher used to pull artists, years and keywords out of prompts.
+
+Phrases are tokenized the same way as prompts and kept in a token trie,
+stored flat as ``{phrase: payload}`` plus the set of proper prefixes. A scan
+starts at every prompt token and extends only while the phrase so far is a
+known prefix, so the cost is O(prompt tokens x longest phrase) and does not
+depend on how many phrases were compiled in.
+"""
+import re
+from typing import NamedTuple
+
+# Runs of digits or of letters, so "k-pop" -> k, pop and "1990s" -> 1990, s
+TOKEN_RE = re.compile(r"\d+|[^\W\d_]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold())
+
+
+class Match(NamedTuple):
+    kind: str
+    value: object
+    start: int  # token offsets into the prompt
+    end: int
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+
+class PhraseMatcher:
+    def __init__(self):
+        self.phrases = {}
+        self.prefixes = set()
+        self.max_tokens = 0
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def add(self, phrase, kind, value=None):
+        """Register ``phrase``; the first value added for a phrase and kind wins."""
+        tokens = tokenize(phrase)
+        if not tokens:
+            return
+        key = " ".join(tokens)
+        self.phrases.setdefault(key, {}).setdefault(kind, phrase if value is None else value)
+        for n in range(1, len(tokens)):
+            self.prefixes.add(" ".join(tokens[:n]))
+        self.max_tokens = max(self.max_tokens, len(tokens))
+
+    def find_all(self, text):
+        """Every phrase occurrence in ``text``, ordered by start then length."""
+        tokens = tokenize(text)
+        matches = []
+        for i in range(len(tokens)):
+            key = tokens[i]
+            for j in range(i + 1, min(len(tokens), i + self.max_tokens) + 1):
+                if j > i + 1:
+                    key = f"{key} {tokens[j - 1]}"
+                hit = self.phrases.get(key)
+                if hit:
+                    matches.extend(Match(kind, value, i, j) for kind, value in hit.items())
+                if key not in self.prefixes:
+                    break
+        return matches
+
+
+def longest(matches):
+    """Longest match, ties going to the earliest one."""
+    return max(matches, key=lambda m: (m.length, -m.start), default=None)
+
+
+def by_kind(matches):
+    grouped = {}
+    for match in matches:
+        grouped.setdefault(match.kind, []).append(match)
+    return grouped
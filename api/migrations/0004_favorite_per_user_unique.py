@@ -0,0 +1,54 @@
+# Generated by Django 5.1.2 on 2026-10-17 07:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    # track_id was globally unique until now so there should be nothing to
+    # do, but never let stray duplicates block the new constraint: keep the
+    # oldest row of each (user, track_id)
+    Favorite = apps.get_model('api', 'Favorite')
+    duplicates = (
+        Favorite.objects.values('user_id', 'track_id')
+        .annotate(rows=Count('id'), keep=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        Favorite.objects.filter(
+            user_id=duplicate['user_id'], track_id=duplicate['track_id']
+        ).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_tasteprofile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # The per-user constraint is added before the global one is dropped, so
+    # there is never a point where duplicates could slip in
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'track_id'), name='favorite_user_track_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', '-created_at'], name='favorite_user_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='favorite',
+            name='track_id',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='favorite',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -2,10 +2,32 @@ from django.db import models
 from django.contrib.auth.models import User
 
 class Favorite(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites')
-    track_id = models.CharField(max_length=100, unique=True)  # Assuming each song has a unique ID
+    # No index of its own, the (user, track_id) constraint below leads with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites', db_index=False)
+    track_id = models.CharField(max_length=100)
     track_name = models.CharField(max_length=255, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # Each user can favorite a track once; also the index that covers
+            # (user, track_id) lookups and a user's track_id list
+            models.UniqueConstraint(fields=['user', 'track_id'], name='favorite_user_track_unique'),
+        ]
+        indexes = [
+            # A user's favorites newest first
+            models.Index(fields=['user', '-created_at'], name='favorite_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.track_id} - Favorited by {self.user.username}"
+
+
+class TasteProfile(models.Model):
+    """Persisted favorites model used by the recommendations endpoint."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='taste_profile')
+    state = models.JSONField(default=dict)  # Scaler statistics and centroids, see api.recommender
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Taste profile of {self.user.username}"
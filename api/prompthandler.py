@@ -1,13 +1,24 @@
-from fuzzywuzzy import fuzz, process
+from functools import cached_property
+from typing import NamedTuple
+from rapidfuzz import fuzz, process
 import numpy as np
-from .models import Favorite
+from django.conf import settings
+from . import workers
+from .executor import run_cpu
+from .genres import GenreMatcher
+from .indexes import intersect
+from .matcher import PhraseMatcher, by_kind, longest
+from .recommender import FEATURES, recommend
+from .result_cache import prompt_cache
+from .timing import stage
 
 # Dynamic threshold calculations for various attributes
 def calculate_dynamic_thresholds(songs_df):
     thresholds = {}
     for column in ['acousticness', 'energy', 'valence', 'tempo']:
-        mean = songs_df[column].mean()
-        std_dev = songs_df[column].std()
+        values = np.asarray(songs_df[column], dtype=np.float64)
+        mean = np.nanmean(values)
+        std_dev = np.nanstd(values, ddof=1)
         thresholds[column] = {
             "low": mean - std_dev,
             "medium": mean,
@@ -15,129 +26,262 @@ def calculate_dynamic_thresholds(songs_df):
         }
     return thresholds
 
+# Prompt keywords and the mood/tempo they stand for
+KEYWORDS = {
+    "mood": {"calm": "calm", "chill": "calm", "intense": "intense", "high energy": "intense", "happy": "happy", "sad": "sad"},
+    "tempo": {"fast": "fast", "upbeat": "fast", "slow": "slow"},
+    "popular": {"popular": True},
+}
+YEAR_RANGE = range(1900, 2030)
+
+# What each mood/tempo asks of the audio features: +1 for high values, -1 for low
+PREFERENCES = {
+    "calm": (("energy", -1), ("acousticness", 1)),
+    "intense": (("energy", 1),),
+    "happy": (("valence", 1),),
+    "sad": (("valence", -1),),
+    "fast": (("tempo", 1),),
+    "slow": (("tempo", -1),),
+}
+
+# Weights of each part of the intent in scoring mode (PROMPT_SCORING)
+DEFAULT_WEIGHTS = {
+    "genre": 3.0,
+    "artist": 4.0,
+    "year": 2.0,
+    "mood": 1.0,
+    "tempo": 1.0,
+    "popularity": 0.25,  # tie-breaker when the prompt doesn't ask for popular songs
+    "popular": 1.0,
+}
+# Years this far from the one asked for no longer score
+YEAR_SPAN = 5
+
 # Function to extract closest matching genre with fuzzy matching
 def get_fuzzy_genre_match(prompt, all_genres, threshold=80):
-    match, score = process.extractOne(prompt, all_genres, scorer=fuzz.token_sort_ratio)
-    return match if score >= threshold else None
+    if isinstance(all_genres, GenreMatcher):
+        return all_genres.best(prompt, score_cutoff=threshold)
+    result = process.extractOne(prompt, all_genres, scorer=fuzz.token_sort_ratio, score_cutoff=threshold)
+    return result[0] if result else None
 
-# Filter function with dynamic thresholds and fuzzy genre matching
-def filter_songs_by_prompt(prompt, songs_df):
-    # Calculate thresholds dynamically
-    thresholds = calculate_dynamic_thresholds(songs_df)
-    # Default filters
-    genre_filter, artist_filter, mood_filter, tempo_filter, popularity_filter, year_filter = None, None, None, None, None, None
-    # Lowercase the prompt for easier matching
-    prompt = prompt.lower()
-    # Genre extraction with fuzzy matching
-    all_genres = set(g for sublist in songs_df['genres'] for g in sublist)
-    genre_filter = get_fuzzy_genre_match(prompt, all_genres)
-    # Artist extraction from dataset
-    all_artists = set(a for sublist in songs_df['artist_names'] for a in sublist)
-    for artist in all_artists:
-        if artist.lower() in prompt:
-            artist_filter = artist
-            break
-    # Mood-based filtering
-    if "calm" in prompt or "chill" in prompt:
-        mood_filter = ("energy", "<", thresholds["energy"]["low"])
-        mood_filter = ("acousticness", ">", thresholds["acousticness"]["high"])
-    elif "intense" in prompt or "high energy" in prompt:
-        mood_filter = ("energy", ">", thresholds["energy"]["high"])
-    elif "happy" in prompt:
-        mood_filter = ("valence", ">", thresholds["valence"]["high"])
-    elif "sad" in prompt:
-        mood_filter = ("valence", "<", thresholds["valence"]["low"])
-    # Tempo filtering
-    if "fast" in prompt or "upbeat" in prompt:
-        tempo_filter = ("tempo", ">", thresholds["tempo"]["high"])
-    elif "slow" in prompt:
-        tempo_filter = ("tempo", "<", thresholds["tempo"]["low"])
-    # Popularity filtering
-    if "popular" in prompt:
-        popularity_filter = songs_df["popularity"] > songs_df["popularity"].mean()
-    # Year filtering based on decades or specific years
-    if any(year in prompt for year in map(str, range(1900, 2030))):
-        for year in map(str, range(1900, 2030)):
-            if year in prompt:
-                year_filter = (int(year), int(year))
-                break
-    # Applying filters to the dataset
-    filtered_songs = songs_df
-    if genre_filter:
-        filtered_songs = filtered_songs[filtered_songs["genres"].apply(lambda x: genre_filter in x)]
-    if artist_filter:
-        filtered_songs = filtered_songs[filtered_songs["artist_names"].apply(lambda x: artist_filter in x)]
-    if mood_filter:
-        column, operator, value = mood_filter
-        if operator == "<":
-            filtered_songs = filtered_songs[filtered_songs[column] < value]
-        elif operator == ">":
-            filtered_songs = filtered_songs[filtered_songs[column] > value]
-    if tempo_filter:
-        column, operator, value = tempo_filter
-        if operator == "<":
-            filtered_songs = filtered_songs[filtered_songs[column] < value]
-        elif operator == ">":
-            filtered_songs = filtered_songs[filtered_songs[column] > value]
-    if popularity_filter is not None:
-        filtered_songs = filtered_songs[popularity_filter]
-    if year_filter:
-        start_year, end_year = year_filter
-    filtered_songs = filtered_songs[(filtered_songs["year"] >= start_year) & (filtered_songs["year"] <= end_year)]
-    # Fallback: most popular songs if no strong filter match
-    if filtered_songs.empty:
-        filtered_songs = songs_df.sort_values(by="popularity", ascending=False).head(10)
-    
-    return filtered_songs
-
-import pandas as pd
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-
-def get_recommendations_from_favorites(user_id, songs_df, n_recommendations=10):
+
+class PromptIntent(NamedTuple):
+    """What a prompt asks for; equal intents always give equal results."""
+    genre: str = None
+    artist: str = None
+    mood: str = None
+    tempo: str = None
+    popular: bool = False
+    year: int = None
+
+
+class PromptEngine:
     """
-    Generate song recommendations based on a user's favorite songs.
-    
-    Parameters:
-    - user_id (int): The ID of the user whose favorites are used for recommendations.
-    - songs_df (DataFrame): The main dataset containing all song details.
-    - n_recommendations (int): Number of recommendations to return.
+    Everything the prompt filter needs that does not depend on the prompt.
 
-    Returns:
-    - DataFrame: A DataFrame with recommended songs.
+    Built once per catalog (see ``Catalog.prompt_engine``) so a request only
+    pays for parsing its prompt and filtering the matching rows.
     """
 
-    # Step 1: Retrieve favorite songs IDs from the database
-    favorite_track_ids = list(Favorite.objects.filter(user_id=user_id).values_list('track_id', flat=True))
-    if not favorite_track_ids:
-        print("No favorites found for this user.")
-        return pd.DataFrame()  # Return an empty DataFrame if no favorites
+    def __init__(self, catalog):
+        self.catalog = catalog
+        store = catalog.store
+        self.thresholds = calculate_dynamic_thresholds(store)
+        # Vocabularies straight from the column dictionaries, no row scans
+        self.all_genres = store['genres'].dictionary.strings[:-1].tolist()
+        self.all_artists = store['artist_names'].dictionary.strings[:-1].tolist()
+        self.genre_matcher = GenreMatcher(self.all_genres)
+        # One matcher for artists, years and keywords, scanned once per prompt
+        self.matcher = PhraseMatcher()
+        for kind, keywords in KEYWORDS.items():
+            for keyword, value in keywords.items():
+                self.matcher.add(keyword, kind, value)
+        for year in YEAR_RANGE:
+            self.matcher.add(str(year), "year", year)
+        for artist in self.all_artists:
+            self.matcher.add(artist, "artist", artist)
+        popularity = np.asarray(store['popularity'])
+        self.popularity_mean = float(np.nanmean(popularity))
+        # Fallback result: most popular songs first
+        self.most_popular = np.argsort(-popularity, kind='stable')[:10]
+        options = getattr(settings, 'PROMPT_SCORING', {})
+        self.mode = options.get('MODE', 'filter')
+        self.weights = {**DEFAULT_WEIGHTS, **options.get('WEIGHTS', {})}
+        if self.mode == 'score':
+            # Built up front when prompts are scored, otherwise on first use
+            self.years
+
+    @cached_property
+    def years(self):
+        return np.nan_to_num(np.asarray(self.catalog.store['year'], dtype=np.float32), nan=-1e4)
 
-    # Step 2: Filter the songs_df to include only the user's favorite songs
-    user_favorites_df = songs_df[songs_df['track_id'].isin(favorite_track_ids)].copy()
+    def _apply(self, positions, column, operator, value):
+        values = np.asarray(self.catalog.store[column])
+        values = values if positions is None else values[positions]
+        mask = values < value if operator == "<" else values > value
+        return np.flatnonzero(mask) if positions is None else positions[mask]
 
-    # Step 3: Select features for clustering (e.g., popularity, year, and any other numeric features available)
-    features = ['popularity', 'year']  # Adjust these features based on your dataset
-    user_favorites_features = user_favorites_df[features]
+    def parse(self, prompt):
+        """Extract the intent (genre, artist, mood, tempo, popularity, year) of ``prompt``."""
+        # Lowercase the prompt for easier matching
+        prompt = prompt.lower()
+        # Genre extraction with fuzzy matching
+        with stage('genre_match'):
+            genre = get_fuzzy_genre_match(prompt, self.genre_matcher)
+        # Artists, years and keywords in a single pass over the prompt
+        with stage('phrase_match'):
+            found = by_kind(self.matcher.find_all(prompt))
+        moods = {m.value for m in found.get("mood", ())}
+        tempos = {m.value for m in found.get("tempo", ())}
+        # Artist extraction: longest mention wins, then the earliest one
+        artist_match = longest(found.get("artist", ()))
+        return PromptIntent(
+            genre=genre.casefold() if genre else None,
+            artist=artist_match.value.casefold() if artist_match else None,
+            # Keyword precedence: calm, intense, happy, sad / fast, slow
+            mood=next((m for m in ("calm", "intense", "happy", "sad") if m in moods), None),
+            tempo=next((t for t in ("fast", "slow") if t in tempos), None),
+            popular="popular" in found,
+            # The first year mentioned
+            year=found["year"][0].value if "year" in found else None,
+        )
 
-    # Standardize the features
-    scaler = StandardScaler()
-    user_favorites_scaled = scaler.fit_transform(user_favorites_features)
+    def apply(self, intent):
+        """Return the row positions matching ``intent``, in catalog order."""
+        thresholds = self.thresholds
+        # Mood and tempo filtering: beyond one standard deviation in the
+        # wanted direction (calm needs both low energy and high acousticness)
+        conditions = [
+            (column, ">", thresholds[column]["high"]) if direction > 0 else (column, "<", thresholds[column]["low"])
+            for wanted in (intent.mood, intent.tempo) if wanted
+            for column, direction in PREFERENCES[wanted]
+        ]
+        # Popularity filtering
+        if intent.popular:
+            conditions.append(("popularity", ">", self.popularity_mean))
+        # Applying filters, most selective (index backed) first
+        positions = None
+        if intent.genre:
+            positions = intersect(positions, self.catalog.genre_index.get(intent.genre))
+        if intent.artist:
+            positions = intersect(positions, self.catalog.artist_index.get(intent.artist))
+        for condition in conditions:
+            positions = self._apply(positions, *condition)
+        if intent.year:
+            positions = self._apply(positions, "year", ">", intent.year - 1)
+            positions = self._apply(positions, "year", "<", intent.year + 1)
+        if positions is None:
+            positions = np.arange(len(self.catalog), dtype=np.int64)
+        # Fallback: most popular songs if no strong filter match
+        if not len(positions):
+            positions = self.most_popular
+        return positions
 
-    # Step 4: Apply K-means clustering to find clusters within favorite songs
-    kmeans = KMeans(n_clusters=3, random_state=42)  # Adjust clusters as needed
-    user_favorites_df['cluster'] = kmeans.fit_predict(user_favorites_scaled)
+    def score(self, intent):
+        """
+        Relevance of every row to ``intent`` (float32, higher is better): a
+        weighted sum of soft matches instead of hard filters, so partial
+        matches still rank.
+        """
+        weights = self.weights
+        matrix = self.catalog.features.matrix
+        score = np.zeros(len(self.catalog), dtype=np.float32)
+        preferences = [
+            (column, direction, weights[kind] / len(PREFERENCES[wanted]))
+            for kind, wanted in (("mood", intent.mood), ("tempo", intent.tempo)) if wanted
+            for column, direction in PREFERENCES[wanted]
+        ]
+        preferences.append(("popularity", 1, weights["popular"] if intent.popular else weights["popularity"]))
+        for column, direction, weight in preferences:
+            # Standardized value in the wanted direction, clipped to +-2 sd
+            # and mapped onto 0..weight
+            match = matrix[:, FEATURES.index(column)] * np.float32(direction)
+            np.clip(match, -2, 2, out=match)
+            score += (match + 2) * np.float32(weight / 4)
+        if intent.genre:
+            score[self.catalog.genre_index.get(intent.genre)] += weights["genre"]
+        if intent.artist:
+            score[self.catalog.artist_index.get(intent.artist)] += weights["artist"]
+        if intent.year:
+            # Full weight for the year itself, fading out over YEAR_SPAN years
+            distance = np.abs(self.years - np.float32(intent.year))
+            np.clip(distance, 0, YEAR_SPAN, out=distance)
+            score += (YEAR_SPAN - distance) * np.float32(weights["year"] / YEAR_SPAN)
+        return score
 
-    # Step 5: Recommend songs from the main dataset that are in the same clusters
-    # Select non-favorite songs for recommendations
-    non_favorites_df = songs_df[~songs_df['track_id'].isin(favorite_track_ids)].copy()
+    def top(self, intent, k):
+        """The ``k`` highest scoring row positions for ``intent``, best first."""
+        score = self.score(intent)
+        k = min(k, len(score))
+        if not k:
+            return np.empty(0, dtype=np.int64)
+        # O(n) selection of the k-th best score, then only the winners are
+        # sorted. Clipped matches tie a lot, so ties at the cut go by position
+        kth = -np.partition(-score, k - 1)[k - 1]
+        above = np.flatnonzero(score > kth)
+        top = np.concatenate([above, np.flatnonzero(score == kth)[:k - len(above)]])
+        return top[np.lexsort((top, -score[top]))]
 
-    # Scale the features in the non-favorites dataset for consistent clustering
-    non_favorites_scaled = scaler.transform(non_favorites_df[features])
-    non_favorites_df['cluster'] = kmeans.predict(non_favorites_scaled)
+    def filter(self, prompt):
+        """Return the row positions matching ``prompt``, in catalog order."""
+        return self.apply(self.parse(prompt))
+
+
+def intent_positions(catalog, intent):
+    """
+    Row positions of the top ``PROMPT_CACHE['TOP_N']`` songs for ``intent``.
+    Runs as a worker pool job, so it leaves caching to the caller.
+    """
+    engine = catalog.prompt_engine
+    top_n = settings.PROMPT_CACHE.get('TOP_N', 10)
+    if engine.mode == 'score':
+        with stage('score'):
+            return engine.top(intent, top_n)
+    with stage('filter'):
+        return engine.apply(intent)[:top_n].copy()
 
-    # Filter songs by matching clusters with user favorites
-    recommended_df = non_favorites_df[non_favorites_df['cluster'].isin(user_favorites_df['cluster'].unique())]
 
-    # Step 6: Return a sample of recommendations
-    return recommended_df.sample(n=min(n_recommendations, len(recommended_df)), random_state=42)
+def prompt_positions(catalog, prompt):
+    """Row positions of the top songs for ``prompt``."""
+    # Results are cached per parsed intent, so "chill lofi 2019" and
+    # "2019 lofi, chill" share one entry. The cache is this process's: only
+    # misses go to the worker pool
+    intent = catalog.prompt_engine.parse(prompt)
+    positions = prompt_cache().get_or_compute(
+        catalog.version, intent, lambda: workers.run('prompt', catalog, intent)
+    )
+    return positions[:10]
+
+
+async def aprompt_positions(catalog, prompt):
+    """``prompt_positions()`` for async views."""
+    intent = await run_cpu(catalog.prompt_engine.parse, prompt)
+    positions = await prompt_cache().aget_or_compute(
+        catalog.version, intent, lambda: workers.arun('prompt', catalog, intent)
+    )
+    return positions[:10]
+
+
+# Filter function with dynamic thresholds and fuzzy genre matching
+def filter_songs_by_prompt(prompt, engine):
+    return engine.catalog.songs.iloc[engine.filter(prompt)]
+
+def get_recommendations_from_favorites(user_id, catalog, n_recommendations=10):
+    """
+    Generate song recommendations based on a user's favorite songs.
+
+    Parameters:
+    - user_id (int): The ID of the user whose favorites are used for recommendations.
+    - catalog (Catalog): The loaded song catalog.
+    - n_recommendations (int): Number of recommendations to return.
+
+    Returns:
+    - DataFrame: A DataFrame with recommended songs, closest match first.
+
+    The user's scaler and K-means centroids are persisted (see
+    ``api.recommender``) and kept up to date as favorites change, so this
+    never refits; scoring is one distance computation over the catalog's
+    precomputed feature matrix.
+    """
+    positions = recommend(user_id, catalog, n_recommendations)
+    return catalog.songs.iloc[positions]
@@ -0,0 +1,302 @@
+"""
+Favorites-based recommendations with persisted per-user taste models.
+
+A user's taste model is their favorites' scaler statistics plus K-means
+centroids, both kept in raw feature units and stored in ``TasteProfile``.
+Models are fitted once, then updated incrementally as favorites are added or
+removed, so serving recommendations never refits.
+
+Candidates are scored against the catalog's standardized feature matrix
+(``Catalog.features``), which is computed once per catalog. Distances in the
+user's own scaling are rewritten in terms of that matrix, so a request is a
+single weighted distance computation over all rows.
+"""
+import numpy as np
+from django.db import transaction
+
+from . import favorites, workers
+from .models import Favorite, TasteProfile
+
+FEATURES = ['acousticness', 'energy', 'valence', 'tempo', 'popularity', 'year']
+N_CLUSTERS = 3
+# A feature the user's favorites barely vary on still gets at least this
+# fraction of the catalog's spread, so one favorite cannot dominate
+MIN_SCALE_FRACTION = 0.1
+
+
+class FeatureMatrix:
+    """
+    Standardized float32 audio features for every catalog row.
+
+    Compiled catalogs carry the matrix (see ``attach``), in which case it is
+    used straight from the memory map instead of being recomputed.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        meta = store.meta.get('features', {})
+        if 'features' in store.extras and meta.get('columns') == FEATURES:
+            self.mean = np.asarray(meta['mean'])
+            self.scale = np.asarray(meta['scale'])
+            self.matrix = store.extras['features']
+            self.norms = store.extras.get('feature_norms')
+            if self.norms is None:
+                self.norms = (self.matrix ** 2).sum(axis=1)
+            return
+        raw = self.raw()
+        self.mean = np.nanmean(raw, axis=0)
+        scale = np.nanstd(raw, axis=0)
+        self.scale = np.where(scale > 0, scale, 1.0)
+        self.matrix = self._standardize(raw, self.mean, self.scale)
+        self.matrix.flags.writeable = False
+        self.norms = (self.matrix ** 2).sum(axis=1)
+
+    @staticmethod
+    def _standardize(raw, mean, scale):
+        matrix = ((raw - mean) / scale).astype(np.float32)
+        return np.nan_to_num(matrix, copy=False)
+
+    def attach(self, store):
+        """Add the matrix to ``store`` so it is persisted with the catalog."""
+        store.extras['features'] = self.matrix
+        store.extras['feature_norms'] = self.norms
+        store.meta['features'] = self._meta(self.mean, self.scale)
+
+    @staticmethod
+    def _meta(mean, scale):
+        return {'columns': FEATURES, 'mean': mean.tolist(), 'scale': scale.tolist()}
+
+    @classmethod
+    def save_blocks(cls, store, writer, block_rows):
+        """
+        Compute the matrix for a (memory-mapped) ``store`` ``block_rows`` at a
+        time, straight into a ``columnar.StoreWriter``. Two passes over the
+        columns: mean, then spread around it.
+        """
+        rows = len(store)
+        blocks = [slice(start, start + block_rows) for start in range(0, rows, block_rows)]
+        columns = [store[c] for c in FEATURES]
+
+        def raw(block):
+            return np.column_stack([np.asarray(c[block], dtype=np.float64) for c in columns])
+
+        total, count = np.zeros(len(FEATURES)), np.zeros(len(FEATURES))
+        for block in blocks:
+            values = raw(block)
+            total += np.nansum(values, axis=0)
+            count += (~np.isnan(values)).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+        squares = np.zeros(len(FEATURES))
+        for block in blocks:
+            squares += np.nansum((raw(block) - mean) ** 2, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.sqrt(squares / count)
+        scale = np.where(scale > 0, scale, 1.0)
+
+        matrix = writer.allocate_extra('features', (rows, len(FEATURES)), np.float32)
+        norms = writer.allocate_extra('feature_norms', rows, np.float32)
+        for block in blocks:
+            matrix[block] = cls._standardize(raw(block), mean, scale)
+            norms[block] = (matrix[block] ** 2).sum(axis=1)
+        writer.meta['features'] = cls._meta(mean, scale)
+
+    def raw(self, positions=None):
+        columns = [np.asarray(self.store[c], dtype=np.float64) for c in FEATURES]
+        if positions is not None:
+            columns = [c[positions] for c in columns]
+        return np.column_stack(columns)
+
+    def scaled(self, raw):
+        return (raw - self.mean) / self.scale
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.norms.nbytes
+
+
+class TasteModel:
+    """Scaler statistics and centroids for one user's favorites, in raw units."""
+
+    def __init__(self, count=0, total=None, total_sq=None, centroids=None, sizes=None):
+        dims = len(FEATURES)
+        self.count = count
+        self.total = np.zeros(dims) if total is None else np.asarray(total, dtype=np.float64)
+        self.total_sq = np.zeros(dims) if total_sq is None else np.asarray(total_sq, dtype=np.float64)
+        self.centroids = np.empty((0, dims)) if centroids is None else np.asarray(centroids, dtype=np.float64).reshape(-1, dims)
+        self.sizes = np.empty(0) if sizes is None else np.asarray(sizes, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, points):
+        from sklearn.cluster import KMeans
+
+        model = cls(len(points), points.sum(axis=0), (points ** 2).sum(axis=0))
+        if not len(points):
+            return model
+        mean, scale = model.scaler()
+        n_clusters = min(N_CLUSTERS, len(np.unique(points, axis=0)))
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10).fit((points - mean) / scale)
+        model.centroids = kmeans.cluster_centers_ * scale + mean
+        model.sizes = np.bincount(kmeans.labels_, minlength=n_clusters).astype(np.float64)
+        return model
+
+    def scaler(self, floor=None):
+        mean = self.total / max(self.count, 1)
+        std = np.sqrt(np.maximum(self.total_sq / max(self.count, 1) - mean ** 2, 0))
+        scale = np.where(std > 0, std, 1.0) if floor is None else np.maximum(std, floor)
+        return mean, scale
+
+    def _nearest(self, point):
+        _, scale = self.scaler()
+        return int(np.argmin((((self.centroids - point) / scale) ** 2).sum(axis=1)))
+
+    def add(self, point):
+        self.count += 1
+        self.total += point
+        self.total_sq += point ** 2
+        if len(self.centroids) < N_CLUSTERS:
+            self.centroids = np.vstack([self.centroids, point])
+            self.sizes = np.append(self.sizes, 1.0)
+            return
+        # Online K-means step: move the nearest centroid towards the point
+        k = self._nearest(point)
+        self.sizes[k] += 1
+        self.centroids[k] += (point - self.centroids[k]) / self.sizes[k]
+
+    def remove(self, point):
+        if not self.count:
+            return
+        self.count -= 1
+        self.total -= point
+        self.total_sq -= point ** 2
+        if not len(self.centroids):
+            return
+        k = self._nearest(point)
+        self.sizes[k] -= 1
+        if self.sizes[k] <= 0 or not self.count:
+            self.centroids = np.delete(self.centroids, k, axis=0)
+            self.sizes = np.delete(self.sizes, k)
+        else:
+            self.centroids[k] -= (point - self.centroids[k]) / self.sizes[k]
+
+    def to_state(self):
+        return {
+            "features": FEATURES,
+            "count": self.count,
+            "total": self.total.tolist(),
+            "total_sq": self.total_sq.tolist(),
+            "centroids": self.centroids.tolist(),
+            "sizes": self.sizes.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        if state.get("features") != FEATURES:
+            return None
+        return cls(state["count"], state["total"], state["total_sq"], state["centroids"], state["sizes"])
+
+    def score(self, features):
+        """Squared distance of every catalog row to its nearest centroid."""
+        if not len(self.centroids):
+            return None
+        # ((raw - C) / s_u)^2 with raw = X * s_c + m_c equals
+        # ((X - C') * w)^2 with C' = (C - m_c) / s_c and w = s_c / s_u
+        _, user_scale = self.scaler(floor=features.scale * MIN_SCALE_FRACTION)
+        weights = (features.scale / user_scale).astype(np.float32)
+        centroids = (features.scaled(self.centroids) * weights).astype(np.float32)
+        weighted = features.matrix * weights
+        distances = (weighted ** 2).sum(axis=1, keepdims=True) - 2 * (weighted @ centroids.T) + (centroids ** 2).sum(axis=1)
+        return distances.min(axis=1)
+
+
+# Persistence
+
+def _favorite_positions(user_id, catalog):
+    return favorites.favorite_positions(user_id, catalog)
+
+
+def _stored_positions(user_id, catalog):
+    # From the database, which the persisted model has to agree with
+    return catalog.positions(Favorite.objects.filter(user_id=user_id).values_list('track_id', flat=True))
+
+
+def get_taste_model(user_id, catalog):
+    """Load the persisted model, fitting and storing it when there is none."""
+    profile = TasteProfile.objects.filter(user_id=user_id).first()
+    model = TasteModel.from_state(profile.state) if profile else None
+    if model is not None:
+        return model
+    # Fitted and saved under the profile's row lock, like updates, so an
+    # update never gets overwritten by a fit that started before it
+    with transaction.atomic():
+        profile, _ = TasteProfile.objects.select_for_update().get_or_create(user_id=user_id)
+        model = TasteModel.from_state(profile.state)
+        if model is None:
+            # K-means runs on the worker pool
+            profile.state = workers.run('fit', catalog, _stored_positions(user_id, catalog))
+            profile.save(update_fields=['state', 'updated_at'])
+            model = TasteModel.from_state(profile.state)
+    return model
+
+
+def forget_taste_model(user_id):
+    """Drop the persisted model so the next request refits it, e.g. after changes the views did not see."""
+    TasteProfile.objects.filter(user_id=user_id).update(state={})
+
+
+def favorite_added(user_id, track_ids, catalog):
+    _update(user_id, track_ids, catalog, TasteModel.add)
+
+
+def favorite_removed(user_id, track_ids, catalog):
+    _update(user_id, track_ids, catalog, TasteModel.remove)
+
+
+def _update(user_id, track_ids, catalog, apply):
+    if catalog is None:
+        return
+    points = catalog.features.raw(catalog.positions(track_ids))
+    # Read-modify-write under a row lock: concurrent changes for the same
+    # user apply one after the other instead of losing one, which no refit
+    # would ever correct
+    with transaction.atomic():
+        profile = TasteProfile.objects.select_for_update().filter(user_id=user_id).first()
+        model = TasteModel.from_state(profile.state) if profile else None
+        # No stored model yet: it is fitted from scratch on first use anyway
+        if model is None:
+            return
+        for point in points:
+            apply(model, point)
+        # A model that no longer counts the user's favorites (a fit that
+        # already saw this change, changes made outside the views) is
+        # refitted on next use rather than kept drifting
+        stale = model.count != len(_stored_positions(user_id, catalog))
+        profile.state = {} if stale else model.to_state()
+        profile.save(update_fields=['state', 'updated_at'])
+
+
+def recommend(user_id, catalog, n_recommendations=10):
+    """Row positions of the closest non-favorite songs, best first."""
+    model = get_taste_model(user_id, catalog)
+    # Scoring the whole catalog runs on the worker pool
+    return workers.run('rank', catalog, model.to_state(), _favorite_positions(user_id, catalog), n_recommendations)
+
+
+# Worker pool jobs, no database access
+
+def fit_state(catalog, positions):
+    """State of a taste model fitted to the favorites at ``positions``."""
+    return TasteModel.fit(catalog.features.raw(positions)).to_state()
+
+
+def rank(catalog, state, exclude, n_recommendations):
+    """Row positions closest to the model in ``state``, skipping ``exclude``."""
+    distances = TasteModel.from_state(state).score(catalog.features)
+    if distances is None:
+        return np.empty(0, dtype=np.int64)
+    distances[exclude] = np.inf
+    k = min(n_recommendations, int(np.isfinite(distances).sum()))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top], kind='stable')]
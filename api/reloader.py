@@ -0,0 +1,136 @@
+"""
+Background catalog reloads.
+
+A daemon thread polls the dataset CSV and the compiled catalog manifest every
+``CATALOG_RELOAD['INTERVAL']`` seconds (one ``stat`` and one small read), and
+SIGHUP or ``POST /api/catalog/reload/`` wake it up immediately. Once a
+change has stayed the same for one poll (so a file still being written isn't
+loaded) it builds and warms the new catalog on its own thread, restarts the worker
+pool processes so they load the new version, and then swaps the catalog in
+with ``install_catalog()``. Requests already running keep the catalog they
+started with; caches keyed by catalog version (prompt results, favorites)
+miss once and refill.
+"""
+import logging
+import os
+import signal
+import threading
+import time
+
+from django.conf import settings
+
+from . import workers
+from .catalog import get_catalog, reload_catalog, source_signature
+
+logger = logging.getLogger(__name__)
+
+
+def _options():
+    return getattr(settings, 'CATALOG_RELOAD', {})
+
+
+class CatalogReloader:
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.signature = source_signature()
+        self._pending = None
+        self._wake = threading.Event()
+        self._thread = None
+        self.checks = self.reloads = self.failures = 0
+        self.last_reload = None
+        self.last_error = None
+        self.reload_seconds = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='catalog-reloader', daemon=True)
+            self._thread.start()
+        return self
+
+    def request(self):
+        """Check for a new catalog now rather than at the next poll."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            forced = self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.check(force=forced)
+            except Exception as e:
+                # Keep serving the current catalog, try again next time
+                self.failures += 1
+                self.last_error = repr(e)
+                logger.exception("Catalog reload failed")
+
+    def check(self, force=False):
+        """Reload if the files changed (or ``force``); returns True if a new catalog was installed."""
+        self.checks += 1
+        signature = source_signature()
+        if not force:
+            if signature == self.signature:
+                self._pending = None
+                return False
+            if signature != self._pending:
+                # Changed since the last poll: the file may still be being
+                # written, wait until it stays the same for one interval
+                self._pending = signature
+                return False
+        self._pending = None
+        started = time.perf_counter()
+        catalog, reloaded = reload_catalog(on_built=lambda catalog: workers.worker_pool().restart())
+        # Only remember the signature once it has loaded, so failures are
+        # retried. Loading may have compiled the catalog, so take the
+        # manifest's version as it is now
+        self.signature = (signature[0], source_signature()[1])
+        if reloaded:
+            self.reloads += 1
+            self.last_reload = time.time()
+            self.reload_seconds = time.perf_counter() - started
+            logger.info("Catalog reloaded: version %s, %d rows", catalog.version, len(catalog))
+        return reloaded
+
+    def stats(self):
+        catalog = get_catalog()
+        return {
+            "interval": self.interval,
+            "version": catalog.version if catalog else None,
+            "checks": self.checks,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_reload": self.last_reload,
+            "reload_seconds": round(self.reload_seconds, 3) if self.reload_seconds is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+_reloader = None
+_reloader_lock = threading.Lock()
+
+
+def reloader():
+    """The process-wide reloader (not started), configured by ``CATALOG_RELOAD``."""
+    global _reloader
+    if _reloader is None:
+        with _reloader_lock:
+            if _reloader is None:
+                _reloader = CatalogReloader(interval=_options().get('INTERVAL', 5.0))
+    return _reloader
+
+
+def _on_sighup(signum, frame):
+    reloader().request()
+
+
+def start_reloader():
+    """Start watching for catalog changes, per ``CATALOG_RELOAD``; returns the reloader or None."""
+    options = _options()
+    if not options.get('WATCH', False) or os.environ.get(workers.WORKER_ENV):
+        return None
+    instance = reloader().start()
+    # Signal handlers can only be installed from the main thread
+    if options.get('SIGNAL', True) and hasattr(signal, 'SIGHUP') \
+            and threading.current_thread() is threading.main_thread() \
+            and signal.getsignal(signal.SIGHUP) in (signal.SIG_DFL, None):
+        signal.signal(signal.SIGHUP, _on_sighup)
+    return instance
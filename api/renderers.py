@@ -0,0 +1,234 @@
+"""
+Fast JSON rendering for song lists.
+
+Every catalog row's JSON object, minus the closing brace and the per-user
+``is_favorite`` flag, is encoded once per catalog into ``SongFragments``
+(persisted with compiled catalogs, so it is memory-mapped too). The cover
+URLs, shared by every song of an album, are not repeated per row: they are
+spliced in from the column dictionaries when rendering. Views
+return a ``SongList`` of row positions and ``SongListJSONRenderer`` splices
+the fragments together, adding only the flag, instead of going through a
+DataFrame, ``to_dict(orient='records')`` and a generic JSON encoder.
+"""
+import json
+
+import numpy as np
+from rest_framework.renderers import JSONRenderer
+
+from .timing import stage
+
+SONG_FIELDS = [
+    "track_id",
+    "track_name",
+    "artist_names",
+    "album_name",
+    "year",
+    "duration_ms",
+    "album_cover_64x64",
+    "album_cover_640x640"
+]
+
+# Trailing SONG_FIELDS rendered from their dictionaries (see SharedField)
+SHARED_FIELDS = ["album_cover_64x64", "album_cover_640x640"]
+
+FAVORITE_SUFFIX = {True: b',"is_favorite":true}', False: b',"is_favorite":false}', None: b'}'}
+
+
+def _dumps(value):
+    # Same output as DRF's default (UNICODE_JSON, COMPACT_JSON) settings
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _scalar(value):
+    # Missing numbers become null rather than the invalid JSON token NaN
+    return None if isinstance(value, float) and value != value else value
+
+
+def _needs_escaping(data, block=1 << 20):
+    # Bytes JSON strings escape: '"', backslash and control characters
+    for start in range(0, len(data), block):
+        chunk = np.asarray(data[start:start + block])
+        if ((chunk < 0x20) | (chunk == 0x22) | (chunk == 0x5c)).any():
+            return True
+    return False
+
+
+class SharedField:
+    """
+    A string field rendered as ``,"name":"`` + prefix + the dictionary bytes
+    of the row's code + ``"``, straight from the (memory-mapped) dictionary.
+    """
+
+    def __init__(self, field, column):
+        self.field = field
+        self.codes = column.codes
+        self.dictionary = column.dictionary
+        self.key = b',' + _dumps(field) + b':'
+        # Everything up to the value's own bytes, opening quote included
+        self.opening = self.key + _dumps(self.dictionary.prefix)[:-1]
+        self._data = memoryview(np.ascontiguousarray(self.dictionary.data))
+        self.plain = not _needs_escaping(self.dictionary.data)
+
+    def parts(self, positions):
+        """``,"name":value`` of each row of ``positions``."""
+        codes = np.asarray(self.codes[positions])
+        if self.plain and not (codes < 0).any():
+            offsets = self.dictionary.offsets
+            data, opening = self._data, self.opening
+            return [opening + data[start:end] + b'"' for start, end in
+                    zip(np.asarray(offsets[codes]).tolist(), np.asarray(offsets[codes + 1]).tolist())]
+        return [self.key + _dumps(value) for value in self.dictionary.take(codes).tolist()]
+
+
+def shared_fields(store):
+    """The SHARED_FIELDS of ``store`` (all or none: they must be dictionary encoded)."""
+    from .columnar import StringColumn
+
+    if all(isinstance(store[field], StringColumn) for field in SHARED_FIELDS):
+        return list(SHARED_FIELDS)
+    return []
+
+
+class SongFragments:
+    """
+    Pre-encoded ``{"track_id":...,"duration_ms":...`` per row, plus the
+    ``shared`` fields that complete it.
+    """
+
+    def __init__(self, data, offsets, shared=()):
+        self.data = data
+        self.offsets = offsets
+        self.shared = list(shared)
+        self._blob = data if isinstance(data, bytes) else memoryview(data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.rows([position])[0]
+
+    def rows(self, positions):
+        """The JSON of each row of ``positions`` (ints), without the closing brace."""
+        positions = np.asarray(positions, dtype=np.int64)
+        blob = self._blob
+        heads = [blob[start:end] for start, end in
+                 zip(np.asarray(self.offsets[positions]).tolist(), np.asarray(self.offsets[positions + 1]).tolist())]
+        if not self.shared:
+            return [bytes(head) for head in heads]
+        return [b''.join(parts) for parts in zip(heads, *(field.parts(positions) for field in self.shared))]
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.offsets.nbytes
+
+    @classmethod
+    def build(cls, store, shared=None):
+        shared = shared_fields(store) if shared is None else shared
+        data, offsets = cls.encode(store, shared)
+        return cls(data, offsets, [SharedField(field, store[field]) for field in shared])
+
+    @staticmethod
+    def encode(store, shared=()):
+        """``(data, offsets)`` of the fragments of every row of ``store``, leaving out ``shared`` fields."""
+        from .columnar import ListColumn, StringColumn
+
+        parts = []
+        for field in SONG_FIELDS:
+            if field in shared:
+                continue
+            column = store[field]
+            prefix = _dumps(field) + b':'
+            if isinstance(column, ListColumn):
+                # Encode each distinct value once, then join per row
+                encoded = [_dumps(s) for s in column.dictionary.strings[:-1].tolist()]
+                values = column.values.tolist()
+                bounds = column.offsets.tolist()
+                parts.append([
+                    prefix + b'[' + b','.join([encoded[v] for v in values[bounds[i]:bounds[i + 1]]]) + b']'
+                    for i in range(len(store))
+                ])
+            elif isinstance(column, StringColumn):
+                encoded = [prefix + _dumps(s) for s in column.dictionary.strings.tolist()]
+                parts.append([encoded[c] for c in column.codes.tolist()])
+            else:
+                parts.append([prefix + _dumps(_scalar(v)) for v in np.asarray(column).tolist()])
+
+        rows = [b'{' + b','.join(fields) for fields in zip(*parts)]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=offsets[1:])
+        return b''.join(rows), offsets
+
+    def attach(self, store):
+        """Add the fragments to ``store`` so they are persisted with the catalog."""
+        store.extras['song_fragments'] = np.frombuffer(self.data, dtype=np.uint8)
+        store.extras['song_fragment_offsets'] = self.offsets
+        store.meta['song_fragments'] = self.meta([field.field for field in self.shared])
+
+    @staticmethod
+    def meta(shared):
+        return {'fields': SONG_FIELDS, 'shared': shared}
+
+    @classmethod
+    def from_store(cls, store):
+        shared = shared_fields(store)
+        if 'song_fragments' in store.extras and store.meta.get('song_fragments') == cls.meta(shared):
+            return cls(store.extras['song_fragments'], store.extras['song_fragment_offsets'],
+                       [SharedField(field, store[field]) for field in shared])
+        return cls.build(store, shared)
+
+
+class SongList:
+    """
+    Songs at ``positions`` of ``catalog``, ready to render.
+
+    ``favorites`` are the sorted row positions of the user's favorites; each
+    song gets an ``is_favorite`` flag unless it is ``None``.
+    """
+
+    def __init__(self, catalog, positions, favorites=None, flag=None):
+        self.catalog = catalog
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.favorites = favorites
+        self.flag = flag
+
+    def __len__(self):
+        return len(self.positions)
+
+    def flags(self):
+        if self.favorites is None:
+            return [self.flag] * len(self.positions)
+        return np.isin(self.positions, self.favorites).tolist()
+
+    def encode(self):
+        rows = self.catalog.song_fragments.rows(self.positions)
+        return b'[' + b','.join([row + FAVORITE_SUFFIX[f] for row, f in zip(rows, self.flags())]) + b']'
+
+    def to_records(self):
+        """Plain Python records, for renderers other than ``SongListJSONRenderer``."""
+        return json.loads(self.encode())
+
+
+class SongListJSONRenderer(JSONRenderer):
+    """JSONRenderer that writes ``SongList`` values from pre-encoded fragments."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with stage('serialize'):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, SongList):
+            return data.encode()
+        if isinstance(data, dict) and any(isinstance(v, SongList) for v in data.values()):
+            # Encode the small envelope normally and splice the lists in
+            items = [
+                _dumps(str(key)) + b':' + (value.encode() if isinstance(value, SongList) else self._encode(value))
+                for key, value in data.items()
+            ]
+            return b'{' + b','.join(items) + b'}'
+        return super().render(data, accepted_media_type, renderer_context)
+
+    def _encode(self, value):
+        return json.dumps(
+            value, cls=self.encoder_class, ensure_ascii=self.ensure_ascii,
+            allow_nan=not self.strict, separators=(',', ':') if self.compact else (', ', ': '),
+        ).encode('utf-8')
@@ -0,0 +1,112 @@
+"""
+Per-process LRU/TTL cache for catalog query results.
+
+Entries are small read-only arrays of row positions, keyed by a hashable
+description of the query (e.g. a ``PromptIntent``) and scoped to one catalog
+version: the first lookup against a new version drops everything cached for
+the previous one.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .timing import stage
+
+
+class ResultCache:
+    def __init__(self, max_entries=4096, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, version, key, value):
+        value.flags.writeable = False
+        expires = time.monotonic() + self.timeout if self.timeout else None
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, version, key, compute):
+        # The lookup and store are timed as the 'cache' stage; compute()
+        # times its own stages
+        with stage('cache'):
+            value = self.get(version, key)
+        if value is None:
+            # Computed outside the lock; a concurrent miss just computes twice
+            value = compute()
+            with stage('cache'):
+                self.set(version, key, value)
+        return value
+
+    async def aget_or_compute(self, version, key, compute):
+        """``get_or_compute()`` with ``compute`` returning an awaitable."""
+        with stage('cache'):
+            value = self.get(version, key)
+        if value is None:
+            value = await compute()
+            with stage('cache'):
+                self.set(version, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "timeout": self.timeout,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+_prompt_cache = None
+
+
+def prompt_cache():
+    """The process-wide cache of prompt results, configured by ``PROMPT_CACHE``."""
+    global _prompt_cache
+    if _prompt_cache is None:
+        options = getattr(settings, 'PROMPT_CACHE', {})
+        _prompt_cache = ResultCache(options.get('MAX_ENTRIES', 4096), options.get('TIMEOUT', 300))
+    return _prompt_cache
@@ -0,0 +1,29 @@
+"""
+Keep the favorites cache (``api.favorites``) and the persisted taste models
+(``api.recommender``) in step with every change to ``Favorite`` rows, not
+only those made through the API views.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import favorites, recommender
+from .models import Favorite
+
+
+@receiver(post_save, sender=Favorite, dispatch_uid='favorite_saved')
+@receiver(post_delete, sender=Favorite, dispatch_uid='favorite_deleted')
+def favorite_changed(sender, instance, **kwargs):
+    if favorites.written_through():
+        return
+    # After the commit, so a new version never goes with the old favorites
+    transaction.on_commit(partial(_changed, instance.user_id))
+
+
+def _changed(user_id):
+    favorites.changed(user_id)
+    # The views update the taste model incrementally; for anything else it
+    # is simply refitted
+    recommender.forget_taste_model(user_id)
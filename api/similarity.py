@@ -0,0 +1,76 @@
+"""
+Exact nearest-neighbour search over the standardized audio feature matrix.
+
+With only a handful of features an exact search is both simpler and faster
+than a tree: squared distances are ``|x|^2 - 2 x.q + |q|^2``, computed as a
+matrix product over fixed-size row blocks so memory stays bounded, keeping
+the best ``k`` per query with ``argpartition``. Many query tracks are
+answered in one call, sharing each pass over the matrix.
+"""
+import numpy as np
+
+BLOCK_ROWS = 1 << 16
+
+
+class SimilarityIndex:
+    def __init__(self, features):
+        self.matrix = features.matrix
+        self.norms = features.norms
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def vectors(self, positions):
+        return np.asarray(self.matrix[positions], dtype=np.float32)
+
+    def query(self, vectors, k=10, exclude=None, exclude_self=None):
+        """
+        Top ``k`` rows closest to each query vector.
+
+        ``exclude`` is an array of positions never returned; ``exclude_self``
+        gives, per query, one more position to skip (e.g. the query track).
+        Returns ``(positions, distances)``, both shaped ``(queries, k)`` and
+        ordered closest first.
+        """
+        queries = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        k = max(0, min(k, len(self) - (0 if exclude is None else len(exclude)) - (exclude_self is not None)))
+        if not k or not len(queries):
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        query_norms = (queries ** 2).sum(axis=1)[:, None]
+        best_pos = np.empty((len(queries), 0), dtype=np.int64)
+        best_dist = np.empty((len(queries), 0), dtype=np.float32)
+        rows = np.arange(len(queries))[:, None]
+        for start in range(0, len(self), BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, len(self))
+            block = self.matrix[start:end]
+            distances = self.norms[start:end] - 2 * (queries @ block.T) + query_norms
+            if exclude is not None:
+                skipped = exclude[(exclude >= start) & (exclude < end)] - start
+                distances[:, skipped] = np.inf
+            if exclude_self is not None:
+                inside = (exclude_self >= start) & (exclude_self < end)
+                distances[inside, exclude_self[inside] - start] = np.inf
+            take = min(k, end - start)
+            top = np.argpartition(distances, take - 1, axis=1)[:, :take]
+            best_pos = np.hstack([best_pos, top + start])
+            best_dist = np.hstack([best_dist, distances[rows, top]])
+            if best_pos.shape[1] > k:
+                keep = np.argpartition(best_dist, k - 1, axis=1)[:, :k]
+                best_pos, best_dist = best_pos[rows, keep], best_dist[rows, keep]
+
+        order = np.argsort(best_dist, axis=1, kind='stable')
+        best_pos, best_dist = best_pos[rows, order], best_dist[rows, order]
+        return best_pos, np.maximum(best_dist, 0)
+
+    def similar_to(self, positions, k=10, exclude=None):
+        """Neighbours for each of the given catalog rows, excluding the row itself."""
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.query(self.vectors(positions), k, exclude=exclude, exclude_self=positions)
+
+    def similar_to_centroid(self, positions, k=10):
+        """Neighbours of the mean vector of ``positions``, excluding them."""
+        positions = np.asarray(positions, dtype=np.int64)
+        centroid = self.vectors(positions).mean(axis=0)
+        found, distances = self.query(centroid, k, exclude=positions)
+        return found[0], distances[0]
@@ -1,3 +1,1160 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from rapidfuzz import fuzz
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .catalog import (
+    Catalog, build_catalog, get_catalog, install_catalog, installed_catalog, read_songs_csv, reload_catalog, warm_up,
+)
+from . import recommender, timing
+from .columnar import ListColumn, StringColumn, StringDictionary, common_prefix, compact_numeric
+from .genres import GenreMatcher
+from .indexes import InvertedIndex, intersect
+from .ingest import SeenIds, compile_csv
+from .matcher import PhraseMatcher, longest, tokenize
+from .models import Favorite, TasteProfile
+from .prompthandler import PromptEngine, PromptIntent, get_fuzzy_genre_match, intent_positions
+from .reloader import CatalogReloader
+from .renderers import SONG_FIELDS, SongList, SongListJSONRenderer
+from .result_cache import ResultCache, prompt_cache
+from .similarity import SimilarityIndex
+from .workers import JobTimeout, PoolBusy, WorkerPool
+
+COLUMNS = [
+    'track_id', 'track_name', 'artist_names', 'album_name', 'year', 'duration_ms',
+    'album_cover_64x64', 'album_cover_640x640', 'popularity', 'acousticness',
+    'energy', 'valence', 'tempo', 'danceability', 'genres',
+]
+
+
+def song(track_id, name, artists, year, popularity, genres, energy=0.5, valence=0.5):
+    return {
+        'track_id': track_id,
+        'track_name': name,
+        'artist_names': repr(artists),
+        'album_name': f"album {name}",
+        'year': year,
+        'duration_ms': 200000,
+        'album_cover_64x64': f"https://i.scdn.co/image/ab67616d00004851{track_id}",
+        'album_cover_640x640': f"https://i.scdn.co/image/ab67616d0000b273{track_id}",
+        'popularity': popularity,
+        'acousticness': 0.5,
+        'energy': energy,
+        'valence': valence,
+        'tempo': 120.0,
+        'danceability': 0.5,
+        'genres': repr(genres),
+    }
+
+
+SONGS = [
+    song('t1', 'gold wild', ['Gold'], 2017, 83, ['rock', 'indie'], energy=0.9),
+    song('t2', 'night wild', ['Rain', 'Blue'], 2008, 76, [], valence=0.9),
+    song('t3', 'wild rain', ['Night Love'], 2001, 55, ['jazz']),
+    song('t4', 'fire ocean', ['Heart'], 1981, 46, ['rock'], energy=0.1),
+    song('t5', 'sky love', ['Gold', 'Heart'], 2017, 90, ['pop', 'rock'], valence=0.1),
+    song('t6', 'blue fire', ['Sky'], 2020, 12, ['pop']),
+]
+
+
+def write_songs_csv(path, songs):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        writer.writerows(songs)
+    return path
+
+
+class CatalogFilesMixin:
+    """A temporary directory for CSVs and compiled catalogs."""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def in_memory_catalog(self, songs=SONGS):
+        source = write_songs_csv(self.directory / 'songs.csv', songs)
+        return Catalog.from_frame(read_songs_csv(source), source=source)
+
+
+class CatalogAPITestCase(CatalogFilesMixin, TestCase):
+    """API tests against a small installed catalog, as a logged-in user."""
+
+    def setUp(self):
+        super().setUp()
+        self.catalog = self.in_memory_catalog()
+        self.addCleanup(install_catalog, install_catalog(self.catalog))
+        # A favorites cache of the test's own, like the shared one in settings
+        self.enterContext(override_settings(CACHES={
+            **settings.CACHES,
+            'favorites': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': str(self.directory / 'favorites'),
+            },
+        }))
+        caches['default'].clear()
+        self.user = User.objects.create_user('listener')
+        self.client = self.client_for(self.user)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def as_worker(self):
+        """Use a favorites cache instance of its own, as another worker process would."""
+        return mock.patch('api.favorites._cache', return_value=caches.create_connection('favorites'))
+
+
+class SeenIdsTests(TestCase):
+    def test_empty_add_keeps_lookups_working(self):
+        seen = SeenIds()
+        seen.add(seen.hash(['a', 'b']))
+        seen.add(seen.hash([]))
+        self.assertEqual(len(seen.runs), 1)
+        self.assertEqual(seen.contains(seen.hash(['a', 'c'])).tolist(), [True, False])
+
+
+class InvertedIndexTests(CatalogFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Mixed case and a genre listed twice in one row
+        songs = SONGS + [song('t7', 'loud', ['GOLD', 'Storm'], 2017, 60, ['Rock', 'rock ', 'Metal'])]
+        self.catalog = self.in_memory_catalog(songs)
+
+    def scan(self, column, term):
+        # What the per-row ``.apply`` used to compute
+        rows = self.catalog.store[column].decode()
+        return [i for i, values in enumerate(rows) if term in {v.casefold().strip() for v in values}]
+
+    def test_matches_row_scans(self):
+        for column, index in (('genres', self.catalog.genre_index), ('artist_names', self.catalog.artist_index)):
+            for block_rows in (None, 2, 3):
+                built = InvertedIndex.from_list_column(self.catalog.store[column], block_rows=block_rows)
+                self.assertEqual(built.terms, index.terms)
+                for term in index.terms:
+                    with self.subTest(column=column, term=term, block_rows=block_rows):
+                        self.assertEqual(index.get(term).tolist(), self.scan(column, term))
+                        self.assertEqual(built.get(term).tolist(), self.scan(column, term))
+        self.assertEqual(self.catalog.genre_index.get('rock').tolist(), [0, 3, 4, 6])
+
+    def test_lookups_ignore_case(self):
+        index = self.catalog.artist_index
+        self.assertEqual(index.get('gold').tolist(), [0, 4, 6])
+        self.assertEqual(index.get(' GoLd ').tolist(), index.get('gold').tolist())
+        self.assertIn('NIGHT LOVE', index)
+        self.assertEqual(index.get('nobody').tolist(), [])
+
+    def test_years_and_intersections(self):
+        years = self.catalog.year_index
+        self.assertEqual(years.get(2017).tolist(), [0, 4, 6])
+        rock_2017 = intersect(self.catalog.genre_index.get('rock'), years.get(2017), None)
+        self.assertEqual(rock_2017.tolist(), [0, 4, 6])
+        self.assertIsNone(intersect(None, None))
+        self.assertEqual(intersect(years.get(1981), self.catalog.genre_index.get('pop')).tolist(), [])
+
+
+class CompactStoreTests(CatalogFilesMixin, TestCase):
+    def test_numbers_take_the_smallest_type_that_fits(self):
+        for values, dtype in (
+            ([1, 2, 3], np.int16), ([-32768, 32767], np.int16), ([0, 40000], np.int32),
+            ([0, 1 << 40], np.int64), (np.array([], dtype=np.int64), np.int16), ([0.5, np.nan], np.float32),
+        ):
+            with self.subTest(values=values):
+                compact = compact_numeric(np.array(values))
+                self.assertEqual(compact.dtype, dtype)
+                np.testing.assert_array_equal(compact, values)
+        self.assertEqual(compact_numeric(np.array([True])).dtype, bool)
+
+    def test_shared_prefixes_are_stored_once(self):
+        urls = ['https://i.scdn.co/image/a', 'https://i.scdn.co/image/bb']
+        self.assertEqual(common_prefix(urls), 'https://i.scdn.co/image/')
+        self.assertEqual(common_prefix(['rock', 'rocksteady']), '')
+        self.assertEqual(common_prefix(urls[:1]), '')
+        dictionary = StringDictionary.from_strings(urls + ['https://i.scdn.co/image/é'], common_prefix(urls))
+        self.assertEqual(dictionary.data.tobytes(), 'abbé'.encode())
+        self.assertEqual(dictionary.take([2, -1, 0]).tolist(), [urls[0][:-1] + 'é', None, urls[0]])
+
+    def test_catalog_columns(self):
+        catalog = self.in_memory_catalog()
+        store = catalog.store
+        self.assertEqual({store[name].dtype for name in ('year', 'popularity', 'duration_ms')}, {np.dtype(np.int16), np.dtype(np.int32)})
+        self.assertEqual(store['energy'].dtype, np.float32)
+        for name in ('track_name', 'album_cover_64x64'):
+            self.assertIsInstance(store[name], StringColumn)
+        self.assertIsInstance(store['genres'], ListColumn)
+        self.assertEqual(store['album_cover_640x640'].dictionary.prefix, 'https://i.scdn.co/image/ab67616d0000b273t')
+        # Decoded back to the values read from the CSV
+        frame = read_songs_csv(catalog.source)
+        decoded = store.to_frame()
+        self.assertEqual(decoded['track_name'].dtype, 'category')
+        for name in COLUMNS:
+            # Floats were narrowed to float32
+            if isinstance(store[name], np.ndarray) and store[name].dtype.kind == 'f':
+                np.testing.assert_allclose(decoded[name], frame[name], rtol=1e-6)
+            else:
+                self.assertEqual(decoded[name].tolist(), frame[name].tolist(), name)
+        self.assertLess(store.nbytes, frame.memory_usage(index=False, deep=True).sum())
+
+    def test_catalog_stats_command(self):
+        source = write_songs_csv(self.directory / 'songs.csv', SONGS)
+        out = io.StringIO()
+        call_command('catalog_stats', source=str(source), compiled=str(self.directory / 'catalog'), json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['rows'], len(SONGS))
+        self.assertEqual([c['column'] for c in report['columns']], COLUMNS)
+        self.assertEqual(report['compact_bytes'], sum(c['compact_bytes'] for c in report['columns']))
+        self.assertLess(report['compact_bytes'], report['dataframe_bytes'])
+        self.assertIn('year: int16', [f"{c['column']}: {c['type']}" for c in report['columns']])
+
+        out = io.StringIO()
+        call_command('catalog_stats', source=str(source), compiled=str(self.directory / 'catalog'), stdout=out)
+        self.assertIn(f"{len(SONGS)} tracks from", out.getvalue())
+
+
+class CompileCsvTests(CatalogFilesMixin, TestCase):
+    def compile(self, songs, chunk_rows):
+        source = write_songs_csv(self.directory / 'songs.csv', songs)
+        compiled = self.directory / f'catalog-{chunk_rows}'
+        stats = compile_csv(source, compiled, chunk_rows=chunk_rows)
+        return stats, build_catalog(source, compiled), Catalog.from_frame(read_songs_csv(source))
+
+    def assertSameCatalog(self, compiled, in_memory):
+        self.assertTrue(compiled.mapped)
+        self.assertEqual(compiled.store.to_frame().to_dict('records'), in_memory.store.to_frame().to_dict('records'))
+        renderer = SongListJSONRenderer()
+        everything = np.arange(len(in_memory))
+        self.assertEqual(
+            renderer.render(SongList(compiled, everything)), renderer.render(SongList(in_memory, everything))
+        )
+        for index in ('genre_index', 'artist_index', 'year_index'):
+            expected = getattr(in_memory, index)
+            actual = getattr(compiled, index)
+            self.assertEqual(list(actual.terms), list(expected.terms))
+            for term in expected.terms:
+                self.assertEqual(actual.get(term).tolist(), expected.get(term).tolist())
+        np.testing.assert_allclose(compiled.features.matrix, in_memory.features.matrix, rtol=1e-5, atol=1e-5)
+        self.assertEqual(
+            compiled.positions(['t6', 'missing', 't1']).tolist(), in_memory.positions(['t6', 'missing', 't1']).tolist()
+        )
+
+    def test_chunked_matches_in_memory(self):
+        for chunk_rows in (1, 2, 4, 100):
+            with self.subTest(chunk_rows=chunk_rows):
+                stats, compiled, in_memory = self.compile(SONGS, chunk_rows)
+                self.assertEqual(stats["rows"], len(SONGS))
+                self.assertSameCatalog(compiled, in_memory)
+
+    def test_duplicate_only_chunks(self):
+        # The first occurrence wins; with chunks of 2 the last two chunks
+        # hold nothing but duplicates
+        songs = SONGS[:4] + [dict(SONGS[1], track_name='repeat'), dict(SONGS[0], popularity=1)] \
+            + [dict(SONGS[3]), dict(SONGS[2])] + SONGS[4:]
+        for chunk_rows in (1, 2):
+            with self.subTest(chunk_rows=chunk_rows):
+                stats, compiled, in_memory = self.compile(songs, chunk_rows)
+                self.assertEqual((stats["rows"], stats["duplicates"]), (len(SONGS), 4))
+                self.assertEqual(compiled.store['track_name'].decode(compiled.positions(['t2'])).tolist(), ['night wild'])
+                self.assertSameCatalog(compiled, in_memory)
+
+
+class PhraseMatcherTests(TestCase):
+    def setUp(self):
+        self.matcher = PhraseMatcher()
+        for artist in ('Love', 'Night', 'Night Love', 'AC/DC', 'Gold'):
+            self.matcher.add(artist, 'artist')
+        self.matcher.add('high energy', 'mood', 'intense')
+        self.matcher.add('2008', 'year', 2008)
+
+    def found(self, text):
+        return [(m.kind, m.value, m.start, m.end) for m in self.matcher.find_all(text)]
+
+    def test_finds_every_phrase_on_token_boundaries(self):
+        self.assertEqual(self.found('Night Love, high-energy ac dc 2008'), [
+            ('artist', 'Night', 0, 1), ('artist', 'Night Love', 0, 2), ('artist', 'Love', 1, 2),
+            ('mood', 'intense', 2, 4), ('artist', 'AC/DC', 4, 6), ('year', 2008, 6, 7),
+        ])
+        # Never inside a word
+        self.assertEqual(self.found('golden nightlove 20080 high'), [])
+
+    def test_longest_then_earliest(self):
+        self.assertEqual(longest(self.matcher.find_all('love night love')).value, 'Night Love')
+        self.assertEqual(longest(self.matcher.find_all('gold or love')).value, 'Gold')
+        self.assertIsNone(longest([]))
+
+    def test_first_value_wins(self):
+        self.matcher.add('night', 'artist', 'someone else')
+        self.assertEqual(self.found('night'), [('artist', 'Night', 0, 1)])
+
+
+class GenreMatcherTests(TestCase):
+    GENRES = ['lo-fi', 'dance pop', 'pop', 'k-pop', 'jazz', 'acid jazz', 'hip hop', 'rock', 'indie rock', 'drum and bass']
+
+    def setUp(self):
+        self.matcher = GenreMatcher(self.GENRES)
+
+    def scores(self, prompt, score_cutoff=80):
+        # Every genre against every n-gram, without the candidate pruning
+        tokens = tokenize(prompt)
+        best = {}
+        for n in range(1, self.matcher.max_tokens + 1):
+            for i in range(len(tokens) - n + 1):
+                phrase = tokens[i:i + n]
+                for genre, compact, ordered in zip(self.GENRES, self.matcher.compact, self.matcher.sorted):
+                    score = max(fuzz.ratio(''.join(phrase), compact), fuzz.ratio(' '.join(sorted(phrase)), ordered))
+                    if score >= score_cutoff:
+                        best[genre] = max(best.get(genre, 0), score)
+        return best
+
+    def test_spelling_variants(self):
+        for prompt, genre in (
+            ('some lofi beats', 'lo-fi'), ('pop dance for tonight', 'dance pop'), ('jaz please', 'jazz'),
+            ('HIP-HOP', 'hip hop'), ('drum & bass', 'drum and bass'), ('kpop', 'k-pop'),
+        ):
+            with self.subTest(prompt=prompt):
+                self.assertEqual(self.matcher.best(prompt), genre)
+        self.assertIsNone(self.matcher.best('classical piano'))
+        self.assertIsNone(GenreMatcher([]).best('rock'))
+
+    def test_more_specific_genre_wins_ties(self):
+        self.assertEqual(self.matcher.match('indie rock', limit=2), [('indie rock', 100.0), ('rock', 100.0)])
+        self.assertEqual(self.matcher.best('acid jazz'), 'acid jazz')
+
+    def test_pruning_keeps_every_match(self):
+        # At the cutoffs prompts are matched with; far lower ones may lose
+        # weak matches to the trigram prefilter
+        for prompt in ('chill lofi jazz', 'indie rok and dance pop', 'popp k pop', 'drum n bass hiphop', 'rock'):
+            for score_cutoff in (80, 90):
+                with self.subTest(prompt=prompt, score_cutoff=score_cutoff):
+                    expected = self.scores(prompt, score_cutoff)
+                    found = dict(self.matcher.match(prompt, limit=len(self.GENRES), score_cutoff=score_cutoff))
+                    self.assertEqual(found.keys(), expected.keys())
+                    for genre, score in found.items():
+                        self.assertAlmostEqual(score, expected[genre], places=3)
+
+    def test_fuzzy_genre_match_takes_either(self):
+        self.assertEqual(get_fuzzy_genre_match('dance pop', self.matcher), 'dance pop')
+        self.assertEqual(get_fuzzy_genre_match('pop dance', self.GENRES), 'dance pop')
+        self.assertIsNone(get_fuzzy_genre_match('metal', self.GENRES))
+
+
+class SongListRenderingTests(CatalogFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        awkward = [
+            song('t7', 'say "hi" \\ back\tslash', ['Beyoncé', 'Ünïcödé 🎵'], '', 10, ['k-pop']),
+            dict(song('t8', 'other covers', [], 1999, 20, []), album_cover_64x64='', album_cover_640x640='x"y'),
+        ]
+        self.catalog = self.in_memory_catalog(SONGS + awkward)
+
+    def records(self, positions, favorites=None):
+        # What the views used to return: to_dict(orient='records') plus the flag
+        frame = self.catalog.store.to_frame()
+        records = frame.iloc[positions][SONG_FIELDS].to_dict(orient='records')
+        for position, record in zip(positions, records):
+            record.update({k: None for k, v in record.items() if isinstance(v, float) and v != v})
+            if favorites is not None:
+                record['is_favorite'] = position in favorites
+        return records
+
+    def test_same_json_as_records(self):
+        renderer = SongListJSONRenderer()
+        for positions, favorites in (([7, 0, 6, 3], [3, 7]), ([], []), (list(range(8)), None), ([6], [])):
+            with self.subTest(positions=positions, favorites=favorites):
+                rendered = renderer.render(SongList(self.catalog, positions, favorites))
+                self.assertEqual(rendered, JSONRenderer().render(self.records(positions, favorites)))
+
+    def test_missing_values(self):
+        songs = SongList(self.catalog, [6, 7], []).to_records()
+        self.assertIsNone(songs[0]['year'])
+        self.assertEqual(songs[0]['track_name'], 'say "hi" \\ back\tslash')
+        self.assertEqual((songs[1]['artist_names'], songs[1]['album_cover_640x640']), ([], 'x"y'))
+
+    def test_lists_inside_a_response(self):
+        data = {'t1': SongList(self.catalog, [1, 2], [2]), 'gone': None, 'page': 2}
+        rendered = SongListJSONRenderer().render(data)
+        self.assertEqual(rendered, JSONRenderer().render({'t1': self.records([1, 2], [2]), 'gone': None, 'page': 2}))
+        # Not a song list: rendered as usual
+        self.assertEqual(SongListJSONRenderer().render({'a': [1]}), b'{"a":[1]}')
+
+
+class LazyLoadingTests(CatalogFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = write_songs_csv(self.directory / 'songs.csv', SONGS)
+        self.enterContext(override_settings(
+            CATALOG_CSV_PATH=self.source, CATALOG_COMPILED_PATH=self.directory / 'catalog',
+        ))
+        self.addCleanup(install_catalog, install_catalog(None))
+
+    def test_imports_load_nothing_heavy(self):
+        code = (
+            "import sys, django; django.setup(); import api.urls, api.admin; from api import catalog; "
+            "print(sorted(m for m in ('pandas', 'sklearn', 'rapidfuzz') if m in sys.modules), catalog.installed_catalog())"
+        )
+        # A fresh interpreter, with the settings this one uses
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, check=True)
+        self.assertEqual(result.stdout.strip(), '[] None')
+
+    def test_first_use_loads(self):
+        self.assertIsNone(installed_catalog())
+        catalog = get_catalog()
+        self.assertEqual(len(catalog), len(SONGS))
+        self.assertIs(get_catalog(), catalog)
+        self.assertIs(installed_catalog(), catalog)
+
+    def test_failed_loads_are_retried(self):
+        with override_settings(CATALOG_CSV_PATH=self.directory / 'missing.csv'), self.assertLogs('api.catalog', 'ERROR'):
+            self.assertIsNone(get_catalog())
+        self.assertEqual(len(get_catalog()), len(SONGS))
+
+    def test_warm_up(self):
+        with override_settings(CATALOG_WARMUP={'ENABLED': False}):
+            self.assertIsNone(warm_up())
+            self.assertIsNone(installed_catalog())
+        with override_settings(CATALOG_WARMUP={'ENABLED': True}):
+            self.assertIsNone(warm_up())
+            self.assertIsNotNone(installed_catalog().warm_seconds)
+
+    def test_warm_up_in_the_background(self):
+        with override_settings(CATALOG_WARMUP={'ENABLED': True, 'BACKGROUND': True}):
+            thread = warm_up()
+        thread.join(60)
+        self.assertEqual(len(installed_catalog()), len(SONGS))
+
+
+class CatalogReloadTests(CatalogFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = write_songs_csv(self.directory / 'songs.csv', SONGS)
+        self.enterContext(override_settings(
+            CATALOG_CSV_PATH=self.source, CATALOG_COMPILED_PATH=self.directory / 'catalog',
+        ))
+        self.addCleanup(install_catalog, install_catalog(None))
+
+    def change_dataset(self):
+        write_songs_csv(self.source, SONGS + [song('t7', 'new', ['Storm'], 2017, 99, ['rock'])])
+
+    def test_swaps_in_new_versions_only(self):
+        first, reloaded = reload_catalog()
+        self.assertTrue(reloaded)
+        self.assertTrue(first.mapped)
+        self.assertIs(get_catalog(), first)
+        self.assertEqual(reload_catalog(), (first, False))
+
+        self.change_dataset()
+        # Built and warmed before the swap; requests meanwhile see the old one
+        on_built = mock.Mock(side_effect=lambda catalog: self.assertIs(get_catalog(), first))
+        second, reloaded = reload_catalog(on_built=on_built)
+        self.assertTrue(reloaded)
+        on_built.assert_called_once_with(second)
+        self.assertIs(get_catalog(), second)
+        self.assertNotEqual(second.version, first.version)
+        self.assertEqual(len(second), len(SONGS) + 1)
+        self.assertIsNotNone(second.warm_seconds)
+
+    def test_reloader_waits_for_the_file_to_settle(self):
+        install_catalog(build_catalog())
+        reloader = CatalogReloader()
+        with mock.patch('api.workers.worker_pool') as worker_pool:
+            self.assertFalse(reloader.check())
+            self.change_dataset()
+            # Changed since the last poll: maybe still being written
+            self.assertFalse(reloader.check())
+            worker_pool.assert_not_called()
+            self.assertTrue(reloader.check())
+            worker_pool.return_value.restart.assert_called_once_with()
+            self.assertFalse(reloader.check())
+        self.assertEqual(len(get_catalog()), len(SONGS) + 1)
+        self.assertEqual((reloader.stats()['checks'], reloader.stats()['reloads']), (4, 1))
+
+    def test_forced_check_skips_the_wait(self):
+        install_catalog(build_catalog())
+        reloader = CatalogReloader()
+        self.change_dataset()
+        with mock.patch('api.workers.worker_pool'):
+            self.assertTrue(reloader.check(force=True))
+            # Nothing new to load
+            self.assertFalse(reloader.check(force=True))
+
+    def test_failed_reloads_are_retried(self):
+        install_catalog(build_catalog())
+        reloader = CatalogReloader()
+        self.change_dataset()
+        self.assertFalse(reloader.check())
+        with mock.patch('api.reloader.reload_catalog', side_effect=OSError), self.assertRaises(OSError):
+            reloader.check()
+        # The change is still seen as new, and loads once it has settled again
+        with mock.patch('api.workers.worker_pool'):
+            self.assertFalse(reloader.check())
+            self.assertTrue(reloader.check())
+        self.assertEqual(len(get_catalog()), len(SONGS) + 1)
+
+
+class PromptEngineTests(CatalogFilesMixin, TestCase):
+    def test_top_in_both_modes(self):
+        for mode in ('filter', 'score'):
+            with self.subTest(mode=mode), override_settings(PROMPT_SCORING={'MODE': mode}):
+                engine = PromptEngine(self.in_memory_catalog())
+                intent = engine.parse('happy rock 2017')
+                self.assertEqual(intent.year, 2017)
+                top = engine.top(intent, 3)
+                self.assertEqual(len(top), 3)
+                # Rock from 2017 beats anything else
+                self.assertEqual(set(top[:2].tolist()), {0, 4})
+
+    def test_parse(self):
+        engine = PromptEngine(self.in_memory_catalog())
+        self.assertEqual(
+            engine.parse('Slow, sad songs like Night Love or Heart from 2001 and 2017, popular ones'),
+            PromptIntent(artist='night love', mood='sad', tempo='slow', popular=True, year=2001),
+        )
+        # Keyword precedence, and equal-length artists go to the earliest
+        self.assertEqual(engine.parse('happy but chill, fast and slow: heart, gold'),
+                         PromptIntent(artist='heart', mood='calm', tempo='fast'))
+        self.assertEqual(engine.parse('something from 1850'), PromptIntent())
+
+
+class SimilarityIndexTests(TestCase):
+    def setUp(self):
+        matrix = np.random.default_rng(7).normal(size=(50, 6)).astype(np.float32)
+        self.matrix = matrix
+        self.index = SimilarityIndex(SimpleNamespace(matrix=matrix, norms=(matrix ** 2).sum(axis=1)))
+
+    def nearest(self, vector, k, skip=()):
+        distances = ((self.matrix - vector) ** 2).sum(axis=1)
+        return [int(i) for i in np.argsort(distances) if i not in skip][:k]
+
+    def test_matches_brute_force_across_blocks(self):
+        for block_rows in (7, 50, 1 << 16):
+            with self.subTest(block_rows=block_rows), mock.patch('api.similarity.BLOCK_ROWS', block_rows):
+                found, distances = self.index.similar_to([3, 40], k=5)
+                self.assertEqual(found.tolist(), [self.nearest(self.matrix[3], 5, {3}), self.nearest(self.matrix[40], 5, {40})])
+                self.assertTrue((np.diff(distances, axis=1) >= 0).all())
+
+                found, _ = self.index.similar_to_centroid([1, 2, 30], k=4)
+                self.assertEqual(found.tolist(), self.nearest(self.matrix[[1, 2, 30]].mean(axis=0), 4, {1, 2, 30}))
+
+    def test_k_is_capped_by_the_rows_left(self):
+        found, _ = self.index.query(self.matrix[0], k=100, exclude=np.arange(45), exclude_self=np.array([47]))
+        self.assertEqual(sorted(found[0].tolist()), [45, 46, 48, 49])
+        self.assertEqual(self.index.similar_to([], k=3)[0].shape, (0, 0))
+
+
+class SimilarViewTests(CatalogAPITestCase):
+    def ids(self, songs):
+        return [song['track_id'] for song in songs]
+
+    def test_one_track(self):
+        response = self.client.get('/api/similar/t1/?k=3')
+        self.assertEqual(response.status_code, 200)
+        expected = self.catalog.similarity_index.similar_to([0], 3)[0][0]
+        self.assertEqual(self.ids(response.json()), self.catalog.store['track_id'].decode(expected).tolist())
+        self.assertNotIn('t1', self.ids(response.json()))
+        self.assertEqual(self.client.get('/api/similar/nope/').status_code, 404)
+        self.assertEqual(self.client.get('/api/similar/').status_code, 400)
+
+    def test_several_tracks(self):
+        body = self.client.get('/api/similar/?track_ids=t2,nope,t6&k=2').json()
+        self.assertEqual(list(body), ['t2', 't6', 'nope'])
+        self.assertIsNone(body['nope'])
+        self.assertEqual(body['t2'], self.client.get('/api/similar/t2/?k=2').json())
+        self.assertEqual(len(body['t6']), 2)
+
+    def test_like_favorites(self):
+        self.assertEqual(self.client.get('/api/similar/?mode=favorites').json(), [])
+        self.client.post('/api/favorites/bulk/', {'track_ids': ['t1', 't4']}, format='json')
+        songs = self.client.get('/api/similar/?mode=favorites&k=10').json()
+        # Everything but the favorites themselves
+        self.assertEqual(sorted(self.ids(songs)), ['t2', 't3', 't5', 't6'])
+        self.assertFalse(any(song['is_favorite'] for song in songs))
+
+
+class ResultCacheTests(TestCase):
+    def value(self, *positions):
+        return np.array(positions, dtype=np.int64)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResultCache(max_entries=2, timeout=None)
+        cache.set('v1', 'a', self.value(1))
+        cache.set('v1', 'b', self.value(2))
+        cache.get('v1', 'a')
+        cache.set('v1', 'c', self.value(3))
+        self.assertIsNone(cache.get('v1', 'b'))
+        self.assertEqual(cache.get('v1', 'a').tolist(), [1])
+        self.assertEqual(cache.get('v1', 'c').tolist(), [3])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = ResultCache(timeout=10)
+        with mock.patch('api.result_cache.time.monotonic', return_value=100.0):
+            cache.set('v1', 'a', self.value(1))
+        with mock.patch('api.result_cache.time.monotonic', return_value=109.0):
+            self.assertEqual(cache.get('v1', 'a').tolist(), [1])
+        with mock.patch('api.result_cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('v1', 'a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_new_catalog_version_drops_everything(self):
+        cache = ResultCache()
+        cache.set('v1', 'a', self.value(1))
+        self.assertIsNone(cache.get('v2', 'a'))
+        self.assertEqual(len(cache), 0)
+        stats = cache.stats()
+        self.assertEqual((stats['version'], stats['hits'], stats['misses'], stats['invalidations']), ('v2', 0, 1, 1))
+
+    def test_compute_only_on_a_miss(self):
+        cache = ResultCache()
+        compute = mock.Mock(return_value=self.value(4, 2))
+        self.assertEqual(cache.get_or_compute('v1', 'a', compute).tolist(), [4, 2])
+        self.assertEqual(cache.get_or_compute('v1', 'a', compute).tolist(), [4, 2])
+        compute.assert_called_once_with()
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+        # Shared between requests, so never modified in place
+        self.assertFalse(cache.get('v1', 'a').flags.writeable)
+
+
+class PromptCacheTests(CatalogAPITestCase):
+    def setUp(self):
+        super().setUp()
+        # A cache of the test's own, counters included
+        self.enterContext(mock.patch('api.result_cache._prompt_cache', None))
+
+    def ask(self, client, prompt):
+        response = client.post('/api/prompt/', {'prompt': prompt}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_keyed_by_intent(self):
+        first = self.ask(self.client, 'popular rock from 2017')
+        expected = intent_positions(self.catalog, self.catalog.prompt_engine.parse('popular rock from 2017'))
+        self.assertEqual([s['track_id'] for s in first], self.catalog.store['track_id'].decode(expected).tolist())
+        # Same intent, different words
+        self.assertEqual(self.ask(self.client, 'ROCK 2017, popular!'), first)
+        self.ask(self.client, 'rock 2017')
+        stats = prompt_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 2, 2))
+
+    def test_favorite_flags_are_per_user(self):
+        other = self.client_for(User.objects.create_user('other'))
+        other.post('/api/favorites/add/', {'track_id': 't5', 'track_name': 'sky love'}, format='json')
+        mine, theirs = self.ask(self.client, 'rock 2017'), self.ask(other, 'rock 2017')
+        self.assertEqual([s['track_id'] for s in mine], [s['track_id'] for s in theirs])
+        self.assertEqual({s['track_id'] for s in theirs if s['is_favorite']}, {'t5'})
+        self.assertFalse(any(s['is_favorite'] for s in mine))
+
+    def test_reload_invalidates(self):
+        self.ask(self.client, 'rock 2017')
+        reloaded = self.in_memory_catalog(SONGS + [song('t7', 'new', ['Storm'], 2017, 99, ['rock'])])
+        install_catalog(reloaded)
+        self.assertEqual(self.ask(self.client, 'rock 2017')[0]['track_id'], 't7')
+        stats = prompt_cache().stats()
+        self.assertEqual((stats['hits'], stats['invalidations'], stats['version']), (0, 1, reloaded.version))
+
+
+class WorkerPoolTests(CatalogFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.catalog = self.in_memory_catalog()
+        self.addCleanup(install_catalog, install_catalog(self.catalog))
+        self.intent = self.catalog.prompt_engine.parse('popular rock 2017')
+        self.expected = intent_positions(self.catalog, self.intent).tolist()
+        # Threads stand in for the worker processes; they see this process's catalog
+        self.enterContext(mock.patch.object(WorkerPool, '_new_executor', lambda pool: ThreadPoolExecutor(pool.workers)))
+        self.enterContext(mock.patch('api.workers._unavailable', set()))
+
+    def pool(self, **options):
+        pool = WorkerPool(mode='process', **options)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def blocked(self):
+        """Make jobs wait until the returned event is set."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.enterContext(mock.patch('api.workers._call', side_effect=lambda *job: release.wait(5)))
+        return release
+
+    def test_inline_runs_in_process(self):
+        pool = WorkerPool()
+        self.assertEqual(pool.run('prompt', self.catalog, self.intent).tolist(), self.expected)
+        self.assertIsNone(pool._executor)
+        self.assertEqual(pool.stats()['submitted'], 0)
+
+    def test_jobs_run_on_the_pool(self):
+        pool = self.pool().start()
+        self.assertEqual(pool.run('prompt', self.catalog, self.intent).tolist(), self.expected)
+        self.assertEqual((pool.stats()['submitted'], pool.stats()['fallbacks']), (1, 0))
+
+    def test_stale_catalog_runs_in_process(self):
+        # A catalog the workers cannot load, e.g. the web process reloaded
+        # from a file that changed again since
+        newer = self.in_memory_catalog(SONGS + [song('t7', 'new', ['Storm'], 2017, 99, ['rock'])])
+        pool = self.pool()
+        with mock.patch('api.catalog.load_catalog', return_value=self.catalog) as load_catalog:
+            for _ in range(2):
+                self.assertEqual(pool.run('prompt', newer, self.intent).tolist(),
+                                 intent_positions(newer, self.intent).tolist())
+        # Tried once, then known to be unavailable
+        load_catalog.assert_called_once_with(force=True)
+        self.assertEqual(pool.stats()['fallbacks'], 2)
+
+    def test_broken_pool_runs_in_process(self):
+        pool = self.pool().start()
+        executor = pool._executor
+        with mock.patch.object(executor, 'submit', side_effect=BrokenProcessPool()):
+            self.assertEqual(pool.run('prompt', self.catalog, self.intent).tolist(), self.expected)
+        # A fresh pool is started for the next job
+        self.assertIsNone(pool._executor)
+        self.assertEqual(pool.run('prompt', self.catalog, self.intent).tolist(), self.expected)
+        self.assertIsNot(pool._executor, executor)
+
+    def test_backpressure(self):
+        release = self.blocked()
+        pool = self.pool(max_pending=1, queue_wait=0.01)
+        first = threading.Thread(target=pool.run, args=('prompt', self.catalog, self.intent))
+        first.start()
+        while not pool.stats()['pending']:
+            first.join(0.01)
+        with self.assertRaises(PoolBusy):
+            pool.run('prompt', self.catalog, self.intent)
+        release.set()
+        first.join()
+        self.assertEqual(pool.stats()['rejected'], 1)
+        self.assertTrue(pool.run('prompt', self.catalog, self.intent))
+
+    def test_timeout(self):
+        release = self.blocked()
+        pool = self.pool(timeout=0.01)
+        with self.assertRaises(JobTimeout):
+            pool.run('prompt', self.catalog, self.intent)
+        # The slot is held until the job really ends
+        self.assertEqual(pool.stats()['pending'], 1)
+        release.set()
+        pool.shutdown()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_submit_during_restart(self):
+        pool = self.pool().start()
+        old = pool._executor
+        old.shutdown()
+        # Picked up just before a restart replaced it
+        with mock.patch.object(old, 'submit', side_effect=lambda *job: setattr(pool, '_executor', replacement) or
+                               ThreadPoolExecutor.submit(old, *job)):
+            replacement = ThreadPoolExecutor(1)
+            self.assertEqual(pool.run('prompt', self.catalog, self.intent).tolist(), self.expected)
+        replacement.shutdown()
+        # A pool that was shut down for good still fails
+        with self.assertRaises(RuntimeError):
+            pool.run('prompt', self.catalog, self.intent)
+
+
+class ConditionalGetTests(CatalogAPITestCase):
+    def assertNotModified(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        again = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], response['ETag'])
+        self.assertEqual(again.content, b'')
+        return response['ETag']
+
+    def test_unchanged_responses_get_304(self):
+        for path in ('/api/discover/', '/api/discover/?genre=rock&filter=new', '/api/favorites/'):
+            with self.subTest(path=path):
+                self.assertNotModified(path)
+
+    def test_etag_depends_on_query_and_user(self):
+        tag = self.assertNotModified('/api/discover/')
+        self.assertNotEqual(self.client.get('/api/discover/?page=2')['ETag'], tag)
+        other = self.client_for(User.objects.create_user('other'))
+        self.assertEqual(other.get('/api/discover/', HTTP_IF_NONE_MATCH=tag).status_code, 200)
+
+    def test_favorite_changes_invalidate(self):
+        for path in ('/api/discover/', '/api/favorites/'):
+            with self.subTest(path=path):
+                tag = self.assertNotModified(path)
+                self.client.post('/api/favorites/add/', {'track_id': 't3', 'track_name': 'wild rain'}, format='json')
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=tag)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b'"wild rain"', response.content)
+
+                tag = response['ETag']
+                self.client.delete('/api/favorites/remove/t3/')
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=tag).status_code, 200)
+
+    def test_workers_agree_on_versions(self):
+        # The favorites version lives in the shared cache: a tag from one
+        # worker validates on another until a favorite changes anywhere
+        for path in ('/api/discover/', '/api/favorites/'):
+            with self.subTest(path=path):
+                with self.as_worker():
+                    tag = self.client.get(path)['ETag']
+                with self.as_worker():
+                    self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=tag).status_code, 304)
+                with self.as_worker():
+                    self.client.post('/api/favorites/add/', {'track_id': 't6', 'track_name': 'blue fire'}, format='json')
+                with self.as_worker():
+                    self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=tag).status_code, 200)
+                Favorite.objects.filter(user=self.user).delete()
+
+    def test_changes_outside_the_api_invalidate(self):
+        # e.g. the admin or the shell: the signal receivers bump the version
+        tag = self.assertNotModified('/api/favorites/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, track_id='t5', track_name='sky love')
+        response = self.client.get('/api/favorites/', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['track_id'] for s in response.json()], ['t5'])
+
+        tag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get('/api/favorites/', HTTP_IF_NONE_MATCH=tag).status_code, 200)
+
+
+class QueryParamTests(CatalogAPITestCase):
+    def assertBadRequest(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('error', response.json())
+
+    def test_recommendations_count(self):
+        for n in ('x', '0', '-3'):
+            with self.subTest(n=n):
+                self.assertBadRequest(f'/api/recommendations/?n={n}')
+
+    def test_similar_count(self):
+        for path in ('/api/similar/t1/?k=x', '/api/similar/?track_ids=t1,t2&k=1.5', '/api/similar/?mode=favorites&k='):
+            with self.subTest(path=path):
+                self.assertBadRequest(path)
+        self.assertEqual(self.client.get('/api/similar/t1/?k=2').status_code, 200)
+
+    def test_facets_limit(self):
+        self.assertBadRequest('/api/discover/facets/?limit=x')
+        self.assertEqual(self.client.get('/api/discover/facets/?limit=1').status_code, 200)
+
+
+class DiscoverTests(CatalogAPITestCase):
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [song['track_id'] for song in response.json()['songs']]
+
+    def test_orders_and_filters(self):
+        self.assertEqual(self.ids(self.client.get('/api/discover/')), ['t5', 't1', 't2', 't3', 't4', 't6'])
+        # Ties keep catalog order
+        self.assertEqual(self.ids(self.client.get('/api/discover/?filter=new')), ['t6', 't1', 't5', 't2', 't3', 't4'])
+        self.assertEqual(self.ids(self.client.get('/api/discover/?filter=other')), ['t1', 't2', 't3', 't4', 't5', 't6'])
+        self.assertEqual(self.ids(self.client.get('/api/discover/?genre=Rock&year=2017')), ['t5', 't1'])
+        self.assertEqual(self.ids(self.client.get('/api/discover/?artist=heart&filter=new')), ['t5', 't4'])
+        self.assertEqual(self.ids(self.client.get('/api/discover/?genre=null&year=1900')), [])
+
+    def test_cursor_pages_match_offset_pages(self):
+        for query in ('', 'filter=new', 'filter=natural', 'genre=rock', 'genre=pop&filter=new'):
+            with self.subTest(query=query):
+                expected = self.ids(self.client.get(f'/api/discover/?{query}&page_size=100'))
+                by_offset = []
+                for page in range(1, 5):
+                    by_offset += self.ids(self.client.get(f'/api/discover/?{query}&page_size=2&page={page}'))
+                by_cursor, cursor = [], None
+                while True:
+                    response = self.client.get(f'/api/discover/?{query}&page_size=2' + (f'&cursor={cursor}' if cursor else ''))
+                    by_cursor += self.ids(response)
+                    cursor = response.json()['next_cursor']
+                    if cursor is None:
+                        break
+                self.assertEqual(by_offset, expected)
+                self.assertEqual(by_cursor, expected)
+                self.assertEqual(response.json()['total_songs'], len(expected))
+
+    def test_stale_cursor(self):
+        cursor = self.client.get('/api/discover/?page_size=2').json()['next_cursor']
+        # A cursor is only valid for the ordering (and catalog version) it came from
+        self.assertEqual(self.client.get(f'/api/discover/?filter=new&cursor={cursor}').status_code, 400)
+        self.assertEqual(self.client.get('/api/discover/?cursor=garbage').status_code, 400)
+
+    def test_bad_parameters(self):
+        token = Token.objects.create(user=self.user)
+        for prefix in ('/api/discover/', '/api/async/discover/'):
+            for query in ('page=abc', 'page_size=x', 'year=abc', 'page=1.5'):
+                with self.subTest(path=prefix, query=query):
+                    response = self.client.get(f'{prefix}?{query}', HTTP_AUTHORIZATION=f'Token {token.key}')
+                    self.assertEqual(response.status_code, 400, response.content)
+                    self.assertIn('error', response.json())
+        self.assertEqual(self.client.get('/api/discover/facets/?year=abc').status_code, 400)
+
+    def test_page_bounds(self):
+        for query, page, page_size, songs in (
+            ('page_size=-5', 1, 1, 1), ('page_size=0', 1, 1, 1), ('page_size=100000', 1, 100, 6),
+            ('page=-3&page_size=2', 1, 2, 2), ('page=0', 1, 20, 6),
+        ):
+            with self.subTest(query=query):
+                body = self.client.get(f'/api/discover/?{query}').json()
+                self.assertEqual((body['page'], body['page_size'], len(body['songs'])), (page, page_size, songs))
+
+
+class AsyncViewTests(CatalogAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch('api.result_cache._prompt_cache', None))
+        self.token = Token.objects.create(user=self.user)
+        self.async_client = APIClient()
+        self.async_client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_required(self):
+        anonymous = APIClient()
+        self.user.is_active = False
+        self.user.save()
+        for client in (anonymous, self.async_client):
+            for path in ('/api/async/discover/', '/api/async/favorites/'):
+                with self.subTest(path=path):
+                    response = client.get(path)
+                    self.assertEqual(response.status_code, 401)
+                    self.assertEqual(response['WWW-Authenticate'], 'Token')
+        anonymous.credentials(HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(anonymous.post('/api/async/prompt/', {'prompt': 'rock'}, format='json').status_code, 401)
+
+    def test_same_responses_as_sync_views(self):
+        self.client.post('/api/favorites/bulk/', {'track_ids': ['t1', 't6']}, format='json')
+        for path in ('/api/discover/?genre=rock&filter=new', '/api/discover/?page_size=2&page=2', '/api/favorites/'):
+            with self.subTest(path=path):
+                expected = self.client.get(path)
+                response = self.async_client.get(path.replace('/api/', '/api/async/'))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected.json())
+                self.assertEqual(response['Cache-Control'], expected['Cache-Control'])
+                again = self.async_client.get(path.replace('/api/', '/api/async/'), HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(again.status_code, 304)
+        prompt = {'prompt': 'popular rock 2017'}
+        self.assertEqual(
+            self.async_client.post('/api/async/prompt/', prompt, format='json').json(),
+            self.client.post('/api/prompt/', prompt, format='json').json(),
+        )
+
+    def test_add_and_remove(self):
+        add = '/api/async/favorites/add/'
+        self.assertEqual(self.async_client.post(add, {'track_id': 't3'}, format='json').status_code, 400)
+        self.assertEqual(self.async_client.post(add, {'track_id': 't3', 'track_name': 'wild rain'}, format='json').status_code, 201)
+        self.assertEqual(self.async_client.post(add, {'track_id': 't3', 'track_name': 'wild rain'}, format='json').status_code, 200)
+        self.assertEqual([s['track_id'] for s in self.client.get('/api/favorites/').json()], ['t3'])
+
+        self.assertEqual(self.async_client.delete('/api/async/favorites/remove/t3/').status_code, 200)
+        self.assertEqual(self.async_client.delete('/api/async/favorites/remove/t3/').status_code, 404)
+        self.assertEqual(self.client.get('/api/favorites/').json(), [])
+        self.assertFalse(Favorite.objects.filter(user=self.user).exists())
+
+    def test_errors(self):
+        response = self.async_client.post('/api/async/prompt/', b'{"prompt":', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.async_client.post('/api/async/prompt/', {}, format='json').status_code, 400)
+        with mock.patch('api.workers.arun', side_effect=PoolBusy()):
+            response = self.async_client.post('/api/async/prompt/', {'prompt': 'jazz'}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class BulkFavoritesTests(CatalogAPITestCase):
+    path = '/api/favorites/bulk/'
+
+    def test_rejects_bodies_without_track_ids(self):
+        for body in (['t1', 't2'], {'track_ids': []}, {'track_ids': 't1'}, {'track_ids': ['t1', 3]}, {}):
+            for method in (self.client.post, self.client.delete):
+                with self.subTest(body=body, method=method.__name__):
+                    response = method(self.path, body, format='json')
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('error', response.json())
+
+    def statuses(self, response):
+        return {item['track_id']: item['status'] for item in response.json()['results']}
+
+    def test_add_statuses(self):
+        Favorite.objects.create(user=self.user, track_id='t2', track_name='night wild')
+        response = self.client.post(self.path, {'track_ids': ['t1', 't2', 'nope', 't1', 't3']}, format='json')
+        self.assertEqual(response.status_code, 201)
+        # Repeats are dropped, request order is kept
+        self.assertEqual(list(self.statuses(response).items()), [
+            ('t1', 'created'), ('t2', 'exists'), ('nope', 'not_found'), ('t3', 'created'),
+        ])
+        self.assertEqual(response.json()['counts'], {'created': 2, 'exists': 1, 'not_found': 1})
+        # Names come from the catalog
+        self.assertEqual(
+            dict(Favorite.objects.filter(user=self.user).values_list('track_id', 'track_name')),
+            {'t1': 'gold wild', 't2': 'night wild', 't3': 'wild rain'},
+        )
+        listed = self.client.get('/api/favorites/').json()
+        self.assertEqual([song['track_id'] for song in listed], ['t1', 't2', 't3'])
+
+    def test_add_nothing_new(self):
+        Favorite.objects.create(user=self.user, track_id='t1', track_name='gold wild')
+        response = self.client.post(self.path, {'track_ids': ['t1', 'nope']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuses(response), {'t1': 'exists', 'nope': 'not_found'})
+
+    def test_remove_statuses(self):
+        self.client.post(self.path, {'track_ids': ['t1', 't2']}, format='json')
+        # Favorites of tracks no longer in the catalog can still be removed
+        Favorite.objects.create(user=self.user, track_id='gone', track_name='old')
+        other = User.objects.create_user('other')
+        Favorite.objects.create(user=other, track_id='t3', track_name='wild rain')
+
+        response = self.client.delete(self.path, {'track_ids': ['t2', 'gone', 't3', 't4']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuses(response), {'t2': 'removed', 'gone': 'removed', 't3': 'not_found', 't4': 'not_found'})
+        self.assertEqual(response.json()['counts'], {'removed': 2, 'not_found': 2})
+        self.assertEqual(list(Favorite.objects.filter(user=self.user).values_list('track_id', flat=True)), ['t1'])
+        self.assertTrue(Favorite.objects.filter(user=other, track_id='t3').exists())
+        listed = self.client.get('/api/favorites/').json()
+        self.assertEqual([song['track_id'] for song in listed], ['t1'])
+
+
+class FavoriteUniquenessTests(CatalogAPITestCase):
+    def add(self, client, track_id='t1'):
+        return client.post('/api/favorites/add/', {'track_id': track_id, 'track_name': 'gold wild'}, format='json')
+
+    def test_each_user_can_favorite_a_track_once(self):
+        other = self.client_for(User.objects.create_user('other'))
+        self.assertEqual(self.add(self.client).status_code, 201)
+        self.assertEqual(self.add(other).status_code, 201)
+        self.assertEqual(self.add(self.client).status_code, 200)
+        self.assertEqual(Favorite.objects.filter(track_id='t1').count(), 2)
+        self.assertEqual(Favorite.objects.filter(user=self.user, track_id='t1').count(), 1)
+
+    def test_database_enforces_it(self):
+        other = User.objects.create_user('other')
+        Favorite.objects.create(user=self.user, track_id='t1')
+        Favorite.objects.create(user=other, track_id='t1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Favorite.objects.create(user=self.user, track_id='t1')
+
+
+class FavoritesCacheTests(CatalogAPITestCase):
+    def listed(self):
+        return [song['track_id'] for song in self.client.get('/api/favorites/').json()]
+
+    def test_writes_are_seen_by_other_workers(self):
+        with self.as_worker():
+            self.assertEqual(self.listed(), [])
+        with self.as_worker():
+            self.client.post('/api/favorites/bulk/', {'track_ids': ['t4', 't2']}, format='json')
+        with self.as_worker():
+            self.assertEqual(self.listed(), ['t2', 't4'])
+            flags = {s['track_id']: s['is_favorite'] for s in self.client.get('/api/discover/').json()['songs']}
+            self.assertEqual({t for t, flag in flags.items() if flag}, {'t2', 't4'})
+        with self.as_worker():
+            self.client.delete('/api/favorites/remove/t4/')
+        with self.as_worker():
+            self.assertEqual(self.listed(), ['t2'])
+
+
+class TasteModelTests(CatalogAPITestCase):
+    def recommend(self, n=3):
+        response = self.client.get(f'/api/recommendations/?n={n}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [song['track_id'] for song in response.json()]
+
+    def count(self):
+        return TasteProfile.objects.get(user=self.user).state.get('count')
+
+    def test_fitted_once_then_updated(self):
+        self.client.post('/api/favorites/bulk/', {'track_ids': ['t1', 't5']}, format='json')
+        recommended = self.recommend()
+        self.assertEqual(len(recommended), 3)
+        # Favorites are never recommended
+        self.assertFalse({'t1', 't5'} & set(recommended))
+        self.assertEqual(self.count(), 2)
+
+        self.client.post('/api/favorites/add/', {'track_id': 't3', 'track_name': 'wild rain'}, format='json')
+        self.assertEqual(self.count(), 3)
+        self.client.delete('/api/favorites/remove/t1/')
+        self.assertEqual(self.count(), 2)
+        self.assertNotIn('t3', self.recommend(5))
+
+    def test_changes_outside_the_views_refit(self):
+        self.client.post('/api/favorites/add/', {'track_id': 't1', 'track_name': 'gold wild'}, format='json')
+        self.recommend()
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, track_id='t2', track_name='night wild')
+        self.assertIsNone(self.count())
+        self.assertFalse({'t1', 't2'} & set(self.recommend(6)))
+        self.assertEqual(self.count(), 2)
+
+    def test_update_a_fit_already_saw_is_not_applied_twice(self):
+        Favorite.objects.create(user=self.user, track_id='t4', track_name='fire ocean')
+        self.recommend()
+        self.assertEqual(self.count(), 1)
+        # e.g. a fit that read the favorites after this add was committed
+        recommender.favorite_added(self.user.id, ['t4'], self.catalog)
+        self.assertIsNone(self.count())
+        self.recommend()
+        self.assertEqual(self.count(), 1)
+
+
+@override_settings(TIMING={'ENABLED': True})
+class TimingTests(CatalogAPITestCase):
+    def setUp(self):
+        super().setUp()
+        prompt_cache().clear()
+        timing.registry.reset()
+        self.addCleanup(timing.registry.reset)
+
+    def stages(self, response):
+        return {metric.split(';')[0] for metric in response['Server-Timing'].split(', ')}
+
+    def test_prompt_stages(self):
+        miss = self.client.post('/api/prompt/', {'prompt': 'happy rock 2017'}, format='json')
+        self.assertEqual(miss.status_code, 200)
+        self.assertLessEqual({'genre_match', 'phrase_match', 'cache', 'score', 'favorites', 'total'}, self.stages(miss))
+        # Same intent: served from the cache, no scoring
+        hit = self.client.post('/api/prompt/', {'prompt': '2017 rock, happy'}, format='json')
+        self.assertEqual(hit.json(), miss.json())
+        self.assertIn('cache', self.stages(hit))
+        self.assertNotIn('score', self.stages(hit))
+        self.assertEqual(prompt_cache().stats()['hits'], 1)
+
+    def test_histograms(self):
+        for _ in range(3):
+            self.client.get('/api/discover/?genre=rock')
+        admin = self.client_for(User.objects.create_user('admin', is_staff=True))
+        endpoints = admin.get('/api/timing/').json()['endpoints']
+        discover = endpoints['discover-view']['stages_ms']
+        self.assertEqual(discover['total']['count'], 3)
+        self.assertLessEqual({'filter', 'paginate', 'favorites'}, set(discover))
+        self.assertEqual(admin.delete('/api/timing/').status_code, 204)
+        self.assertEqual(admin.get('/api/timing/').json()['endpoints'], {'timing': mock.ANY})
+
+
+class CatalogStatsTests(CatalogAPITestCase):
+    def test_memory_is_reported(self):
+        self.catalog.warm()
+        admin = self.client_for(User.objects.create_user('admin', is_staff=True))
+        stats = admin.get('/api/catalog/stats/').json()['catalog']
+        self.assertEqual(stats['rows'], len(SONGS))
+        self.assertGreater(stats['store_bytes'], 0)
+        self.assertLessEqual({'genre_index', 'sort_orders', 'features', 'song_fragments'}, set(stats['derived_bytes']))
+        self.assertEqual(
+            stats['memory_bytes'], stats['store_bytes'] + sum(stats['derived_bytes'].values()) + stats['frame_bytes']
+        )
+        self.assertEqual(self.client.get('/api/catalog/stats/').status_code, 403)
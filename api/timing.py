@@ -0,0 +1,247 @@
+"""
+Per-request stage timings.
+
+Code on the hot path wraps its steps in ``stage('name')``. While a request is
+being timed (``TIMING['ENABLED']``, see ``ServerTimingMiddleware``) each stage's
+time is added to the request's ``RequestTimings``; otherwise ``stage()``
+returns a shared no-op context manager, so the cost when disabled is one
+context variable read. Database time and query counts are collected by an
+execute wrapper on every connection.
+
+The middleware reports the stages in a ``Server-Timing`` header and records
+them, per endpoint, in log-bucketed histograms served by ``TimingView``.
+"""
+import math
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_current = ContextVar('request_timings', default=None)
+_noop = nullcontext()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.stages = {}
+        self.queries = 0
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, stages):
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+
+
+class _Stage:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def stage(name):
+    """Time the enclosed block as stage ``name`` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        return _noop
+    return _Stage(timings, name)
+
+
+def current():
+    return _current.get()
+
+
+def start():
+    """Start timing in the current context; returns a token for ``stop()``."""
+    return _current.set(RequestTimings())
+
+
+def stop(token):
+    timings = _current.get()
+    _current.reset(token)
+    return timings
+
+
+# Database queries
+
+def _execute_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add('db', time.perf_counter() - started)
+        timings.queries += 1
+
+
+def _install_wrapper(connection, **kwargs):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def instrument_database():
+    # Connections are per thread, so hook every one as it is created
+    connection_created.connect(_install_wrapper, dispatch_uid='api.timing')
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+
+
+# Histograms
+
+class LogHistogram:
+    """Counts in buckets growing by ``GROWTH``, so percentiles are within ~5%."""
+
+    GROWTH = 1.1
+    SMALLEST = 1e-6
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value):
+        bucket = -1 if value <= self.SMALLEST else int(math.log(value / self.SMALLEST, self.GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # Geometric middle of the bucket, clamped to what was seen
+                value = self.SMALLEST * self.GROWTH ** (bucket + 0.5) if bucket >= 0 else self.SMALLEST
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, scale=1.0, digits=3):
+        def fmt(value):
+            return round(value * scale, digits) if value is not None else None
+        return {
+            "count": self.count,
+            "mean": fmt(self.total / self.count) if self.count else None,
+            "p50": fmt(self.percentile(50)),
+            "p95": fmt(self.percentile(95)),
+            "p99": fmt(self.percentile(99)),
+            "max": fmt(self.max) if self.count else None,
+        }
+
+
+class TimingRegistry:
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, total, timings):
+        with self._lock:
+            histograms = self._endpoints.setdefault(endpoint, {"stages": {}, "queries": LogHistogram()})
+            stages = histograms["stages"]
+            stages.setdefault('total', LogHistogram()).record(total)
+            for name, seconds in timings.stages.items():
+                stages.setdefault(name, LogHistogram()).record(seconds)
+            histograms["queries"].record(timings.queries)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "stages_ms": {name: h.summary(scale=1000) for name, h in histograms["stages"].items()},
+                    "db_queries": histograms["queries"].summary(digits=1),
+                }
+                for endpoint, histograms in self._endpoints.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = TimingRegistry()
+
+
+def enabled():
+    return getattr(settings, 'TIMING', {}).get('ENABLED', False)
+
+
+def server_timing(timings, total):
+    metrics = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.stages.items()]
+    metrics.append(f'queries;desc="{timings.queries} queries"')
+    metrics.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(metrics)
+
+
+def _endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class ServerTimingMiddleware:
+    """Times each request and adds a ``Server-Timing`` header; off unless ``TIMING['ENABLED']``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        instrument_database()
+
+    def _finish(self, request, response, token, started):
+        total = time.perf_counter() - started
+        timings = stop(token)
+        registry.record(_endpoint(request), total, timings)
+        response['Server-Timing'] = server_timing(timings, total)
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        token = start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            stop(token)
+            raise
+        return self._finish(request, response, token, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        token = start()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            stop(token)
+            raise
+        return self._finish(request, response, token, started)
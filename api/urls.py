@@ -1,12 +1,27 @@
 from django.urls import path
-from .views import PromptView, FavoritesListView, AddFavoriteView, RemoveFavoriteView, DiscoverView, GetUserName, IsLoggedin
+from .async_views import AsyncPromptView, AsyncDiscoverView, AsyncFavoritesListView, AsyncAddFavoriteView, AsyncRemoveFavoriteView
+from .views import PromptView, FavoritesListView, AddFavoriteView, RemoveFavoriteView, BulkFavoritesView, DiscoverView, DiscoverFacetsView, GetUserName, IsLoggedin, RecommendationsView, SimilarView, CatalogStatsView, CatalogReloadView, TimingView
 
 urlpatterns = [
     path('prompt/', PromptView.as_view(), name='prompt'),
     path('favorites/', FavoritesListView.as_view(), name='favorites-list'),
     path('favorites/add/', AddFavoriteView.as_view(), name='favorites-add'),
     path('favorites/remove/<str:track_id>/', RemoveFavoriteView.as_view(), name='favorites-remove'),
+    path('favorites/bulk/', BulkFavoritesView.as_view(), name='favorites-bulk'),
     path('discover/', DiscoverView.as_view(), name='discover-view'),
+    path('discover/facets/', DiscoverFacetsView.as_view(), name='discover-facets'),
+    path('recommendations/', RecommendationsView.as_view(), name='recommendations'),
+    path('similar/', SimilarView.as_view(), name='similar'),
+    path('similar/<str:track_id>/', SimilarView.as_view(), name='similar-track'),
+    path('catalog/stats/', CatalogStatsView.as_view(), name='catalog-stats'),
+    path('catalog/reload/', CatalogReloadView.as_view(), name='catalog-reload'),
+    path('timing/', TimingView.as_view(), name='timing'),
+    # Async variants, for serving under ASGI
+    path('async/prompt/', AsyncPromptView.as_view(), name='async-prompt'),
+    path('async/discover/', AsyncDiscoverView.as_view(), name='async-discover'),
+    path('async/favorites/', AsyncFavoritesListView.as_view(), name='async-favorites-list'),
+    path('async/favorites/add/', AsyncAddFavoriteView.as_view(), name='async-favorites-add'),
+    path('async/favorites/remove/<str:track_id>/', AsyncRemoveFavoriteView.as_view(), name='async-favorites-remove'),
     path('username/', GetUserName.as_view(), name="get-username"),
     path('checkLogin/', IsLoggedin.as_view(), name="get-loginStatus"),
 ]
@@ -1,24 +1,130 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
-from django.core.cache import cache
+from django.db import transaction
 from .models import Favorite
-from django.conf import settings
-import pandas as pd
-import os
-from .prompthandler import filter_songs_by_prompt
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import numpy as np
+from .catalog import get_catalog
+from .indexes import intersect
+from . import etags, favorites, recommender, reloader, timing, workers
+from .renderers import SongList
+from .result_cache import prompt_cache
+from .timing import stage
 
-# Load and cache the dataset upon server start-up if not already cached
-def load_dataset():
-    if not cache.get('songs_df'):
-        songs = pd.read_csv(os.path.join(settings.BASE_DIR, 'dataset', 'processes_dataset.csv'))
-        songs = songs.drop_duplicates(subset=['track_id'])
-        cache.set('songs_df', songs, timeout=None)  # No timeout to keep it persistently cached
 
+def favorites_changed(user_id, catalog, added=(), removed=()):
+    """Write favorite changes through to the favorites cache and taste model."""
+    if catalog is not None:
+        favorites.refresh(user_id, catalog)
+    # After the refresh, so a new ETag never goes with the old favorites
+    favorites.bump_version(user_id)
+    if added:
+        recommender.favorite_added(user_id, added, catalog)
+    if removed:
+        recommender.favorite_removed(user_id, removed, catalog)
+
+
+def int_param(params, name, default):
+    """Query parameter ``name`` as an int (``default`` if absent), None if it is not one."""
+    try:
+        return int(params.get(name, default))
+    except (TypeError, ValueError):
+        return None
+
+
+# Songs per Discover page at most
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(version, order_name, rank):
+    return urlsafe_b64encode(f"{version}:{order_name}:{rank}".encode()).decode()
+
+
+class InvalidQuery(ValueError):
+    """A query parameter Discover cannot use; the message is the 400 error."""
+
+
+def decode_cursor(cursor, version, order_name):
+    """Rank encoded in ``cursor``, or None if it is malformed or stale."""
+    try:
+        cursor_version, cursor_order, rank = urlsafe_b64decode(cursor.encode()).decode().split(':')
+        rank = int(rank)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if cursor_version != version or cursor_order != order_name or rank < 0:
+        return None
+    return rank
+
+
+def discover_positions(catalog, params):
+    """Sorted row positions matching the Discover filters in ``params``, None for all rows."""
+    year = params.get('year')
+    artist = params.get('artist')
+    genre = params.get('genre')
+
+    # Narrow down to matching row positions using the prebuilt indexes
+    with stage('filter'):
+        positions = None
+
+        # Filter by year if specified
+        if year and year != 'null':
+            year = int_param(params, 'year', None)
+            if year is None:
+                raise InvalidQuery("year must be an integer")
+            positions = catalog.year_index.get(year)
+
+        # Filter by artist if specified
+        if artist and artist != 'null':
+            positions = intersect(positions, catalog.artist_index.get(artist))
+
+        # Filter by genre if specified
+        if genre and genre != 'null':
+            positions = intersect(positions, catalog.genre_index.get(genre))
+    return positions
+
+
+def discover_page(catalog, params):
+    """
+    Row positions and pagination info of one Discover page for the query
+    ``params``. Raises ``InvalidQuery`` for parameters it cannot use.
+    """
+    # Get query parameters for filtering and pagination
+    filter_by = params.get('filter', 'popular')
+    page = int_param(params, 'page', 1)
+    page_size = int_param(params, 'page_size', 20)
+    if page is None or page_size is None:
+        raise InvalidQuery("page and page_size must be integers")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    positions = discover_positions(catalog, params)
+
+    # Popular and new use orderings precomputed at load, anything else
+    # keeps catalog order
+    order_name = filter_by if filter_by in ('popular', 'new') else 'natural'
+    sort_order = catalog.sort_orders[order_name]
+
+    # Optional keyset cursor for deep pagination, replaces page
+    after = None
+    cursor = params.get('cursor')
+    if cursor:
+        after = decode_cursor(cursor, catalog.version, order_name)
+        if after is None:
+            raise InvalidQuery("Invalid cursor")
+
+    # Pagination straight from the permutation, no copy or sort
+    start_idx = (page - 1) * page_size
+    with stage('paginate'):
+        page_positions, total_songs, last_rank = sort_order.page(positions, start_idx, page_size, after)
+
+    return page_positions, {
+        "page": page,
+        "page_size": page_size,
+        "total_songs": total_songs,
+        "next_cursor": encode_cursor(catalog.version, order_name, last_rank) if last_rank is not None else None,
+    }
 
-# Ensure dataset is loaded at startup
-load_dataset()
 
 class IsLoggedin(APIView):
     permission_classes = [IsAuthenticated]
@@ -49,133 +155,201 @@ class PromptView(APIView):
         if not prompt:
             return Response({"error": "No prompt provided"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Retrieve the dataset from cache
-        songs_df = cache.get('songs_df')
-        recommendations = filter_songs_by_prompt(prompt, songs_df).head(10)
-        recommendations = recommendations[["track_id", 
-                                           "track_name", 
-                                           "artist_names",
-                                           "album_name",
-                                           "year", 
-                                           "duration_ms",
-                                           "album_cover_64x64",
-                                           "album_cover_640x640"
-                                           ]]
-        # Get track IDs from the Favorite model
-        favorite_track_ids = set(Favorite.objects.filter(user=request.user).values_list('track_id', flat=True))
-
-        # Create a new column in the DataFrame that checks if the track_id is in the favorites
-        recommendations['is_favorite'] = recommendations['track_id'].isin(favorite_track_ids)
-        
-        return Response(recommendations.to_dict(orient='records'), status=status.HTTP_200_OK)
+        # Shared read-only catalog, no copy
+        catalog = get_catalog()
+        if catalog is None:
+            return Response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Served from the prompt cache, or scored on the worker pool. Imported
+        # here so only processes that serve prompts load the prompt stack
+        from .prompthandler import prompt_positions
+        positions = prompt_positions(catalog, prompt)
+
+        # Only the is_favorite overlay is computed per user, from the cached
+        # favorites; the songs themselves are written from pre-encoded JSON
+        user_favorites = favorites.favorite_positions(request.user.id, catalog)
+        return Response(SongList(catalog, positions, user_favorites), status=status.HTTP_200_OK)
 
 class DiscoverView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Retrieve the dataset from cache
-        songs_df = cache.get('songs_df')
-
-        if songs_df is None:
+        # Shared read-only catalog, no copy
+        catalog = get_catalog()
+        if catalog is None:
             return Response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Get query parameters for filtering and pagination
-        filter_by = request.query_params.get('filter', 'popular')
-        year = request.query_params.get('year')
-        artist = request.query_params.get('artist')
-        genre = request.query_params.get('genre')
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 20))
-        
-        # Apply filters to the dataset
-        filtered_df = songs_df.copy()
+        # Unchanged since the client's copy: 304 before any filtering
+        tag = etags.etag(request, catalog, favorites.version(request.user.id), request.accepted_renderer.format)
+        if etags.matches(request, tag):
+            return etags.tag(Response(status=status.HTTP_304_NOT_MODIFIED), tag)
 
-        # Filter by year if specified
-        if year and year != 'null':
-            filtered_df = filtered_df[filtered_df['year'] == int(year)]
+        try:
+            page_positions, page_info = discover_page(catalog, request.query_params)
+        except InvalidQuery as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Filter by artist if specified
-        if artist!= 'null':
-            filtered_df = filtered_df[
-                filtered_df['artist_names'].apply(
-                    lambda x: any(a.lower() == artist.lower() for a in x) if isinstance(x, list) else False
-                )
-            ]
+        user_favorites = favorites.favorite_positions(request.user.id, catalog)
 
-        # Filter by genre if specified
-        if genre!= 'null':
-            filtered_df = filtered_df[
-                filtered_df['genres'].apply(
-                    lambda x: any(g.lower() == genre.lower() for g in x) if isinstance(x, list) else False
-                )
-            ]
+        return etags.tag(Response({
+            "songs": SongList(catalog, page_positions, user_favorites),
+            **page_info,
+        }, status=status.HTTP_200_OK), tag)
 
-        # Sort by popularity if requested
-        if filter_by == 'popular':
-            filtered_df = filtered_df.sort_values(by='popularity', ascending=False)
-        
-        if filter_by == 'new':
-            filtered_df = filtered_df.sort_values(by='year', ascending=False)
-        
+class DiscoverFacetsView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        # Get track IDs from the Favorite model
-        favorite_track_ids = set(Favorite.objects.filter(user=request.user).values_list('track_id', flat=True))
-
-        # Create a new column in the DataFrame that checks if the track_id is in the favorites
-        filtered_df = filtered_df[["track_id", 
-                                           "track_name", 
-                                           "artist_names",
-                                           "album_name",
-                                           "year", 
-                                           "duration_ms",
-                                           "album_cover_64x64",
-                                           "album_cover_640x640"
-                                           ]]
-        filtered_df['is_favorite'] = filtered_df['track_id'].isin(favorite_track_ids)
-        
-        # Pagination
-        total_songs = filtered_df['track_id'].nunique()
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        
-        # Ensure the end index does not exceed the total number of songs
-        paginated_songs = filtered_df.iloc[start_idx:end_idx].to_dict(orient='records')
-        
-        return Response({
-            "songs": paginated_songs,
-            "page": page,
-            "page_size": page_size,
-            "total_songs": total_songs
-        }, status=status.HTTP_200_OK)
+    def get(self, request):
+        catalog = get_catalog()
+        if catalog is None:
+            return Response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Counts don't depend on favorites, only on the catalog and filters
+        tag = etags.etag(request, catalog, None, request.accepted_renderer.format)
+        if etags.matches(request, tag):
+            return etags.tag(Response(status=status.HTTP_304_NOT_MODIFIED), tag)
+
+        limit = int_param(request.query_params, 'limit', 20)
+        if limit is None:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(max(limit, 1), 500)
+
+        # Counts per year, genre and artist for the same filters as Discover
+        try:
+            positions = discover_positions(catalog, request.query_params)
+        except InvalidQuery as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        with stage('facets'):
+            facets = catalog.facets.counts(positions, limit)
+        return etags.tag(Response(facets, status=status.HTTP_200_OK), tag)
 
 class FavoritesListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Retrieve user's favorites track IDs
-        favorite_track_ids = Favorite.objects.filter(user=request.user).values_list('track_id', flat=True)
+        # Shared read-only catalog, no copy
+        catalog = get_catalog()
+        if catalog is None:
+            return Response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        tag = etags.etag(request, catalog, favorites.version(request.user.id), request.accepted_renderer.format)
+        if etags.matches(request, tag):
+            return etags.tag(Response(status=status.HTTP_304_NOT_MODIFIED), tag)
+
+        # User's favorites in catalog order, same fields as other endpoints
+        # but without the is_favorite flag; no query on a cache hit
+        user_favorites = favorites.favorite_positions(request.user.id, catalog)
+        return etags.tag(Response(SongList(catalog, user_favorites), status=status.HTTP_200_OK), tag)
+
+
+class RecommendationsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        catalog = get_catalog()
+        if catalog is None:
+            return Response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Retrieve the dataset from cache
-        songs_df: pd.DataFrame = cache.get('songs_df')
-        if songs_df is None:
+        n_recommendations = int_param(request.query_params, 'n', 10)
+        if n_recommendations is None or n_recommendations < 1:
+            return Response({"error": "n must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+        n_recommendations = min(n_recommendations, 100)
+
+        # Served from the user's persisted taste model, no refitting here
+        positions = recommender.recommend(request.user.id, catalog, n_recommendations)
+
+        # Favorites are excluded from recommendations
+        return Response(SongList(catalog, positions, flag=False), status=status.HTTP_200_OK)
+
+
+class SimilarView(APIView):
+    """
+    Nearest neighbours by audio features.
+
+    - ``similar/<track_id>/``: songs like one track
+    - ``similar/?track_ids=a,b,c``: songs like each of several tracks, in one pass
+    - ``similar/?mode=favorites``: songs like the centroid of the user's favorites
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, track_id=None):
+        catalog = get_catalog()
+        if catalog is None:
             return Response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Filter dataset to include only user's favorite tracks
-        favorite_songs_df = songs_df[songs_df['track_id'].isin(favorite_track_ids)]
+        k = int_param(request.query_params, 'k', 10)
+        if k is None:
+            return Response({"error": "k must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        k = min(k, 100)
+        index = catalog.similarity_index
+        user_favorites = favorites.favorite_positions(request.user.id, catalog)
+
+        if request.query_params.get('mode') == 'favorites':
+            if not len(user_favorites):
+                return Response([], status=status.HTTP_200_OK)
+            found, distances = index.similar_to_centroid(user_favorites, k)
+            found = found[np.isfinite(distances)]
+            return Response(SongList(catalog, found, user_favorites), status=status.HTTP_200_OK)
+
+        if track_id is not None:
+            track_ids = [track_id]
+        else:
+            track_ids = [t for t in request.query_params.get('track_ids', '').split(',') if t]
+        if not track_ids:
+            return Response({"error": "No track_id provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = catalog.track_positions.find(track_ids)
+        known = [t for t, row in zip(track_ids, rows.tolist()) if row >= 0]
+        if track_id is not None and not known:
+            return Response({"error": "Track not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # All query tracks share each pass over the feature matrix
+        found, distances = index.similar_to(rows[rows >= 0].tolist(), k)
+        results = {
+            t: SongList(catalog, row[np.isfinite(dist)], user_favorites)
+            for t, row, dist in zip(known, found, distances)
+        }
+        if track_id is not None:
+            return Response(results[track_id], status=status.HTTP_200_OK)
+        results.update({t: None for t, row in zip(track_ids, rows.tolist()) if row < 0})
+        return Response(results, status=status.HTTP_200_OK)
+
+
+class CatalogStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        catalog = get_catalog()
+        return Response({
+            "catalog": catalog.stats() if catalog else None,
+            "prompt_cache": prompt_cache().stats(),
+            "worker_pool": workers.worker_pool().stats(),
+            "reloader": reloader.reloader().stats(),
+        }, status=status.HTTP_200_OK)
+
+
+class CatalogReloadView(APIView):
+    permission_classes = [IsAdminUser]
 
-        # Format response data similar to other endpoints
-        favorite_songs = favorite_songs_df[[
-            "track_id", 
-            "track_name", 
-            "artist_names", 
-            "album_name", 
-            "year", 
-            "duration_ms", 
-            "album_cover_64x64", 
-            "album_cover_640x640"
-        ]].to_dict(orient='records')
+    def post(self, request):
+        # Builds on the reloader thread; poll catalog/stats/ for the result
+        reloader.reloader().start().request()
+        return Response({"detail": "Reload requested."}, status=status.HTTP_202_ACCEPTED)
 
-        return Response(favorite_songs, status=status.HTTP_200_OK)
+
+class TimingView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Per-endpoint stage percentiles collected by ServerTimingMiddleware
+        return Response({
+            "enabled": timing.enabled(),
+            "endpoints": timing.registry.snapshot(),
+        }, status=status.HTTP_200_OK)
+
+    def delete(self, request):
+        timing.registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class AddFavoriteView(APIView):
@@ -191,15 +365,20 @@ class AddFavoriteView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        favorite, created = Favorite.objects.get_or_create(
-            user=request.user,
-            track_id=track_id,
-            defaults={
-                'track_name': track_name,
-            }
-        )
+        # favorites_changed() below writes the change through
+        with favorites.write_through():
+            favorite, created = Favorite.objects.get_or_create(
+                user=request.user,
+                track_id=track_id,
+                defaults={
+                    'track_name': track_name,
+                }
+            )
 
         if created:
+            # Update the favorites cache and fold the new favorite into the
+            # user's taste model
+            favorites_changed(request.user.id, get_catalog(), added=[track_id])
             return Response({"message": "Favorite added successfully"}, status=status.HTTP_201_CREATED)
         else:
             return Response({"message": "Item already in favorites"}, status=status.HTTP_200_OK)
@@ -210,7 +389,89 @@ class RemoveFavoriteView(APIView):
     def delete(self, request, track_id):
         try:
             favorite = Favorite.objects.get(user=request.user, track_id=track_id)
-            favorite.delete()
+            with favorites.write_through():
+                favorite.delete()
+            favorites_changed(request.user.id, get_catalog(), removed=[track_id])
             return Response({"message": "Favorite removed successfully"}, status=status.HTTP_200_OK)
         except Favorite.DoesNotExist:
             return Response({"error": "Favorite item not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class BulkFavoritesView(APIView):
+    """
+    Add (POST) or remove (DELETE) many favorites at once.
+
+    Body: ``{"track_ids": [...]}``. Every id gets a status in the response:
+    ``created``/``exists``/``not_found`` when adding, ``removed``/``not_found``
+    when removing. All writes happen in one transaction.
+    """
+    permission_classes = [IsAuthenticated]
+    max_items = 5000
+
+    def _track_ids(self, request):
+        # e.g. a bare JSON list instead of an object
+        track_ids = request.data.get("track_ids") if isinstance(request.data, dict) else None
+        if not isinstance(track_ids, list) or not track_ids or not all(isinstance(t, str) and t for t in track_ids):
+            return None, Response({"error": "track_ids must be a non-empty list of track IDs"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(track_ids) > self.max_items:
+            return None, Response({"error": f"At most {self.max_items} track IDs per request"}, status=status.HTTP_400_BAD_REQUEST)
+        # Keep request order, drop repeats
+        return list(dict.fromkeys(track_ids)), None
+
+    def _summary(self, statuses):
+        counts = {}
+        for item_status in statuses.values():
+            counts[item_status] = counts.get(item_status, 0) + 1
+        return {
+            "results": [{"track_id": t, "status": s} for t, s in statuses.items()],
+            "counts": counts,
+        }
+
+    def post(self, request):
+        track_ids, error = self._track_ids(request)
+        if error:
+            return error
+
+        catalog = get_catalog()
+        if catalog is None:
+            return Response({"error": "Dataset is not available"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Validate against the catalog index, names come from the catalog too
+        rows = catalog.track_positions.find(track_ids)
+        known = [t for t, row in zip(track_ids, rows.tolist()) if row >= 0]
+        names = catalog.store['track_name'].decode(rows[rows >= 0]).tolist()
+
+        with transaction.atomic():
+            existing = set(
+                Favorite.objects.filter(user=request.user, track_id__in=known).values_list('track_id', flat=True)
+            )
+            new = [
+                Favorite(user=request.user, track_id=t, track_name=name)
+                for t, name in zip(known, names) if t not in existing
+            ]
+            Favorite.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+
+        created = [f.track_id for f in new]
+        if created:
+            favorites_changed(request.user.id, catalog, added=created)
+
+        statuses = {t: "not_found" for t in track_ids}
+        statuses.update({t: "exists" if t in existing else "created" for t in known})
+        return Response(self._summary(statuses), status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def delete(self, request):
+        track_ids, error = self._track_ids(request)
+        if error:
+            return error
+
+        # No catalog check, favorites of tracks no longer in it can still go
+        with transaction.atomic(), favorites.write_through():
+            query = Favorite.objects.filter(user=request.user, track_id__in=track_ids)
+            removed = set(query.values_list('track_id', flat=True))
+            query.delete()
+
+        if removed:
+            favorites_changed(request.user.id, get_catalog(), removed=list(removed))
+
+        statuses = {t: "removed" if t in removed else "not_found" for t in track_ids}
+        return Response(self._summary(statuses), status=status.HTTP_200_OK)
@@ -0,0 +1,295 @@
+"""
+Process pool for CPU-heavy catalog work (prompt scoring and filtering,
+taste model fitting and scoring).
+
+Each worker process loads the catalog once when it starts (memory-mapping the
+compiled copy, so the pages are shared with the web workers) and then runs
+small jobs: a job is a name from ``JOBS`` plus a few small arguments, e.g. a
+parsed prompt or a model state and favorite positions, never the catalog
+itself. Jobs carry the catalog version; a worker whose catalog is older
+reloads it, and if it still does not match the job runs in-process instead.
+
+Configured by ``WORKER_POOL``:
+
+* ``MODE``: ``'inline'`` (run jobs in the calling process, the default) or
+  ``'process'``
+* ``WORKERS``: number of processes
+* ``MAX_PENDING``: jobs queued or running at once; beyond that a request
+  waits up to ``QUEUE_WAIT`` seconds for a slot, then gets a 503 (``PoolBusy``)
+* ``TIMEOUT``: seconds a request waits for its job before a 504 (``JobTimeout``)
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import timing
+from .executor import run_cpu
+
+# Job name -> function(catalog, *args)
+JOBS = {
+    'prompt': 'api.prompthandler.intent_positions',
+    'fit': 'api.recommender.fit_state',
+    'rank': 'api.recommender.rank',
+}
+
+
+class PoolBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many requests in progress, try again shortly."
+    default_code = 'pool_busy'
+    # DRF turns this into a Retry-After header
+    wait = 1
+
+
+class JobTimeout(APIException):
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = "The request took too long to process."
+    default_code = 'job_timeout'
+
+
+class StaleCatalog(Exception):
+    """The worker could not load the catalog version the job was made for."""
+
+
+def _call(name, catalog, args):
+    return import_string(JOBS[name])(catalog, *args)
+
+
+# Worker process side
+
+WORKER_ENV = 'API_POOL_WORKER'
+
+
+# Catalog versions this worker failed to load, so they are not retried per job
+_unavailable = set()
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    # Workers follow the web process's catalog, they don't watch for reloads
+    os.environ[WORKER_ENV] = '1'
+
+    import django
+    django.setup()
+    from .catalog import load_catalog
+    load_catalog()
+
+
+def _execute(version, name, args, timed=False):
+    from .catalog import get_catalog, load_catalog
+    catalog = get_catalog()
+    if catalog is None or catalog.version != version:
+        if version in _unavailable:
+            raise StaleCatalog(version)
+        catalog = load_catalog(force=True)
+        if catalog.version != version:
+            _unavailable.add(version)
+            raise StaleCatalog(version)
+    if not timed:
+        return _call(name, catalog, args)
+    # Time the job's stages here and send them back with the result
+    token = timing.start()
+    try:
+        result = _call(name, catalog, args)
+    finally:
+        stages = timing.stop(token).stages
+    return result, stages
+
+
+# Web process side
+
+class WorkerPool:
+    def __init__(self, mode='inline', workers=2, max_pending=16, queue_wait=0.5, timeout=10, start_method='spawn'):
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_wait = queue_wait
+        self.timeout = timeout
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.submitted = self.completed = self.rejected = self.timeouts = self.fallbacks = self.restarts = 0
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=_init_worker,
+            initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', ''),),
+        )
+
+    def _spin_up(self, executor):
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._new_executor()
+        return self._executor
+
+    def start(self):
+        """Start the worker processes now rather than on the first job."""
+        if self.mode == 'process':
+            self._spin_up(self.executor)
+        return self
+
+    def restart(self):
+        """
+        Replace the worker processes with fresh ones, which load the catalog
+        currently on disk. Jobs already running on the old processes finish.
+        """
+        if self.mode != 'process' or self._executor is None:
+            # Never started, the first job will start it on the new catalog
+            return self
+        # Jobs keep going to the old processes until the new ones are up
+        executor = self._new_executor()
+        self._spin_up(executor)
+        with self._lock:
+            previous, self._executor = self._executor, executor
+        self.restarts += 1
+        if previous is not None:
+            previous.shutdown(wait=False)
+        return self
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, name, catalog, args, wait):
+        acquired = self._slots.acquire(timeout=wait) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            self.rejected += 1
+            raise PoolBusy()
+        try:
+            future = self._submit_job(_execute, catalog.version, name, args, timing.current() is not None)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.submitted += 1
+        # The slot is held until the job really ends, even after a timeout,
+        # so runaway jobs still count against MAX_PENDING
+        future.add_done_callback(self._done)
+        return future
+
+    def _submit_job(self, *job):
+        executor = self.executor
+        try:
+            return executor.submit(*job)
+        except BrokenProcessPool:
+            raise
+        except RuntimeError:
+            # restart() shut this executor down after we picked it up; its
+            # replacement is already installed
+            if self._executor is executor:
+                raise
+            return self.executor.submit(*job)
+
+    def _done(self, future):
+        self.completed += 1
+        self._slots.release()
+
+    def _fallback(self, name, catalog, args, error):
+        self.fallbacks += 1
+        if isinstance(error, BrokenProcessPool):
+            # A worker died; start a fresh pool for the next job
+            self.shutdown()
+        return _call(name, catalog, args)
+
+    def _result(self, result):
+        # Timed jobs return their worker-side stages along with the result
+        timings = timing.current()
+        if timings is None:
+            return result
+        result, stages = result
+        timings.merge(stages)
+        return result
+
+    def run(self, name, catalog, *args):
+        """Run job ``name`` for ``catalog`` and return its result."""
+        if self.mode != 'process':
+            return _call(name, catalog, args)
+        try:
+            with timing.stage('pool'):
+                result = self._submit(name, catalog, args, self.queue_wait).result(self.timeout)
+            return self._result(result)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            raise JobTimeout()
+        except (StaleCatalog, BrokenProcessPool) as e:
+            return self._fallback(name, catalog, args, e)
+
+    async def arun(self, name, catalog, *args):
+        """``run()`` for async views; never blocks the event loop."""
+        if self.mode != 'process':
+            return await run_cpu(_call, name, catalog, args)
+        try:
+            # No waiting for a slot here, that would block the loop
+            with timing.stage('pool'):
+                future = self._submit(name, catalog, args, wait=None)
+                result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            return self._result(result)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise JobTimeout()
+        except (StaleCatalog, BrokenProcessPool) as e:
+            return await run_cpu(self._fallback, name, catalog, args, e)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "timeout": self.timeout,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "pending": self.submitted - self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "fallbacks": self.fallbacks,
+            "restarts": self.restarts,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def worker_pool():
+    """The process-wide pool, configured by ``WORKER_POOL``."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                options = getattr(settings, 'WORKER_POOL', {})
+                _pool = WorkerPool(
+                    mode=options.get('MODE', 'inline'),
+                    workers=options.get('WORKERS', 2),
+                    max_pending=options.get('MAX_PENDING', 16),
+                    queue_wait=options.get('QUEUE_WAIT', 0.5),
+                    timeout=options.get('TIMEOUT', 10),
+                    start_method=options.get('START_METHOD', 'spawn'),
+                )
+    return _pool
+
+
+def run(name, catalog, *args):
+    return worker_pool().run(name, catalog, *args)
+
+
+async def arun(name, catalog, *args):
+    return await worker_pool().arun(name, catalog, *args)